@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量转换的任务执行
+
+各批量脚本负责扫描输入、决定输出路径和打印结果，这里只负责按顺序
+或在进程池中执行转换。
+
+指定单个文件的时间上限或内存上限时，每个转换在一个新的隔离工作进程
+中执行。超过任一上限的工作进程被终止，该文件记为失败并附带原因，
+后续文件换用新的工作进程继续处理。内存上限按工作进程的常驻内存
+检查（Linux），同时用 RLIMIT_AS 限制地址空间的增长，使检查间隔内的
+快速分配也会失败。
+"""
+
+import time
+import argparse
+import multiprocessing
+from multiprocessing.connection import wait as wait_connections
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from memory_budget import format_size, limit_address_space, parse_size, peak_address_space, process_rss
+from xml_sources import load_sources
+
+# 隔离执行时检查工作进程的间隔（秒）
+WATCH_INTERVAL = 0.2
+
+def _call(convert, source, output_path):
+    """执行单个转换，把异常转换为失败结果，并附带转换用时（秒）"""
+    started = time.perf_counter()
+    try:
+        success, message = convert(source, output_path)
+    except MemoryError:
+        success, message = False, "处理文件时发生错误 - 内存不足"
+    except Exception as e:
+        success, message = False, f"处理文件时发生错误 - {str(e)}"
+    return success, message, time.perf_counter() - started
+
+def _isolated_call(conn, convert, source, output_path, memory_limit):
+    """在隔离的工作进程中执行单个转换，结果通过管道返回"""
+    address_limit = limit_address_space(memory_limit) if memory_limit else None
+    success, message, seconds = _call(convert, source, output_path)
+    if not success and address_limit:
+        # 转换函数自己捕获了 MemoryError 时信息中没有原因，按地址空间峰值判断
+        peak = peak_address_space()
+        if peak is not None and peak >= address_limit * 0.95:
+            message = f"内存超出上限 {format_size(memory_limit)}：{message}"
+    conn.send((success, message, seconds))
+    conn.close()
+
+def _exit_reason(process):
+    """工作进程没有返回结果就退出时的失败原因"""
+    if process.exitcode is not None and process.exitcode < 0:
+        return f"工作进程异常退出（信号 {-process.exitcode}），可能内存不足"
+    return f"工作进程异常退出（退出码 {process.exitcode}）"
+
+def _run_isolated(sources, convert, jobs, timeout, memory_limit):
+    """
+    每个任务在新的工作进程中执行，超时或超出内存上限时终止该进程
+
+    Yields:
+        (task, (success, message, seconds))，按完成顺序
+    """
+    context = multiprocessing.get_context()
+    sources = iter(sources)
+    running = {}
+    exhausted = False
+
+    try:
+        while True:
+            # 最多同时运行 jobs 个工作进程，完成一个才取下一个任务
+            while not exhausted and len(running) < jobs:
+                try:
+                    task, source = next(sources)
+                except StopIteration:
+                    exhausted = True
+                    break
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_isolated_call, daemon=True,
+                                          args=(sender, convert, source, task[1], memory_limit))
+                process.start()
+                sender.close()
+                running[receiver] = (task, process, time.perf_counter())
+            if not running:
+                return
+
+            ready = wait_connections(list(running), timeout=WATCH_INTERVAL)
+            now = time.perf_counter()
+            for conn in list(running):
+                task, process, started = running[conn]
+                result = None
+                if conn in ready:
+                    try:
+                        result = conn.recv()
+                    except EOFError:
+                        process.join()
+                        result = (False, _exit_reason(process), now - started)
+                elif timeout and now - started > timeout:
+                    result = (False, f"处理超时：超过 {timeout:g} 秒，已终止", now - started)
+                elif memory_limit:
+                    rss = process_rss(process.pid)
+                    if rss is not None and rss > memory_limit:
+                        result = (False, f"内存超出上限：{format_size(rss)} > {format_size(memory_limit)}，已终止",
+                                  now - started)
+                if result is None:
+                    continue
+
+                if process.is_alive():
+                    process.kill()
+                process.join()
+                conn.close()
+                del running[conn]
+                yield task, result
+    finally:
+        for conn, (task, process, started) in running.items():
+            process.kill()
+            process.join()
+            conn.close()
+
+def run_conversions(tasks, convert, jobs=1, timed=False, timeout=None, memory_limit=None):
+    """
+    执行转换任务并产出结果
+
+    tasks 会被惰性消费：顺序执行时每完成一个任务才取下一个，因此调用方
+    可以在生成任务时检查前面任务的输出是否已经存在。
+
+    Args:
+        tasks: 可迭代的 (XmlInput, 输出路径)
+        convert: 模块级函数 convert(source, output_path) -> (bool, str)，
+                 source 为 XmlInput 或已读取的字节内容（tar 成员）
+        jobs: 并行进程数，1 表示在当前进程中顺序执行
+        timed: 是否在结果中附带转换用时（在执行转换的进程中测量）
+        timeout: 单个文件的转换时间上限（秒）
+        memory_limit: 单个工作进程的内存上限（字节）
+                      指定 timeout 或 memory_limit 时每个转换在新的隔离工作进程中执行
+    Yields:
+        (task, success, message)，timed 时为 (task, success, message, seconds)；
+        顺序执行时按任务顺序，并行时按完成顺序
+    """
+    sources = load_sources(tasks)
+
+    if timeout or memory_limit:
+        for task, result in _run_isolated(sources, convert, max(jobs, 1), timeout, memory_limit):
+            yield (task,) + (result if timed else result[:2])
+        return
+
+    if jobs <= 1:
+        for task, source in sources:
+            result = _call(convert, source, task[1])
+            yield (task,) + (result if timed else result[:2])
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = {}
+
+        def finished(futures):
+            for future in futures:
+                task = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = (False, f"处理文件时发生错误 - {str(e)}", None)
+                yield (task,) + (result if timed else result[:2])
+
+        for task, source in sources:
+            pending[executor.submit(_call, convert, source, task[1])] = task
+            # 限制已提交但未完成的任务数，避免提前读入过多 tar 成员
+            if len(pending) >= jobs * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+
+def _positive_size(text):
+    try:
+        size = parse_size(text)
+    except ValueError:
+        size = 0
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"无效的大小: {text}")
+    return size
+
+def add_isolation_arguments(parser):
+    """向批量脚本的参数解析器添加 --timeout 和 --worker-memory"""
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='单个文件的转换时间上限（秒），超时的工作进程被终止并记为失败')
+    parser.add_argument('--worker-memory', type=_positive_size, default=None,
+                        help='单个工作进程的内存上限，如 2G；超出时终止并记为失败')
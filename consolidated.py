@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+把批量转换的所有采集合并为一个分区数据集
+
+合并模式不再为每个输入写一个CSV，而是把所有采集的记录写入按第一级
+目录分区的数据集，每行前面加上来源文件和快照时间两列：
+
+    输出目录/<分区>.csv[.gz]
+
+转换时每个工作进程只追加写自己的分片文件，不需要任何锁：
+
+    输出目录/_parts/<分区>/part-<进程号>.csv[.gz]    记录（不带表头）
+    输出目录/_parts/<分区>/part-<进程号>.index       每个采集一行：序号、起止位置
+
+一个采集的记录写完并刷新后才在索引中登记；写入失败时截断回写入前的
+位置，被终止的工作进程留下的半截数据没有登记。所有转换结束后按采集
+的序号把登记的字节范围依次复制到分区文件（表头另写一段），只是顺序
+复制，不再解析XML，结果与并行进程数无关。压缩输出时每个采集是一个
+独立的压缩段，gzip、bz2 和 xz 都允许多段直接拼接。
+"""
+
+import os
+import re
+import csv
+import glob
+import shutil
+from datetime import datetime
+
+from csv_output import open_csv_output, output_suffix
+
+# 分片文件所在的子目录
+PARTS_DIR = '_parts'
+
+# 每行前面增加的列
+SOURCE_COLUMNS = ['SourceFile', 'Snapshot']
+
+# 复制字节范围时每次读取的大小
+COPY_CHUNK_SIZE = 1 << 20
+
+# 文件名中的日期（可带时间），如 20240101、20240101-0830、20240101T083000
+_SNAPSHOT = re.compile(r'((?:19|20)\d{2})(\d{2})(\d{2})(?:[T_-]?(\d{2})(\d{2})(\d{2})?)?')
+
+def snapshot_of(xml_input):
+    """
+    采集的快照时间
+
+    取文件名中的日期时间；文件名中没有日期时取文件（归档成员取归档）的修改时间。
+
+    Returns:
+        ISO 格式的日期或日期时间
+    """
+    name = os.path.basename(xml_input.rel_path)
+    match = _SNAPSHOT.search(name)
+    if match is not None:
+        year, month, day, hour, minute, second = match.groups()
+        try:
+            if hour is None:
+                return datetime(int(year), int(month), int(day)).date().isoformat()
+            return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                            int(second or 0)).isoformat()
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(xml_input.path)).isoformat(timespec='seconds')
+
+class PartTarget(str):
+    """
+    一个采集在合并输出中的写入目标
+
+    字符串值为该采集所属分区的数据集文件路径（用于显示和运行报告），
+    并附带写入分片文件所需的信息。
+
+    Attributes:
+        parts_dir: 分区的分片目录
+        number: 采集的序号，决定最终拼接的顺序
+        source_file: SourceFile 列的值
+        snapshot: Snapshot 列的值
+    """
+
+    def __new__(cls, dataset_file, parts_dir, number, source_file, snapshot):
+        target = super().__new__(cls, dataset_file)
+        target.parts_dir = parts_dir
+        target.number = number
+        target.source_file = source_file
+        target.snapshot = snapshot
+        return target
+
+    def __reduce__(self):
+        return PartTarget, (str(self), self.parts_dir, self.number, self.source_file, self.snapshot)
+
+def append_capture(target, rows, compression=None, compresslevel=None):
+    """
+    把一个采集的记录追加到当前工作进程的分片文件
+
+    Args:
+        target: PartTarget
+        rows: 记录元组的可迭代对象（不含来源列）
+        compression: 压缩格式
+        compresslevel: 压缩级别
+    Returns:
+        写入的记录数
+    """
+    os.makedirs(target.parts_dir, exist_ok=True)
+    stem = os.path.join(target.parts_dir, f"part-{os.getpid()}")
+    prefix = (target.source_file, target.snapshot)
+    count = 0
+    with open(stem + '.csv' + output_suffix(compression), 'ab') as f:
+        start = f.tell()
+        try:
+            # 分片中的记录不带 BOM，BOM 只在分区文件的表头中出现一次
+            with open_csv_output(f, compression, compresslevel, encoding='utf-8') as text:
+                writer = csv.writer(text)
+                for row in rows:
+                    writer.writerow(prefix + row)
+                    count += 1
+            end = f.tell()
+        except BaseException:
+            f.truncate(start)
+            raise
+    with open(stem + '.index', 'a', encoding='utf-8') as index:
+        index.write(f"{target.number}\t{start}\t{end}\n")
+    return count
+
+def _segments(partition_dir, compression):
+    """读取分区中各分片文件登记的字节范围，按采集序号排列"""
+    segments = []
+    for index_path in glob.glob(os.path.join(partition_dir, 'part-*.index')):
+        data_path = index_path[:-len('.index')] + '.csv' + output_suffix(compression)
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                number, start, end = (int(value) for value in line.split('\t'))
+                segments.append((number, data_path, start, end))
+    segments.sort()
+    return segments
+
+def _copy_range(source, out, start, end):
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise IOError(f"分片文件被截断: {source.name}")
+        out.write(chunk)
+        remaining -= len(chunk)
+
+def finalize_dataset(output_dir, header, compression=None, compresslevel=None):
+    """
+    把各分区的分片文件拼接为分区文件，然后删除分片目录
+
+    Args:
+        output_dir: 输出目录
+        header: 表头（含来源列）
+        compression: 压缩格式，与写分片时相同
+        compresslevel: 压缩级别
+    Returns:
+        [(分区文件路径, 采集数), ...]；没有任何登记记录的分区不生成文件
+    """
+    parts_root = os.path.join(output_dir, PARTS_DIR)
+    if not os.path.isdir(parts_root):
+        return []
+    written = []
+    for partition in sorted(os.listdir(parts_root)):
+        segments = _segments(os.path.join(parts_root, partition), compression)
+        if not segments:
+            continue
+        dataset_file = os.path.join(output_dir, partition + '.csv' + output_suffix(compression))
+        temp_path = dataset_file + '.tmp'
+        sources = {}
+        try:
+            with open(temp_path, 'wb') as out:
+                with open_csv_output(out, compression, compresslevel) as text:
+                    csv.writer(text).writerow(header)
+                for _, data_path, start, end in segments:
+                    if data_path not in sources:
+                        sources[data_path] = open(data_path, 'rb')
+                    _copy_range(sources[data_path], out, start, end)
+        finally:
+            for source in sources.values():
+                source.close()
+        os.replace(temp_path, dataset_file)
+        written.append((dataset_file, len(segments)))
+    shutil.rmtree(parts_root)
+    return written
+
+def reset_parts(output_dir):
+    """删除上次中断的运行留下的分片目录"""
+    shutil.rmtree(os.path.join(output_dir, PARTS_DIR), ignore_errors=True)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CSV输出目标
+
+支持写入文件路径、标准输出 ('-') 或已打开的文件对象，可选 gzip / bz2 / xz
+压缩。所有输出都经过一个较大的缓冲区，避免大量小的写系统调用。
+"""
+
+import io
+import os
+import bz2
+import sys
+import gzip
+import lzma
+from contextlib import contextmanager
+
+# 输出缓冲区大小
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# 压缩格式对应的文件后缀和默认压缩级别
+COMPRESSIONS = {
+    'gz': ('.gz', 6),
+    'bz2': ('.bz2', 9),
+    'xz': ('.xz', 6),
+}
+
+# 与原来的输出保持一致，带BOM以便Excel直接打开
+CSV_ENCODING = 'utf-8-sig'
+
+def output_suffix(compression):
+    """压缩格式对应的文件后缀，不压缩时为 ''"""
+    if not compression:
+        return ''
+    return COMPRESSIONS[compression][0]
+
+def compression_from_path(path):
+    """根据文件后缀推断压缩格式"""
+    lower = os.fspath(path).lower()
+    for name, (suffix, level) in COMPRESSIONS.items():
+        if lower.endswith(suffix):
+            return name
+    return None
+
+def _compressor(f, compression, compresslevel):
+    """为二进制输出流套上压缩层（关闭时不会关闭 f）"""
+    if compresslevel is None:
+        compresslevel = COMPRESSIONS[compression][1]
+    if compression == 'gz':
+        return gzip.GzipFile(fileobj=f, mode='wb', compresslevel=compresslevel)
+    if compression == 'bz2':
+        return bz2.BZ2File(f, 'wb', compresslevel=compresslevel)
+    return lzma.LZMAFile(f, 'wb', preset=compresslevel)
+
+@contextmanager
+def open_csv_output(target, compression=None, compresslevel=None, buffer_size=DEFAULT_BUFFER_SIZE,
+                    encoding=CSV_ENCODING):
+    """
+    打开CSV输出，产出可直接交给 csv.writer 的文本流
+
+    Args:
+        target: 输出文件路径、'-'（标准输出）、二进制或文本文件对象
+        compression: None、'gz'、'bz2' 或 'xz'；目标为路径且未指定时按后缀推断
+        compresslevel: 压缩级别，默认 gz/xz 为 6，bz2 为 9
+        buffer_size: 输出缓冲区大小
+        encoding: 文本编码，默认带BOM；追加到已有内容之后时用 'utf-8'
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"不支持的压缩格式: {compression}，可选: {', '.join(COMPRESSIONS)}")
+
+    owns_target = False
+    if isinstance(target, (str, bytes, os.PathLike)) and os.fspath(target) not in ('-', b'-'):
+        if compression is None:
+            compression = compression_from_path(target)
+        raw = open(target, 'wb', buffering=buffer_size)
+        owns_target = True
+    elif isinstance(target, (str, bytes)):
+        raw = sys.stdout.buffer
+    elif isinstance(target, io.TextIOBase):
+        # 文本流无法再套压缩层，直接写入
+        if compression:
+            raise ValueError("文本文件对象不支持压缩输出，请传入二进制文件对象")
+        yield target
+        target.flush()
+        return
+    else:
+        raw = target
+
+    layers = []
+    stream = raw
+    if compression:
+        stream = _compressor(raw, compression, compresslevel)
+        layers.append(stream)
+        stream = io.BufferedWriter(stream, buffer_size)
+        layers.append(stream)
+    elif not owns_target:
+        stream = io.BufferedWriter(_Unclosable(raw), buffer_size)
+        layers.append(stream)
+
+    text = io.TextIOWrapper(stream, encoding=encoding, newline='', write_through=False)
+    try:
+        yield text
+        text.flush()
+    finally:
+        # 依次关闭文本层、缓冲层和压缩层，只有自己打开的文件才真正关闭
+        text.detach()
+        for layer in reversed(layers):
+            layer.close()
+        if owns_target:
+            raw.close()
+        else:
+            raw.flush()
+
+class _Unclosable(io.RawIOBase):
+    """包装调用方传入的二进制流，关闭时只刷新不关闭"""
+
+    def __init__(self, f):
+        self._f = f
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._f.write(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._f.flush()
+        super().close()
@@ -3,10 +3,15 @@
 
 import pandas as pd
 import sys
+from xlsx_grouping import DEFAULT_GROUPING, GROUPINGS, apply_grouping, check_grouping
+from xml_frame import group_runs
 
-def merge_cells_in_xlsx(csv_file, xlsx_file):
+def merge_cells_in_xlsx(csv_file, xlsx_file, grouping=DEFAULT_GROUPING):
     """
     读取CSV文件并将相同名称和IP地址的单元格合并到Excel文件中
+    
+    grouping 为 'block'、'outline' 或 'band' 时改用更轻量的分组方式，
+    见 xlsx_grouping。
     """
     try:
         # 读取CSV文件
@@ -21,41 +26,15 @@ def merge_cells_in_xlsx(csv_file, xlsx_file):
         # 获取工作表
         worksheet = writer.sheets['Sheet1']
         
-        # 跟踪需要合并的单元格范围
-        merge_ranges = {}
-        current_key = None
-        start_row = None
-        
-        # 从第2行开始遍历(跳过标题行)
-        for row in range(2, len(df) + 2):
-            name = worksheet.cell(row=row, column=1).value
-            ip = worksheet.cell(row=row, column=2).value
-            key = f"{name}_{ip}"
-            
-            if current_key is None:
-                current_key = key
-                start_row = row
-            elif key != current_key:
-                # 如果key变化,合并之前的单元格
-                if row - start_row > 1:
-                    for col in range(1, 7):  # 合并前6列
-                        merge_ranges[(start_row, col)] = (row-1, col)
-                current_key = key
-                start_row = row
+        check_grouping(grouping)
         
-        # 处理最后一组
-        if start_row and row - start_row > 0:
-            for col in range(1, 7):
-                merge_ranges[(start_row, col)] = (row, col)
+        # 在 DataFrame 上向量化计算每组相同名称和IP地址的行范围（从第2行开始，跳过标题行）
+        # 空值转为字符串后彼此相等，与逐个单元格比较时相同
+        keys = list(df.columns[:2])
+        groups = group_runs(df[keys].astype(str), keys)
         
-        # 执行单元格合并
-        for start, end in merge_ranges.items():
-            worksheet.merge_cells(
-                start_row=start[0],
-                start_column=start[1],
-                end_row=end[0],
-                end_column=end[1]
-            )
+        # 按组合并前6列（或使用其他分组方式）
+        apply_grouping(worksheet, groups, list(range(1, 7)), grouping)
             
         # 保存文件
         writer.close()  # 使用close()方法保存并关闭writer对象
@@ -65,14 +44,15 @@ def merge_cells_in_xlsx(csv_file, xlsx_file):
         return False, f"处理失败: {str(e)}"
 
 def main():
-    if len(sys.argv) != 3:
-        print("用法: python csv2xlsx.py <输入CSV文件> <输出XLSX文件>")
+    if len(sys.argv) not in (3, 4) or (len(sys.argv) == 4 and sys.argv[3] not in GROUPINGS):
+        print(f"用法: python csv2xlsx.py <输入CSV文件> <输出XLSX文件> [{'|'.join(GROUPINGS)}]")
         sys.exit(1)
         
     csv_file = sys.argv[1]
     xlsx_file = sys.argv[2]
+    grouping = sys.argv[3] if len(sys.argv) == 4 else DEFAULT_GROUPING
     
-    success, message = merge_cells_in_xlsx(csv_file, xlsx_file)
+    success, message = merge_cells_in_xlsx(csv_file, xlsx_file, grouping)
     if success:
         print(f"成功: {message}")
     else:
@@ -1,9 +1,27 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import re
 import sys
 import csv
+import heapq
+import marshal
+import struct
+import argparse
+import tempfile
+import itertools
 import xml.etree.ElementTree as ET
+from functools import partial
+from operator import itemgetter
+from xml_sources import open_input
+from memory_budget import ENGINES, PeakMemory, choose_engine, parse_size
+from model_cache import DEFAULT_CACHE_SIZE, PROFILE_RAW, ModelCache, cached_models
+from csv_output import COMPRESSIONS, open_csv_output
+from xml_backends import BACKENDS, DEFAULT_BACKEND, EntityGuard, StructureError, device_model_from_element, get_backend, iter_ports
+from xml_filter import add_filter_arguments, extraction_fields, filter_from_args
+from xml_split import map_segments, split_layout
+from xml_preview import DEFAULT_SAMPLE_BYTES, add_preview_arguments, preview_models, sample_bytes_from_args
+from sparse_csv import sparse_fieldnames, sparse_rows
 
 def validate_xml_structure(xml_file):
     """
@@ -11,7 +29,8 @@ def validate_xml_structure(xml_file):
     返回: (bool, str) - (是否有效, 错误信息)
     """
     try:
-        tree = ET.parse(xml_file)
+        with open_input(xml_file) as f:
+            tree = ET.parse(EntityGuard(f))
         root = tree.getroot()
         
         devices = root.find('DeviceCollection')
@@ -29,25 +48,26 @@ def validate_xml_structure(xml_file):
         return False, f"读取XML文件失败: {str(e)}"
 
 def extract_port_info(port):
-    """从端口元素中提取信息"""
+    """从端口字段中提取信息"""
     return {
-        'Port_ID': port.findtext('PortID', ''),
-        'Port_Desc': port.findtext('PortDesc', ''),
-        'Remote_Port_ID': port.findtext('RemotePortID', ''),
-        'Remote_Station': port.findtext('RemoteNameOfStation', ''),
-        'Remote_MAC': port.findtext('RemoteMAC', ''),
-        'Port_Status': port.findtext('OperStatus', '')
+        'Port_ID': port.get('PortID', ''),
+        'Port_Desc': port.get('PortDesc', ''),
+        'Remote_Port_ID': port.get('RemotePortID', ''),
+        'Remote_Station': port.get('RemoteNameOfStation', ''),
+        'Remote_MAC': port.get('RemoteMAC', ''),
+        'Port_Status': port.get('OperStatus', '')
     }
 
-def extract_device_info(device):
-    """从设备元素中提取信息，包括端口信息"""
+def device_records(model):
+    """从设备模型中提取信息，每个端口一条记录"""
+    device = model['device']
     base_info = {
-        'NameOfStation': device.findtext('NameOfStation', ''),
-        'IpAddress': device.findtext('IpAddress', ''),
-        'DeviceType': device.findtext('DeviceType', ''),
-        'MAC': device.findtext('MAC', ''),
-        'ManufacturerName': device.findtext('ManufacturerName', ''),
-        'RunState': device.findtext('RunState', ''),
+        'NameOfStation': device.get('NameOfStation', ''),
+        'IpAddress': device.get('IpAddress', ''),
+        'DeviceType': device.get('DeviceType', ''),
+        'MAC': device.get('MAC', ''),
+        'ManufacturerName': device.get('ManufacturerName', ''),
+        'RunState': device.get('RunState', ''),
         'Port_ID': '',
         'Port_Desc': '',
         'Remote_Port_ID': '',
@@ -56,85 +76,537 @@ def extract_device_info(device):
         'Port_Status': ''
     }
     
-    device_records = []
+    records = []
     
-    # 查找所有端口
-    interfaces = device.find('Interfaces')
-    if interfaces is not None:
-        for pn_interface in interfaces.findall('PnInterface'):
-            port_list = pn_interface.find('PortList')
-            if port_list is not None:
-                for port in port_list.findall('Port'):
-                    record = base_info.copy()
-                    port_info = extract_port_info(port)
-                    record.update(port_info)
-                    device_records.append(record)
+    # 所有端口
+    for port in iter_ports(model, direct_only=True):
+        record = base_info.copy()
+        port_info = extract_port_info(port)
+        record.update(port_info)
+        records.append(record)
     
     # 如果没有找到端口信息，至少返回设备基本信息
-    if not device_records:
-        device_records.append(base_info)
+    if not records:
+        records.append(base_info)
     
-    return device_records
+    return records
 
-def xml_to_csv(xml_file, csv_file):
-    try:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        
-        devices = root.find('DeviceCollection')
-        if devices is None:
-            raise Exception("找不到设备集合")
-            
-        # 提取所有设备和端口信息
-        all_records = []
-        for device in devices.findall('Device'):
-            device_records = extract_device_info(device)
-            all_records.extend(device_records)
+def extract_device_info(device):
+    """从设备元素中提取信息，包括端口信息"""
+    return device_records(device_model_from_element(device))
+
+# CSV输出列
+FIELDNAMES = [
+    'NameOfStation', 'IpAddress', 'DeviceType', 'MAC', 
+    'ManufacturerName', 'RunState',
+    'Port_ID', 'Port_Desc', 
+    'Remote_Port_ID', 'Remote_Station', 'Remote_MAC',
+    'Port_Status'
+]
 
-        # 按设备名称和IP地址排序
+# CSV列对应的设备模型字段：(是否为端口字段, 字段名)
+COLUMN_SOURCES = {
+    'NameOfStation': (False, 'NameOfStation'),
+    'IpAddress': (False, 'IpAddress'),
+    'DeviceType': (False, 'DeviceType'),
+    'MAC': (False, 'MAC'),
+    'ManufacturerName': (False, 'ManufacturerName'),
+    'RunState': (False, 'RunState'),
+    'Port_ID': (True, 'PortID'),
+    'Port_Desc': (True, 'PortDesc'),
+    'Remote_Port_ID': (True, 'RemotePortID'),
+    'Remote_Station': (True, 'RemoteNameOfStation'),
+    'Remote_MAC': (True, 'RemoteMAC'),
+    'Port_Status': (True, 'OperStatus'),
+}
+
+# 排序使用的列
+SORT_COLUMNS = ['NameOfStation', 'IpAddress', 'Port_ID']
+
+# 输出顺序
+#   sorted    按设备名称、IP地址和端口ID的字符串顺序（默认）
+#   natural   同上，但端口ID中的数字按数值比较，port-10 排在 port-2 之后
+#   document  按XML中的顺序边解析边写出，不排序
+ORDERS = ('sorted', 'natural', 'document')
+DEFAULT_ORDER = 'sorted'
+
+def natural_key(text):
+    """将文本拆为字符串和整数交替的元组，用于自然排序"""
+    parts = re.split(r'(\d+)', text)
+    parts[1::2] = map(int, parts[1::2])
+    return tuple(parts)
+
+def records_from_models(models, order=DEFAULT_ORDER):
+    """从设备模型提取所有设备和端口记录，并按设备名称、IP地址和端口排序"""
+    all_records = []
+    for model in models:
+        all_records.extend(device_records(model))
+
+    # 按设备名称和IP地址排序
+    if order == 'natural':
+        all_records.sort(key=lambda x: (x['NameOfStation'], x['IpAddress'], natural_key(x['Port_ID'])))
+    elif order != 'document':
         all_records.sort(key=lambda x: (x['NameOfStation'], x['IpAddress'], x['Port_ID']))
+    return all_records
 
-        # 写入CSV文件
-        if all_records:
-            fieldnames = [
-                'NameOfStation', 'IpAddress', 'DeviceType', 'MAC', 
-                'ManufacturerName', 'RunState',
-                'Port_ID', 'Port_Desc', 
-                'Remote_Port_ID', 'Remote_Station', 'Remote_MAC',
-                'Port_Status'
-            ]
-            
-            with open(csv_file, 'w', newline='', encoding='utf-8-sig') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(all_records)
-            return True, f"成功将 {len(all_records)} 条记录写入 CSV 文件"
-        else:
-            return False, "没有找到任何设备数据"
+def extract_records(root):
+    """从XML根元素提取所有设备和端口记录，并按设备名称、IP地址和端口排序"""
+    devices = root.find('DeviceCollection')
+    if devices is None:
+        raise StructureError("找不到设备集合")
+        
+    return records_from_models(device_model_from_element(device) for device in devices.findall('Device'))
+
+# 流式引擎中每条记录为按 FIELDNAMES 排列的元组，排序键为名称、IP地址和端口
+ROW_SORT_KEY = itemgetter(0, 1, 6)
+
+def device_rows(model):
+    """与 device_records 相同，但每条记录为按 FIELDNAMES 排列的元组，占用内存更少"""
+    device = model['device']
+    base_row = (
+        device.get('NameOfStation', ''),
+        device.get('IpAddress', ''),
+        device.get('DeviceType', ''),
+        device.get('MAC', ''),
+        device.get('ManufacturerName', ''),
+        device.get('RunState', ''),
+    )
+    rows = [base_row + (
+        port.get('PortID', ''),
+        port.get('PortDesc', ''),
+        port.get('RemotePortID', ''),
+        port.get('RemoteNameOfStation', ''),
+        port.get('RemoteMAC', ''),
+        port.get('OperStatus', ''),
+    ) for port in iter_ports(model, direct_only=True)]
+
+    if not rows:
+        rows.append(base_row + ('',) * 6)
+    return rows
+
+def row_builder(columns):
+    """
+    返回把设备模型转换为元组记录的函数，记录按 columns 排列
+
+    Args:
+        columns: CSV列名列表，与 FIELDNAMES 相同时使用 device_rows
+    """
+    if columns == FIELDNAMES:
+        return device_rows
+    sources = [COLUMN_SOURCES[column] for column in columns]
+
+    def rows(model):
+        device = model['device']
+        # 没有端口的设备保留一行，端口列为空
+        ports = list(iter_ports(model, direct_only=True)) or [{}]
+        return [tuple(port.get(field, '') if is_port else device.get(field, '') for is_port, field in sources)
+                for port in ports]
+    return rows
+
+def device_indexes(columns):
+    """columns 中设备字段的位置"""
+    return [index for index, column in enumerate(columns) if not COLUMN_SOURCES[column][0]]
+
+def row_sort_key(columns, order=DEFAULT_ORDER):
+    """按 columns 排列的元组记录的排序键"""
+    name, ip, port = (columns.index(column) for column in SORT_COLUMNS)
+    if order == 'natural':
+        return lambda row: (row[name], row[ip], natural_key(row[port]))
+    return itemgetter(name, ip, port)
+
+def rows_from_models(models):
+    """边解析边提取元组记录，并按设备名称、IP地址和端口排序"""
+    all_rows = []
+    for model in models:
+        all_rows.extend(device_rows(model))
+    all_rows.sort(key=ROW_SORT_KEY)
+    return all_rows
+
+def natural_row_sort_key(row):
+    """元组记录的自然排序键"""
+    return row[0], row[1], natural_key(row[6])
+
+# 外部排序中每个有序段的记录数，超过时把有序段写入临时文件
+SORT_RUN_SIZE = 100000
+
+# 临时文件中每批写入和读出的记录数，逐条调用 marshal 的开销比记录本身还大
+RUN_BATCH_SIZE = 1000
+
+# 每批记录前的长度；marshal.load 直接读文件时逐段调用 read，比先读出再 loads 慢得多
+_BATCH_LENGTH = struct.Struct('<I')
+
+def _dump_rows(rows, f):
+    """将记录分批写入临时文件"""
+    for start in range(0, len(rows), RUN_BATCH_SIZE):
+        data = marshal.dumps(rows[start:start + RUN_BATCH_SIZE])
+        f.write(_BATCH_LENGTH.pack(len(data)) + data)
+
+def _spill_run(run, key):
+    """将一个有序段写入临时文件"""
+    run.sort(key=key)
+    f = tempfile.TemporaryFile()
+    _dump_rows(run, f)
+    f.seek(0)
+    return f
+
+def _read_run(f):
+    while True:
+        header = f.read(_BATCH_LENGTH.size)
+        if not header:
+            return
+        yield from marshal.loads(f.read(_BATCH_LENGTH.unpack(header)[0]))
+
+def sort_rows(rows, key=ROW_SORT_KEY, run_size=SORT_RUN_SIZE):
+    """
+    对元组记录排序，内存中最多保留 run_size 条记录
+
+    记录数不超过 run_size 时直接在内存中排序；否则每 run_size 条排序后
+    写入临时文件，最后 k 路归并。heapq.merge 在键相同时按有序段的先后
+    输出，结果与 sorted(rows, key=key) 完全相同。
+
+    Args:
+        rows: 元组记录的可迭代对象
+        key: 排序键
+        run_size: 每个有序段的记录数
+    Yields:
+        排序后的记录
+    """
+    runs = []
+    run = []
+    try:
+        for row in rows:
+            run.append(row)
+            if len(run) >= run_size:
+                runs.append(_spill_run(run, key))
+                run = []
+        run.sort(key=key)
+        if not runs:
+            yield from run
+            return
+        yield from heapq.merge(*[_read_run(f) for f in runs], run, key=key)
+    finally:
+        for f in runs:
+            f.close()
+
+def model_rows(models, engine='tree', order=DEFAULT_ORDER, run_size=SORT_RUN_SIZE):
+    """
+    按 models_to_csv 输出的顺序产出按 FIELDNAMES 排列的元组记录
+
+    Args:
+        models: 设备模型的可迭代对象
+        engine: 'stream' 时记录过多则溢出到临时文件排序
+        order: 输出顺序，见 ORDERS
+        run_size: 外部排序每个有序段的记录数
+    """
+    rows = (row for model in models for row in device_rows(model))
+    if order == 'document':
+        return rows
+    key = natural_row_sort_key if order == 'natural' else ROW_SORT_KEY
+    if engine == 'stream':
+        return sort_rows(rows, key, run_size)
+    return iter(sorted(rows, key=key))
+
+def write_csv(records, f):
+    """将记录写入已打开的文本文件对象"""
+    writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+    writer.writeheader()
+    writer.writerows(records)
+
+def write_csv_rows(rows, f, fieldnames=FIELDNAMES):
+    """将元组记录写入已打开的文本文件对象，输出与 write_csv 相同"""
+    writer = csv.writer(f)
+    writer.writerow(fieldnames)
+    writer.writerows(rows)
+
+def _sparse_output(records, columns):
+    """把按 columns 排列的元组记录改为稀疏格式（见 sparse_csv），返回 (记录, 写出函数)"""
+    return (sparse_rows(records, device_indexes(columns)),
+            partial(write_csv_rows, fieldnames=sparse_fieldnames(columns)))
+
+def models_to_csv(models, csv_file, engine='tree', compression=None, compresslevel=None, cached=False,
+                  order=DEFAULT_ORDER, run_size=SORT_RUN_SIZE, columns=None, model_filter=None, sparse=False):
+    """
+    将设备模型写为每个端口一行的CSV
+
+    Args:
+        models: 设备模型的可迭代对象
+        csv_file: CSV文件路径、'-'（标准输出）或已打开的文件对象
+        engine: 'tree' 保留字典记录，'stream' 只保留元组记录
+        compression: 输出压缩格式
+        compresslevel: 压缩级别
+        cached: 模型是否来自缓存（只影响结果信息）
+        order: 输出顺序，见 ORDERS
+        run_size: 流式引擎外部排序每个有序段的记录数
+        columns: 输出的CSV列，默认 FIELDNAMES
+        model_filter: ModelFilter，在生成记录之前丢弃不满足条件的设备和端口
+        sparse: 设备字段只写在设备的第一行，见 sparse_csv
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    if order not in ORDERS:
+        raise ValueError(f"未知的输出顺序: {order}，可选: {', '.join(ORDERS)}")
+    if model_filter:
+        models = model_filter.apply(models)
+    columns = list(columns) if columns else FIELDNAMES
+
+    if columns != FIELDNAMES:
+        # 只生成选择的列；排序时在末尾附加缺少的排序列，写出时去掉
+        row_columns = columns
+        if order != 'document':
+            row_columns = columns + [column for column in SORT_COLUMNS if column not in columns]
+        build = row_builder(row_columns)
+        records = (row for model in models for row in build(model))
+        if order != 'document':
+            key = row_sort_key(row_columns, order)
+            records = sort_rows(records, key, run_size) if engine == 'stream' else iter(sorted(records, key=key))
+        if len(row_columns) > len(columns):
+            records = (row[:len(columns)] for row in records)
+        write_records = partial(write_csv_rows, fieldnames=columns)
+    elif order == 'document':
+        # 边解析边写出，不保留任何记录
+        records = (row for model in models for row in device_rows(model))
+        write_records = write_csv_rows
+    elif engine == 'stream':
+        # 不保留设备模型和字典记录，记录过多时溢出到临时文件排序
+        key = natural_row_sort_key if order == 'natural' else ROW_SORT_KEY
+        records = sort_rows((row for model in models for row in device_rows(model)), key, run_size)
+        write_records = write_csv_rows
+    elif sparse:
+        # 稀疏输出在元组记录上逐行比较设备字段，tree 引擎也生成元组记录
+        records = model_rows(models, engine, order, run_size)
+        write_records = write_csv_rows
+    else:
+        records = iter(records_from_models(models, order))
+        write_records = write_csv
+
+    source = "缓存" if cached else f"{engine} 引擎"
+    if sparse:
+        # sparse 时记录总是元组记录（不会进入字典记录的分支），写出之前改为稀疏格式
+        records, write_records = _sparse_output(records, columns)
+        source += "，稀疏"
+    return _write_records(records, write_records, csv_file, compression, compresslevel, source, model_filter)
+
+def _write_records(records, write_records, csv_file, compression, compresslevel, source, model_filter=None):
+    """写入CSV文件（没有记录时不创建输出），返回 (是否成功, 信息)"""
+    first = next(records, None)
+    if first is None:
+        if model_filter:
+            return False, f"没有满足条件（{model_filter}）的设备数据"
+        return False, "没有找到任何设备数据"
+    # zip 先取记录再取计数，写完后计数器的下一个值即为记录数
+    counter = itertools.count()
+    with open_csv_output(csv_file, compression, compresslevel) as f:
+        write_records((record for record, _ in zip(itertools.chain([first], records), counter)), f)
+    return True, f"成功将 {next(counter)} 条记录写入 CSV 文件（{source}）"
+
+def _segment_rows(document, backend, fields, row_columns, order, model_filter, directory):
+    """
+    在工作进程中解析一段设备，把元组记录写入 directory 中的临时文件
+
+    order 不是 document 时记录先在段内排好序。
+
+    Returns:
+        临时文件路径
+    """
+    models = get_backend(backend).iter_devices(document, fields)
+    if model_filter:
+        models = model_filter.apply(models)
+    build = row_builder(row_columns)
+    rows = [row for model in models for row in build(model)]
+    if order != 'document':
+        rows.sort(key=row_sort_key(row_columns, order))
+    with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as f:
+        _dump_rows(rows, f)
+    return f.name
+
+def split_rows(layout, jobs, backend, fields, row_columns, order=DEFAULT_ORDER, model_filter=None):
+    """
+    把一个文件拆分为多段，在多个进程中并行提取元组记录
+
+    各段的记录经由临时文件传回：document 顺序按段的顺序依次读出，
+    其他顺序把各段有序的记录归并。heapq.merge 在键相同时按段的先后
+    输出，结果与整体提取后稳定排序完全相同。
+
+    Args:
+        layout: xml_split.SplitLayout
+        jobs: 并行进程数
+        backend: 工作进程使用的解析后端名称
+        fields: 只提取的叶子字段名集合
+        row_columns: 记录的列
+        order: 输出顺序
+        model_filter: ModelFilter
+    Yields:
+        元组记录
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        work = partial(_segment_rows, backend=backend, fields=fields, row_columns=row_columns, order=order,
+                       model_filter=model_filter, directory=directory)
+        runs = []
+        try:
+            for path in map_segments(layout, work, jobs):
+                runs.append(open(path, 'rb'))
+                if order == 'document':
+                    yield from _read_run(runs[-1])
+            if order != 'document':
+                yield from heapq.merge(*[_read_run(f) for f in runs], key=row_sort_key(row_columns, order))
+        finally:
+            for f in runs:
+                f.close()
+
+def split_to_csv(layout, csv_file, jobs, backend=None, compression=None, compresslevel=None,
+                 order=DEFAULT_ORDER, columns=None, model_filter=None, fields=None, sparse=False):
+    """
+    并行提取一个可拆分的文件并写为CSV，输出与整体转换相同
+
+    Args:
+        layout: xml_split.SplitLayout
+        jobs: 并行进程数
+        其他参数见 models_to_csv 和 xml_to_csv
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    if order not in ORDERS:
+        raise ValueError(f"未知的输出顺序: {order}，可选: {', '.join(ORDERS)}")
+    columns = list(columns) if columns else FIELDNAMES
+    row_columns = columns
+    if order != 'document':
+        row_columns = columns + [column for column in SORT_COLUMNS if column not in columns]
+    records = split_rows(layout, jobs, backend, fields, row_columns, order, model_filter)
+    rows = records
+    if len(row_columns) > len(columns):
+        records = (row[:len(columns)] for row in records)
+    write_records = partial(write_csv_rows, fieldnames=columns)
+    source = f"{jobs} 个进程并行"
+    if sparse:
+        records, write_records = _sparse_output(records, columns)
+        source += "，稀疏"
+    try:
+        return _write_records(records, write_records, csv_file, compression, compresslevel, source, model_filter)
+    finally:
+        rows.close()
+
+def xml_to_csv(xml_file, csv_file, backend=None, compression=None, compresslevel=None,
+               engine='auto', max_memory=None, cache=None, order=DEFAULT_ORDER, run_size=SORT_RUN_SIZE,
+               columns=None, model_filter=None, jobs=1, head=None, sample=None, seed=None,
+               sample_bytes=DEFAULT_SAMPLE_BYTES, sparse=False):
+    """
+    将XML文件转换为每个端口一行的CSV
+
+    Args:
+        xml_file: XML文件路径（可为 .gz/.bz2/.xz 压缩文件）、二进制文件对象或字节内容
+        csv_file: CSV文件路径、'-'（标准输出）或已打开的文件对象
+        backend: 解析后端名称 ('etree' 或 'expat')，默认 etree；流式引擎总是使用 expat
+        compression: 输出压缩格式 ('gz'、'bz2' 或 'xz')，路径以对应后缀结尾时自动启用
+        compresslevel: 压缩级别
+        engine: 'tree'、'stream' 或 'auto'（按输入大小和 max_memory 选择）
+        max_memory: auto 引擎的内存预算（字节）
+        cache: ModelCache，命中时不再解析XML（输入为文件对象时不使用）
+        order: 输出顺序 ('sorted'、'natural' 或 'document')
+        run_size: 流式引擎外部排序每个有序段的记录数
+        columns: 输出的CSV列，默认 FIELDNAMES
+        model_filter: ModelFilter，在生成记录之前丢弃不满足条件的设备和端口
+        jobs: 大于 1 时把未压缩的输入文件拆分为多段并行解析（不使用缓存），
+              不能拆分的输入仍整体处理
+        head: 预览：只转换前 head 个设备，得到后立即停止读取（不使用缓存和并行）
+        sample: 预览：随机抽取 sample 个设备，见 xml_preview
+        seed: 抽样的随机种子
+        sample_bytes: 抽样时最多读取的解压后数据量
+        sparse: 设备字段只写在设备的第一行，见 sparse_csv
+    """
+    try:
+        engine = choose_engine(xml_file, engine, max_memory)
+        parser = get_backend('expat' if engine == 'stream' else backend)
+        previewing = head is not None or sample is not None
+        if hasattr(xml_file, 'read') or previewing:
+            cache = None
+        # 不使用缓存时只提取输出、排序和过滤用到的字段（缓存中保存完整的模型）
+        fields = None
+        if cache is None:
+            needed = list(columns or FIELDNAMES)
+            if order != 'document':
+                needed += SORT_COLUMNS
+            fields = extraction_fields((COLUMN_SOURCES[column][1] for column in needed), model_filter)
+        if previewing:
+            # 预览的设备已经过滤，数量很少，按 tree 引擎在内存中排序
+            preview = preview_models(xml_file, head, sample, seed, sample_bytes, fields, model_filter)
+            success, message = models_to_csv(preview.models, csv_file, 'tree', compression, compresslevel,
+                                             False, order, run_size, columns, sparse=sparse)
+            if success:
+                message = f"{message}（预览 {len(preview.models)} 个设备，{preview.describe()}）"
+            return success, message
+        layout = split_layout(xml_file) if jobs > 1 and cache is None else None
+        if layout is not None:
+            return split_to_csv(layout, csv_file, jobs, parser.name, compression, compresslevel, order,
+                                columns, model_filter, fields, sparse)
+        models, cached = cached_models(cache, xml_file, PROFILE_RAW, lambda: parser.iter_devices(xml_file, fields))
+        return models_to_csv(models, csv_file, engine, compression, compresslevel, cached, order, run_size,
+                             columns, model_filter, sparse)
             
     except Exception as e:
         return False, f"处理失败: {str(e)}"
 
 def main():
-    if len(sys.argv) != 3:
-        print("用法: python xml2csv.py <输入XML文件> <输出CSV文件>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='将XML文件转换为CSV')
+    parser.add_argument('xml_file', help='输入XML文件')
+    parser.add_argument('csv_file', help="输出CSV文件，'-' 表示写到标准输出")
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS),
+                        help='压缩输出 (输出文件以 .gz/.bz2/.xz 结尾时自动启用)')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='转换引擎：tree 整体解析，stream 流式解析，auto 按文件大小选择 (默认 auto)')
+    parser.add_argument('--max-memory', default=None,
+                        help='auto 引擎的单文件内存预算，如 256M、1G (默认 512M)')
+    parser.add_argument('--cache-dir', default=None, help='设备模型缓存目录，命中时不再解析XML')
+    parser.add_argument('--cache-size', default=None, help='缓存目录大小上限，如 500M、2G (默认 1G)')
+    order_group = parser.add_mutually_exclusive_group()
+    order_group.add_argument('--order', choices=ORDERS, default=DEFAULT_ORDER,
+                             help='输出顺序：sorted 按名称、IP和端口排序，natural 端口按数字自然排序，'
+                                  'document 按XML顺序 (默认 sorted)')
+    order_group.add_argument('--no-sort', dest='order', action='store_const', const='document',
+                             help='不排序，按XML顺序边解析边写出（同 --order document）')
+    parser.add_argument('--sort-buffer', type=int, default=SORT_RUN_SIZE,
+                        help=f'流式引擎排序时内存中保留的记录数，超过时使用临时文件 (默认 {SORT_RUN_SIZE})')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='把单个大文件按设备拆分为多段并行解析的进程数，不使用缓存 (默认 1)')
+    parser.add_argument('--sparse', action='store_true',
+                        help='设备字段只写在每个设备的第一行，首列 DeviceRow 标记第一行；'
+                             '用 sparse_csv.py 可展开为完整的CSV')
+    add_filter_arguments(parser, FIELDNAMES)
+    add_preview_arguments(parser)
+    args = parser.parse_args()
+    previewing = args.head is not None or args.sample is not None
+    max_memory = parse_size(args.max_memory) if args.max_memory else None
+    cache = None
+    if args.cache_dir:
+        cache = ModelCache(args.cache_dir, parse_size(args.cache_size) if args.cache_size else DEFAULT_CACHE_SIZE)
         
-    xml_file = sys.argv[1]
-    csv_file = sys.argv[2]
+    xml_file = args.xml_file
+    csv_file = args.csv_file
     
-    # 验证XML结构
-    valid, message = validate_xml_structure(xml_file)
-    if not valid:
-        print(f"错误: {message}")
-        sys.exit(1)
-        
-    # 转换文件
-    success, message = xml_to_csv(xml_file, csv_file)
+    # 输出到标准输出时，提示信息改写到标准错误
+    log = sys.stderr if csv_file == '-' else sys.stdout
+    
+    with PeakMemory() as memory:
+        # 验证XML结构（流式引擎、使用缓存、并行解析和预览时在转换的同一遍解析中检查结构）
+        engine = choose_engine(xml_file, args.engine, max_memory)
+        if engine == 'tree' and cache is None and args.jobs <= 1 and not previewing:
+            valid, message = validate_xml_structure(xml_file)
+            if not valid:
+                print(f"错误: {message}", file=log)
+                sys.exit(1)
+            
+        # 转换文件
+        success, message = xml_to_csv(xml_file, csv_file, args.backend, args.compress, args.level, engine,
+                                      cache=cache, order=args.order, run_size=args.sort_buffer,
+                                      columns=args.columns, model_filter=filter_from_args(args), jobs=args.jobs,
+                                      head=args.head, sample=args.sample, seed=args.seed,
+                                      sample_bytes=sample_bytes_from_args(args), sparse=args.sparse)
     if success:
-        print(f"成功: {message}")
+        print(f"成功: {message}，{memory.describe()}", file=log)
     else:
-        print(f"错误: {message}")
+        print(f"错误: {message}", file=log)
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按设备内容复用已提取的设备模型
+
+同一工厂相邻两次采集的设备绝大部分完全相同。model_cache 只在整个
+文件内容相同时命中，这里再细到单个设备：用 xml_split 的字节扫描找出
+DeviceCollection 中每个 Device 的字节范围，以
+
+    (提取方式, 模型版本, marshal 版本, XML声明, 该设备的原始字节)
+
+的散列作为指纹，在本地 SQLite 库中查找以前提取过的设备模型。找到的
+直接复用，只有新的或变化了的设备重新提取：把它们和原文件的开头、
+结尾拼成一个文档（与 xml_split 的做法相同），按原来的提取方式解析
+一遍，结果按文档顺序与复用的模型合并，并写回库中。
+
+第一个设备总是重新提取，因此原文件的开头和结尾、结构检查每次都按
+原来的方式完成。以下情况不复用，按原来的方式整体提取：
+
+    - 扫描不到可以逐个切开的设备（见 xml_split.scan_layout）
+    - 需要重新提取的部分不是合法的 UTF-8（清理时会改用其他编码）
+
+重新提取的部分解析出错或结构检查失败时，对原文件整体重新解析，以报告原文件中的
+错误位置。库中的条目按最近使用时间淘汰，总大小不超过上限。
+"""
+
+import os
+import re
+import mmap
+import time
+import zlib
+import sqlite3
+import marshal
+import hashlib
+import xml.etree.ElementTree as ET
+
+from xml_backends import MODEL_VERSION, StructureError
+from xml_sources import XmlInput, compression_of, read_input
+from xml_split import scan_layout
+
+# 默认库大小上限（按压缩后的模型计）
+DEFAULT_STORE_SIZE = 1 << 30
+
+# 每次查询或写入的指纹数
+LOOKUP_BATCH_SIZE = 500
+
+# 等待其他进程释放数据库锁的秒数
+LOCK_TIMEOUT = 60
+
+# 文档开头的 BOM 和XML声明，决定设备字节的解码方式
+_DECLARATION = re.compile(rb'(?:\xef\xbb\xbf)?(?:<\?xml[^>]*\?>)?')
+
+class MemoStats:
+    """一次提取中复用的设备数"""
+
+    def __init__(self):
+        self.devices = 0
+        self.reused = 0
+        self.applied = False
+
+    def describe(self):
+        if not self.applied:
+            return "设备缓存未使用"
+        return f"复用 {self.reused}/{self.devices} 个设备"
+
+class DeviceStore:
+    """
+    磁盘上的设备模型库（SQLite）
+
+    只保存路径和大小上限，可以被传递到工作进程中使用；每个进程在第一次
+    使用时打开自己的连接，多个进程可以同时读写。
+    """
+
+    def __init__(self, path, max_size=DEFAULT_STORE_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self._connection = None
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.max_size = state['max_size']
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS devices ('
+                               'fingerprint BLOB PRIMARY KEY, model BLOB NOT NULL, '
+                               'size INTEGER NOT NULL, used INTEGER NOT NULL) WITHOUT ROWID')
+            connection.execute('CREATE INDEX IF NOT EXISTS devices_used ON devices (used)')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def lookup(self, fingerprints, used):
+        """
+        查找指纹对应的模型，并把找到的条目标记为最近使用
+
+        Args:
+            fingerprints: 指纹列表
+            used: 使用时间
+        Returns:
+            {指纹: 压缩的模型}
+        """
+        connection = self._connect()
+        found = {}
+        unique = list(dict.fromkeys(fingerprints))
+        with connection:
+            for start in range(0, len(unique), LOOKUP_BATCH_SIZE):
+                batch = unique[start:start + LOOKUP_BATCH_SIZE]
+                marks = ','.join('?' * len(batch))
+                found.update(connection.execute(
+                    f'SELECT fingerprint, model FROM devices WHERE fingerprint IN ({marks})', batch))
+                connection.execute(f'UPDATE devices SET used = ? WHERE fingerprint IN ({marks})',
+                                   [used] + batch)
+        return found
+
+    def save(self, entries, used):
+        """
+        Args:
+            entries: [(指纹, 压缩的模型), ...]
+            used: 使用时间
+        """
+        connection = self._connect()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?)',
+                                   [(fingerprint, model, len(model), used) for fingerprint, model in entries])
+
+    def evict(self):
+        """删除最久未使用的条目，直到总大小不超过上限"""
+        connection = self._connect()
+        with connection:
+            total, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM devices').fetchone()
+            if total <= self.max_size:
+                return
+            removed = []
+            for fingerprint, size in connection.execute('SELECT fingerprint, size FROM devices ORDER BY used'):
+                if total <= self.max_size:
+                    break
+                removed.append((fingerprint,))
+                total -= size
+            connection.executemany('DELETE FROM devices WHERE fingerprint = ?', removed)
+
+def _plain_path(source):
+    """可以直接映射的未压缩文件路径，其他输入为 None"""
+    if isinstance(source, XmlInput):
+        if source.kind == 'file' and not source.compression:
+            return source.path
+        return None
+    if isinstance(source, str) and not compression_of(source):
+        return source
+    return None
+
+def _is_utf8(pieces):
+    try:
+        for piece in pieces:
+            piece.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def _memoized(store, source, data, layout, profile, extract, stats):
+    """
+    在已读取的文档上逐个设备复用或重新提取
+
+    Returns:
+        设备模型的迭代器，不能复用时为 None
+    """
+    declaration = _DECLARATION.match(data).group()
+    prefix = f"{profile}\0v{MODEL_VERSION}\0m{marshal.version}\0".encode() + declaration + b'\0'
+    ranges = list(zip([layout.header_end] + layout.boundaries, layout.boundaries + [layout.footer_start]))
+    fingerprints = [hashlib.blake2b(prefix + data[start:end], digest_size=16).digest() for start, end in ranges]
+
+    used = int(time.time())
+    found = store.lookup(fingerprints[1:], used)
+    # 第一个设备总是重新提取
+    missing = [0] + [index for index in range(1, len(ranges)) if fingerprints[index] not in found]
+    pieces = ([data[:layout.header_end]] + [data[slice(*ranges[index])] for index in missing] +
+              [data[layout.footer_start:]])
+    if not _is_utf8(pieces):
+        return None
+
+    def models():
+        document = b''.join(pieces)
+        del pieces[:]
+        extracted = extract(document)
+        del document
+        pending = []
+        missing_set = set(missing)
+        try:
+            for index, fingerprint in enumerate(fingerprints):
+                if index in missing_set:
+                    model = next(extracted, None)
+                    if model is None:
+                        raise ValueError("重新提取的设备数与扫描结果不一致")
+                    pending.append((fingerprint, zlib.compress(marshal.dumps(model), 1)))
+                    if len(pending) >= LOOKUP_BATCH_SIZE:
+                        store.save(pending, used)
+                        pending = []
+                else:
+                    model = marshal.loads(zlib.decompress(found[fingerprint]))
+                    stats.reused += 1
+                stats.devices += 1
+                yield model
+            if next(extracted, None) is not None:
+                raise ValueError("重新提取的设备数与扫描结果不一致")
+        except (ET.ParseError, StructureError):
+            # 拼接文档中的行号与原文件不同，整体重新解析以报告原文件中的位置
+            for _ in extract(source):
+                pass
+            raise
+        store.save(pending, used)
+        store.evict()
+
+    stats.applied = True
+    return models()
+
+def memoized_models(store, source, profile, extract, stats=None):
+    """
+    逐个设备复用库中的模型，只重新提取新的或变化了的设备
+
+    Args:
+        store: DeviceStore，为 None 时直接整体提取
+        source: 输入源（文件路径、XmlInput 或已读取的字节内容）
+        profile: 提取方式，见 model_cache
+        extract: extract(source) 返回设备模型的迭代器；source 可以是原输入或拼接的文档字节
+        stats: MemoStats，记录复用的设备数
+    Yields:
+        与 extract(source) 相同的设备模型，按文档顺序
+    """
+    if stats is None:
+        stats = MemoStats()
+    if store is None:
+        yield from extract(source)
+        return
+
+    path = _plain_path(source)
+    if path is not None:
+        with open(path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件无法映射
+                data = b''
+    else:
+        data = read_input(source)
+
+    try:
+        layout = scan_layout(data) if data else None
+        models = None
+        if layout is not None and layout.complete:
+            models = _memoized(store, source, data, layout, profile, extract, stats)
+        if models is None:
+            models = extract(source)
+        yield from models
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
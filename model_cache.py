@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的设备模型缓存
+
+同一份XML（解压后的内容相同）在同一种清理和提取方式下得到的设备模型
+总是相同的，因此以 (内容SHA-256, 提取方式, 模型版本) 为键把模型缓存在
+磁盘上。修改输出布局或增加输出格式后重新转换时，直接读取缓存的模型，
+不必再解码、清理和解析XML。
+
+缓存文件格式:
+    魔数 b'XMC1' + marshal 版本（1 字节）
+    之后是一个 zlib 流，内容为依次排列的 [4 字节长度][marshal 序列化的设备模型]
+
+写入和读取都是逐个设备进行的，不需要把所有模型同时放在内存中。
+缓存目录的总大小超过上限时，按最近使用时间（文件修改时间）淘汰。
+"""
+
+import os
+import zlib
+import struct
+import marshal
+import hashlib
+import tempfile
+
+from xml_backends import MODEL_VERSION
+from xml_sources import open_input
+
+CACHE_MAGIC = b'XMC1'
+CACHE_SUFFIX = '.mdl'
+
+# 默认缓存目录大小上限
+DEFAULT_CACHE_SIZE = 1 << 30
+
+# 读写缓存文件的数据块大小
+_CHUNK_SIZE = 1 << 20
+_LENGTH = struct.Struct('<I')
+
+# 提取方式，决定同一内容得到的设备模型。解码方式不同的引擎使用不同的提取方式：
+# 整体解码在整个文件不是 UTF-8 时全部按 latin-1 解码，流式解码（xml_sources.CleanedReader）
+# 则从第一个无效字节处才改用 latin-1，编码混杂的文件会得到不同的模型
+PROFILE_RAW = 'raw'              # 不清理，DeviceCollection/Device（d_xml2csv）
+PROFILE_STRIPPED = 'stripped'    # 整体解码，移除所有字符引用，DeviceCollection/Device（xml2csv tree 引擎、xml2csv2）
+PROFILE_STRIPPED_STREAM = 'stripped-stream'  # 同上，但为流式解码（xml2csv stream 引擎、xml_fanout 的 CSV 和 sheets）
+PROFILE_XLSX = 'xlsx'            # xml2xlsx 的解码清理，DeviceCollection/Device
+PROFILE_XLSX_ALL = 'xlsx-all'    # xml2xlsx 的解码清理，所有 .//Device
+PROFILE_XLSX_STREAM = 'xlsx-stream'  # xml2xlsx 流式引擎的逐块解码清理，所有 .//Device（含 xml_fanout 的 xlsx）
+
+def content_hash(source):
+    """
+    计算输入解压后内容的 SHA-256
+
+    Args:
+        source: XmlInput、文件路径或已读取的字节内容
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open_input(source) as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class CacheCorrupted(Exception):
+    """缓存文件无法读取"""
+
+class ModelCache:
+    """
+    磁盘上的设备模型缓存
+
+    只保存目录和大小上限，可以被传递到工作进程中使用。
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, profile):
+        """输入源在指定提取方式下的缓存键"""
+        return f"{content_hash(source)}-{profile}-v{MODEL_VERSION}"
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, key):
+        """
+        读取缓存的设备模型
+
+        Returns:
+            models: 设备模型的迭代器，未命中时为 None
+        """
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+
+        try:
+            header = f.read(len(CACHE_MAGIC) + 1)
+            if header != CACHE_MAGIC + bytes([marshal.version]):
+                f.close()
+                return None
+            # 更新修改时间，作为最近使用时间
+            os.utime(path)
+        except OSError:
+            f.close()
+            return None
+        return self._iter_models(f, path)
+
+    def _iter_models(self, f, path):
+        decompressor = zlib.decompressobj()
+        buffer = b''
+        try:
+            with f:
+                while True:
+                    chunk = f.read(_CHUNK_SIZE)
+                    buffer += decompressor.decompress(chunk) if chunk else decompressor.flush()
+                    # 按偏移量逐条读取，数据块处理完后再丢弃已读部分
+                    offset = 0
+                    while len(buffer) - offset >= _LENGTH.size:
+                        length, = _LENGTH.unpack_from(buffer, offset)
+                        end = offset + _LENGTH.size + length
+                        if len(buffer) < end:
+                            break
+                        yield marshal.loads(buffer[offset + _LENGTH.size:end])
+                        offset = end
+                    buffer = buffer[offset:]
+                    if not chunk:
+                        break
+            if buffer or not decompressor.eof:
+                raise CacheCorrupted("缓存文件不完整")
+        except (zlib.error, ValueError, EOFError, TypeError, CacheCorrupted) as e:
+            self._remove(path)
+            raise CacheCorrupted(f"缓存文件损坏，已删除: {os.path.basename(path)} ({str(e)})") from None
+
+    def store(self, key, models):
+        """
+        边产出设备模型边写入缓存
+
+        只有 models 被完整遍历后缓存才会生效，中途出错或未遍历完时丢弃。
+
+        Args:
+            key: 缓存键
+            models: 设备模型的可迭代对象
+        Yields:
+            与 models 相同的设备模型
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        completed = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(CACHE_MAGIC + bytes([marshal.version]))
+                compressor = zlib.compressobj(1)
+                for model in models:
+                    data = marshal.dumps(model)
+                    f.write(compressor.compress(_LENGTH.pack(len(data)) + data))
+                    yield model
+                f.write(compressor.flush())
+            os.replace(temp_path, self.path(key))
+            completed = True
+        finally:
+            if not completed:
+                self._remove(temp_path)
+        self.evict()
+
+    def evict(self):
+        """删除最久未使用的缓存文件，直到总大小不超过上限"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def cached_models(cache, source, profile, extract):
+    """
+    从缓存读取设备模型，未命中时提取并写入缓存
+
+    Args:
+        cache: ModelCache，为 None 时直接提取
+        source: 输入源，用于计算缓存键
+        profile: 提取方式
+        extract: 无参数的函数，返回设备模型的迭代器
+    Returns:
+        (models, hit): 设备模型的迭代器，以及是否命中缓存
+    """
+    if cache is None:
+        return extract(), False
+    key = cache.key(source, profile)
+    models = cache.load(key)
+    if models is not None:
+        return models, True
+    return cache.store(key, extract()), False
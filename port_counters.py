@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+端口计数器的数值列和按设备、按采集的汇总
+
+端口的 NetworkLoadIn、NetworkLoadOut、RxPortErrorsFrames、CableDelay
+和 PowerBudget 在模型中是字符串。这里在提取设备时只把这几个字段
+（以及设备名称、端口状态）追加到各自的列表，提取结束后每列一次性
+转换为 float64 数组：空值和无法解析的值为 NaN，不会被当作 0。
+汇总全部用数组运算完成，同一设备的端口在数组中相邻，按设备的
+最大值用 reduceat 计算，合计和计数用 bincount：
+
+    Ports               端口数
+    PortsDown           OperStatus 为 down 的端口数
+    RxPortErrorsFrames  接收错误帧合计
+    PortsWithErrors     接收错误帧大于 0 的端口数
+    MaxNetworkLoadIn    最大输入负载
+    MaxNetworkLoadOut   最大输出负载
+    MaxCableDelay       最大线缆延迟
+    MinPowerBudget      最小功率预算
+
+每次采集（一个输入文件）汇总为一行，另外加上设备数、有错误帧的
+设备数和无法解析的值的个数。
+
+用法:
+    python port_counters.py 汇总.csv XML文件... [--devices 设备汇总.csv] [--ports 端口计数器.csv]
+
+xml2xlsx --counters 在工作簿中追加 Counters（端口计数器，数值单元格）
+和 Summary（按设备汇总，最后一行为整个采集的合计）工作表。
+"""
+
+import os
+import sys
+import csv
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from csv_output import COMPRESSIONS, open_csv_output
+from xml2csv import remove_char_references
+from xml_backends import BACKENDS, DEFAULT_BACKEND, get_backend, iter_ports
+from xml_sources import open_cleaned
+
+# 转换为数值的端口字段
+COUNTER_FIELDS = ['NetworkLoadIn', 'NetworkLoadOut', 'RxPortErrorsFrames', 'CableDelay', 'PowerBudget']
+
+# 提取时需要的字段
+COUNTER_SOURCE_FIELDS = {'NameOfStation', 'IpAddress', 'PortID', 'OperStatus'} | set(COUNTER_FIELDS)
+
+# 端口计数器表和汇总表的列
+PORT_COUNTER_FIELDS = ['NameOfStation', 'PortID', 'OperStatus'] + COUNTER_FIELDS
+AGGREGATE_FIELDS = ['Ports', 'PortsDown', 'RxPortErrorsFrames', 'PortsWithErrors', 'MaxNetworkLoadIn',
+                    'MaxNetworkLoadOut', 'MaxCableDelay', 'MinPowerBudget']
+DEVICE_SUMMARY_FIELDS = ['NameOfStation', 'IpAddress'] + AGGREGATE_FIELDS
+CAPTURE_SUMMARY_FIELDS = ['SourceFile', 'Devices', 'DevicesWithErrors'] + AGGREGATE_FIELDS + ['Unparsed']
+
+def parse_counter(values):
+    """
+    把字符串列一次性转换为数值
+
+    Args:
+        values: 字符串列表
+    Returns:
+        float64 数组，空值和无法解析的值为 NaN
+    """
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+def cell_value(value):
+    """数组中的值转换为单元格的值：NaN 为 None，整数值为 int"""
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+def _csv_value(value):
+    value = cell_value(value) if isinstance(value, (float, np.floating)) else value
+    return '' if value is None else value
+
+class PortCounters:
+    """
+    收集一次采集中各端口的计数器
+
+    用法:
+        counters = PortCounters()
+        for model in counters.track(models):
+            ...
+        summary = counters.device_summary()
+    """
+
+    def __init__(self):
+        self.stations = []
+        self.addresses = []
+        # 每个端口所属设备的序号，与 stations 对应
+        self.device_index = []
+        self.port_ids = []
+        self.oper_status = []
+        self.values = {field: [] for field in COUNTER_FIELDS}
+        self._arrays = None
+
+    def add(self, model):
+        """登记一个设备模型的所有端口"""
+        device = model['device']
+        index = len(self.stations)
+        self.stations.append(device.get('NameOfStation', ''))
+        self.addresses.append(device.get('IpAddress', ''))
+        columns = [(self.values[field], field) for field in COUNTER_FIELDS]
+        for port in iter_ports(model):
+            self.device_index.append(index)
+            self.port_ids.append(port.get('PortID', ''))
+            self.oper_status.append(port.get('OperStatus', ''))
+            for column, field in columns:
+                column.append(port.get(field, ''))
+        self._arrays = None
+
+    def track(self, models):
+        """在产出设备模型的同时登记端口"""
+        for model in models:
+            self.add(model)
+            yield model
+
+    def arrays(self):
+        """
+        Returns:
+            {字段: float64 数组}，另有 'device_index'（int64）和 'down'（bool）
+        """
+        if self._arrays is None:
+            arrays = {field: parse_counter(self.values[field]) for field in COUNTER_FIELDS}
+            arrays['device_index'] = np.array(self.device_index, dtype=np.int64)
+            arrays['down'] = np.array(self.oper_status, dtype=object) == 'down'
+            self._arrays = arrays
+        return self._arrays
+
+    def unparsed(self):
+        """有值但无法解析为数值的个数"""
+        arrays = self.arrays()
+        count = 0
+        for field in COUNTER_FIELDS:
+            present = np.array(self.values[field], dtype=object) != ''
+            count += int(np.count_nonzero(np.isnan(arrays[field]) & present))
+        return count
+
+    def port_rows(self):
+        """
+        Returns:
+            端口计数器表的行（PORT_COUNTER_FIELDS），计数器为数值，缺失为 None
+        """
+        arrays = self.arrays()
+        counters = zip(*(arrays[field].tolist() for field in COUNTER_FIELDS))
+        return [(self.stations[index], port_id, status) + tuple(cell_value(value) for value in values)
+                for index, port_id, status, values in zip(self.device_index, self.port_ids,
+                                                          self.oper_status, counters)]
+
+    def _aggregates(self, groups, count):
+        """
+        按组汇总，同一组的端口在数组中相邻
+
+        Args:
+            groups: 每个端口所属组的序号（不递减）
+            count: 组数
+        Returns:
+            {AGGREGATE_FIELDS 中的字段: 长度为 count 的数组}
+        """
+        arrays = self.arrays()
+        errors = arrays['RxPortErrorsFrames']
+        ports = np.bincount(groups, minlength=count)
+        result = {
+            'Ports': ports,
+            'PortsDown': np.bincount(groups, weights=arrays['down'], minlength=count).astype(np.int64),
+            'RxPortErrorsFrames': np.bincount(groups, weights=np.nan_to_num(errors), minlength=count),
+            'PortsWithErrors': np.bincount(groups, weights=errors > 0, minlength=count).astype(np.int64),
+        }
+        # 没有端口的组不参与 reduceat，其他组的端口范围首尾相接
+        present = np.flatnonzero(ports)
+        starts = np.searchsorted(groups, present)
+        for name, field, reduce in (('MaxNetworkLoadIn', 'NetworkLoadIn', np.fmax),
+                                    ('MaxNetworkLoadOut', 'NetworkLoadOut', np.fmax),
+                                    ('MaxCableDelay', 'CableDelay', np.fmax),
+                                    ('MinPowerBudget', 'PowerBudget', np.fmin)):
+            values = np.full(count, np.nan)
+            if len(present):
+                values[present] = reduce.reduceat(arrays[field], starts)
+            result[name] = values
+        return result
+
+    def device_summary(self):
+        """
+        Returns:
+            按设备汇总的行（DEVICE_SUMMARY_FIELDS），按文档顺序，包括没有端口的设备
+        """
+        aggregates = self._aggregates(self.arrays()['device_index'], len(self.stations))
+        columns = [aggregates[field].tolist() for field in AGGREGATE_FIELDS]
+        return [(station, address) + tuple(cell_value(value) for value in values)
+                for station, address, values in zip(self.stations, self.addresses, zip(*columns))]
+
+    def capture_summary(self, source_file=''):
+        """
+        Returns:
+            整个采集的汇总行（CAPTURE_SUMMARY_FIELDS）
+        """
+        arrays = self.arrays()
+        aggregates = self._aggregates(np.zeros(len(arrays['device_index']), dtype=np.int64), 1)
+        device_errors = np.bincount(arrays['device_index'], weights=arrays['RxPortErrorsFrames'] > 0,
+                                    minlength=len(self.stations))
+        return ((source_file, len(self.stations), int(np.count_nonzero(device_errors))) +
+                tuple(cell_value(aggregates[field][0]) for field in AGGREGATE_FIELDS) +
+                (self.unparsed(),))
+
+def append_counter_sheets(wb, counters):
+    """
+    在 openpyxl 工作簿（包括只写模式）末尾追加端口计数器和汇总工作表
+
+    Args:
+        wb: 工作簿
+        counters: 已登记全部端口的 PortCounters
+    """
+    ws = wb.create_sheet('Counters')
+    ws.append(PORT_COUNTER_FIELDS)
+    for row in counters.port_rows():
+        ws.append(row)
+
+    ws = wb.create_sheet('Summary')
+    ws.append(DEVICE_SUMMARY_FIELDS)
+    for row in counters.device_summary():
+        ws.append(row)
+    capture = counters.capture_summary()
+    ws.append(('合计', '') + capture[CAPTURE_SUMMARY_FIELDS.index('Ports'):-1])
+
+def collect_counters(xml_file, backend=None):
+    """
+    解析XML输入，登记所有端口的计数器
+
+    与 xml2csv 相同，读取时流式移除所有数字字符引用。
+
+    Args:
+        xml_file: XML文件路径、XmlInput 或已读取的字节内容
+        backend: 解析后端名称
+    Returns:
+        PortCounters
+    """
+    counters = PortCounters()
+    with open_cleaned(xml_file, remove_char_references) as f:
+        for model in get_backend(backend).iter_devices(f, COUNTER_SOURCE_FIELDS):
+            counters.add(model)
+    return counters
+
+def _write_rows(path, header, rows, compression, compresslevel):
+    with open_csv_output(path, compression, compresslevel) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([_csv_value(value) for value in row])
+
+def main():
+    parser = argparse.ArgumentParser(description='把端口计数器转换为数值并按设备、按采集汇总')
+    parser.add_argument('summary_file', help="按采集汇总的CSV文件，每个输入一行，'-' 表示写到标准输出")
+    parser.add_argument('xml_files', nargs='+', help='输入XML文件（每个文件为一次采集）')
+    parser.add_argument('--devices', default=None, help='按设备汇总的CSV文件（增加 SourceFile 列）')
+    parser.add_argument('--ports', default=None, help='端口计数器CSV文件（增加 SourceFile 列）')
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS),
+                        help='压缩输出 (输出文件以 .gz/.bz2/.xz 结尾时自动启用)')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    args = parser.parse_args()
+
+    log = sys.stderr if args.summary_file == '-' else sys.stdout
+    captures, devices, ports = [], [], []
+    failed = 0
+    for xml_file in args.xml_files:
+        try:
+            counters = collect_counters(xml_file, args.backend)
+        except Exception as e:
+            print(f"✗ {xml_file}: 处理失败: {str(e)}", file=log)
+            failed += 1
+            continue
+        source_file = os.path.basename(xml_file)
+        capture = counters.capture_summary(source_file)
+        captures.append(capture)
+        if args.devices:
+            devices.extend((source_file,) + row for row in counters.device_summary())
+        if args.ports:
+            ports.extend((source_file,) + row for row in counters.port_rows())
+        summary = dict(zip(CAPTURE_SUMMARY_FIELDS, capture))
+        print(f"✓ {xml_file}: {summary['Devices']} 个设备，{summary['Ports']} 个端口，"
+              f"{summary['PortsDown']} 个端口 down，错误帧合计 {_csv_value(summary['RxPortErrorsFrames'])}"
+              + (f"，{summary['Unparsed']} 个值无法解析" if summary['Unparsed'] else ''), file=log)
+
+    try:
+        _write_rows(args.summary_file, CAPTURE_SUMMARY_FIELDS, captures, args.compress, args.level)
+        if args.devices:
+            _write_rows(args.devices, ['SourceFile'] + DEVICE_SUMMARY_FIELDS, devices, args.compress, args.level)
+        if args.ports:
+            _write_rows(args.ports, ['SourceFile'] + PORT_COUNTER_FIELDS, ports, args.compress, args.level)
+    except Exception as e:
+        print(f"错误: 写出失败: {str(e)}", file=log)
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
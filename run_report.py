@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+批量转换的进度显示和运行报告
+
+输出方式:
+    verbose   每个文件打印处理信息（原有方式，默认）
+    progress  只显示一行限速刷新的进度：文件/秒、MB/秒和剩余时间
+    quiet     不打印每个文件的信息，也不显示进度，只打印最后的统计
+
+另外可以把每个输入的结果写入 JSONL 报告，每行一条记录:
+    {"time", "source", "status", "output", "rows", "seconds", "bytes", "error"}
+其中 status 为 success、failed 或 skipped，rows 取自结果信息中的
+"N 条记录"（没有时为 null）。
+"""
+
+import os
+import re
+import sys
+import json
+import time
+from datetime import datetime
+
+VERBOSITIES = ('verbose', 'progress', 'quiet')
+
+# 进度行的最短刷新间隔（秒）；输出不是终端时按较长间隔整行输出
+PROGRESS_INTERVAL = 0.5
+PROGRESS_LOG_INTERVAL = 10.0
+
+_ROWS = re.compile(r'(\d+) 条记录')
+
+def rows_from_message(message):
+    """从结果信息中取出写入的记录数，多个输出时求和，没有时为 None"""
+    counts = _ROWS.findall(message or '')
+    if not counts:
+        return None
+    return sum(int(count) for count in counts)
+
+def format_duration(seconds):
+    """将秒数格式化为 时:分:秒"""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+class RunReporter:
+    """
+    记录批量转换中每个输入的结果，显示进度并写出 JSONL 报告
+
+    用法:
+        with RunReporter('progress', 'run.jsonl') as reporter:
+            reporter.set_total(len(inputs), total_bytes)
+            reporter.skipped(xml_input, output_path, "目标文件已存在")
+            reporter.finished(xml_input, output_path, success, message, seconds)
+    """
+
+    def __init__(self, verbosity='verbose', report_path=None, stream=None, interval=None):
+        """
+        Args:
+            verbosity: 输出方式，见 VERBOSITIES
+            report_path: JSONL 报告文件，None 表示不写报告
+            stream: 进度输出的流，默认标准错误
+            interval: 进度刷新间隔（秒）
+        """
+        self.verbosity = verbosity
+        self.stream = stream or sys.stderr
+        self.is_tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        if interval is None:
+            interval = PROGRESS_INTERVAL if self.is_tty else PROGRESS_LOG_INTERVAL
+        self.interval = interval
+        self.report_path = report_path
+        self.report = None
+        if report_path:
+            # 报告可能写在输出目录中，该目录此时还未创建
+            os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+            self.report = open(report_path, 'a', encoding='utf-8')
+
+        self.total_files = None
+        self.total_bytes = None
+        self.done_files = 0
+        self.done_bytes = 0
+        self.success_count = 0
+        self.skipped_count = 0
+        self.failed_count = 0
+        self.failures = []
+        self.started = time.monotonic()
+        self._last_draw = 0.0
+        self._last_flush = self.started
+        self._line_width = 0
+
+    @property
+    def verbose(self):
+        """是否打印每个文件的处理信息"""
+        return self.verbosity == 'verbose'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def set_total(self, files, total_bytes=None):
+        """设置输入总数和总字节数，用于计算剩余时间"""
+        self.total_files = files
+        self.total_bytes = total_bytes
+
+    def skipped(self, xml_input, output, reason):
+        """记录被跳过的输入"""
+        self.skipped_count += 1
+        self._record(xml_input, 'skipped', output, reason, None, None)
+
+    def finished(self, xml_input, output, success, message, seconds=None):
+        """记录转换完成的输入"""
+        if success:
+            self.success_count += 1
+        else:
+            self.failed_count += 1
+            self.failures.append({'source': getattr(xml_input, 'display_name', str(xml_input)),
+                                  'output': output, 'error': message})
+        self._record(xml_input, 'success' if success else 'failed', output, message,
+                     rows_from_message(message) if success else None, seconds)
+
+    def _record(self, xml_input, status, output, message, rows, seconds):
+        size = getattr(xml_input, 'size', None) or 0
+        self.done_files += 1
+        self.done_bytes += size
+
+        if self.report is not None:
+            record = {
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'source': getattr(xml_input, 'display_name', str(xml_input)),
+                'status': status,
+                'output': output,
+                'rows': rows,
+                'seconds': round(seconds, 3) if seconds is not None else None,
+                'bytes': size,
+                'error': message if status == 'failed' else None,
+            }
+            self.report.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        now = time.monotonic()
+        if self.report is not None and now - self._last_flush >= self.interval:
+            # 报告限速刷新，监控程序读到的记录最多落后一个刷新间隔
+            self.report.flush()
+            self._last_flush = now
+        if self.verbosity == 'progress' and now - self._last_draw >= self.interval:
+            self._draw(now)
+
+    def progress_text(self, now=None):
+        """当前进度的单行文字"""
+        elapsed = max((now or time.monotonic()) - self.started, 1e-6)
+        files_rate = self.done_files / elapsed
+        bytes_rate = self.done_bytes / elapsed
+        if self.total_files:
+            text = f"[{self.done_files}/{self.total_files}] {self.done_files / self.total_files:.1%}"
+        else:
+            text = f"[{self.done_files}]"
+        text += f" {files_rate:.1f} 文件/秒 {bytes_rate / (1 << 20):.1f} MB/秒"
+
+        # 剩余时间按字节速度估计，没有大小信息时按文件速度估计
+        remaining = None
+        if self.total_bytes and bytes_rate > 0:
+            remaining = max(self.total_bytes - self.done_bytes, 0) / bytes_rate
+        elif self.total_files and files_rate > 0:
+            remaining = max(self.total_files - self.done_files, 0) / files_rate
+        if remaining is not None:
+            text += f" 剩余 {format_duration(remaining)}"
+        if self.failed_count:
+            text += f" 失败 {self.failed_count}"
+        return text
+
+    def _draw(self, now):
+        text = self.progress_text(now)
+        if self.is_tty:
+            # 用空格覆盖上一次更长的内容
+            self.stream.write('\r' + text.ljust(self._line_width))
+            self._line_width = len(text)
+        else:
+            self.stream.write(text + '\n')
+        self.stream.flush()
+        self._last_draw = now
+
+    def close(self):
+        """输出最后的进度并关闭报告"""
+        if self.verbosity == 'progress':
+            self._draw(time.monotonic())
+            if self.is_tty:
+                self.stream.write('\n')
+                self.stream.flush()
+        if self.report is not None:
+            self.report.close()
+            self.report = None
+
+def add_report_arguments(parser):
+    """向批量脚本的参数解析器添加 --progress、--quiet 和 --report"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--progress', dest='verbosity', action='store_const', const='progress',
+                       default='verbose', help='只显示一行进度（文件/秒、MB/秒、剩余时间），不打印每个文件的信息')
+    group.add_argument('--quiet', dest='verbosity', action='store_const', const='quiet',
+                       help='不打印每个文件的信息和进度，只打印最后的统计')
+    parser.add_argument('--report', default=None, help='JSONL 运行报告文件，每个输入一行（追加写入）')
+
+def reporter_from_args(args):
+    """按命令行参数创建 RunReporter，报告文件无法打开时退出"""
+    try:
+        return RunReporter(args.verbosity, args.report)
+    except OSError as e:
+        print(f"错误: 无法写入运行报告 {args.report}: {e}")
+        sys.exit(1)
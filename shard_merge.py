@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+合并分片运行的清单和运行报告
+
+各分片（--shard i/N）在输出目录的 _shards 中写出清单。本脚本读取这些
+清单，检查分片是否齐全、各分片的输出是否互不重叠，汇总成功、跳过和
+失败的数量以及失败列表；可以另外把各分片的 JSONL 运行报告合并为一个
+文件，每条记录增加 shard 字段。
+
+用法:
+    python shard_merge.py 输出目录 [--json 汇总.json] [--report 合并报告.jsonl]
+"""
+
+import os
+import sys
+import json
+import glob
+import argparse
+
+from sharding import MANIFEST_DIR
+
+COUNT_FIELDS = ('inputs', 'bytes', 'success', 'skipped', 'failed')
+
+def manifest_files(paths):
+    """
+    展开清单路径
+
+    Args:
+        paths: 清单文件、_shards 目录或分片运行的输出目录
+    Returns:
+        清单文件列表
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(os.path.join(path, MANIFEST_DIR)):
+            path = os.path.join(path, MANIFEST_DIR)
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, 'shard-*-of-*.json'))))
+        else:
+            files.append(path)
+    return files
+
+def load_manifests(paths):
+    """读取清单；同一分片有多份清单时（重新运行过）保留最后完成的一份"""
+    manifests = {}
+    for path in manifest_files(paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        previous = manifests.get(manifest['index'])
+        if previous is None or manifest['finished'] >= previous['finished']:
+            manifests[manifest['index']] = manifest
+    return [manifests[index] for index in sorted(manifests)]
+
+def merge_manifests(manifests):
+    """
+    汇总各分片的清单
+
+    Args:
+        manifests: load_manifests 的结果
+    Returns:
+        汇总字典：分片列表、缺少的分片、重叠的输出、合计数量和失败列表
+    Raises:
+        ValueError: 没有清单，或各清单的命令、分片数、分片方式不一致
+    """
+    if not manifests:
+        raise ValueError("没有找到分片清单")
+    first = manifests[0]
+    for manifest in manifests[1:]:
+        for field in ('command', 'count', 'strategy'):
+            if manifest[field] != first[field]:
+                raise ValueError(f"分片 {manifest['shard']} 的 {field} 与分片 {first['shard']} 不一致: "
+                                 f"{manifest[field]} != {first[field]}")
+
+    # 同一输出由多个分片负责说明各分片看到的输入集合不同
+    owners = {}
+    for manifest in manifests:
+        for output in manifest['outputs']:
+            owners.setdefault(output, []).append(manifest['shard'])
+    conflicts = [{'output': output, 'shards': shards}
+                 for output, shards in sorted(owners.items()) if len(shards) > 1]
+
+    present = {manifest['index'] for manifest in manifests}
+    failures = [dict(failure, shard=manifest['shard'])
+                for manifest in manifests for failure in manifest['failures']]
+    return {
+        'command': first['command'],
+        'count': first['count'],
+        'strategy': first['strategy'],
+        'shards': [{field: manifest[field] for field in ('shard', 'host', 'started', 'finished') + COUNT_FIELDS}
+                   for manifest in manifests],
+        'missing': [index for index in range(1, first['count'] + 1) if index not in present],
+        'conflicts': conflicts,
+        'outputs': len(owners),
+        'totals': {field: sum(manifest[field] or 0 for manifest in manifests) for field in COUNT_FIELDS},
+        'failures': failures,
+    }
+
+def merge_reports(manifests, path):
+    """
+    把各分片的 JSONL 运行报告合并为一个文件，每条记录增加 shard 字段
+
+    Returns:
+        找不到的报告文件列表
+    """
+    missing = []
+    with open(path, 'w', encoding='utf-8') as out:
+        for manifest in manifests:
+            report = manifest.get('report')
+            if not report:
+                continue
+            if not os.path.exists(report):
+                missing.append(report)
+                continue
+            with open(report, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        record['shard'] = manifest['shard']
+                        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return missing
+
+def main():
+    parser = argparse.ArgumentParser(description='合并分片运行的清单和运行报告')
+    parser.add_argument('paths', nargs='+', help='分片运行的输出目录、_shards 目录或清单文件')
+    parser.add_argument('--json', default=None, help='汇总JSON文件')
+    parser.add_argument('--report', default=None, help='合并后的 JSONL 运行报告文件')
+    args = parser.parse_args()
+
+    try:
+        manifests = load_manifests(args.paths)
+        summary = merge_manifests(manifests)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"错误: 无法读取分片清单: {str(e)}")
+        sys.exit(1)
+
+    print(f"{summary['command']}，共 {summary['count']} 个分片（{summary['strategy']}）：")
+    for shard in summary['shards']:
+        print(f"  分片 {shard['shard']} [{shard['host']}] 输入 {shard['inputs']}，成功 {shard['success']}，"
+              f"跳过 {shard['skipped']}，失败 {shard['failed']}，{shard['started']} ~ {shard['finished']}")
+
+    totals = summary['totals']
+    print("\n合计：")
+    print(f"总文件数：{totals['inputs']}")
+    print(f"输出文件数：{summary['outputs']}")
+    print(f"成功：{totals['success']}")
+    print(f"跳过：{totals['skipped']}")
+    print(f"失败：{totals['failed']}")
+
+    if summary['failures']:
+        print("\n失败文件列表：")
+        for failure in summary['failures']:
+            print(f"- [{failure['shard']}] {failure['source']}")
+            print(f"  错误：{failure['error']}")
+    if summary['missing']:
+        missing = ', '.join(f"{index}/{summary['count']}" for index in summary['missing'])
+        print(f"\n警告: 缺少分片: {missing}")
+    if summary['conflicts']:
+        print(f"\n警告: {len(summary['conflicts'])} 个输出文件由多个分片负责（各分片的输入集合不一致）:")
+        for conflict in summary['conflicts']:
+            print(f"- {conflict['output']}: {', '.join(conflict['shards'])}")
+
+    if args.report:
+        for report in merge_reports(manifests, args.report):
+            print(f"警告: 找不到运行报告 {report}")
+        print(f"合并报告: {args.report}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"汇总: {args.json}")
+
+    if summary['missing'] or summary['conflicts']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+多机批量转换的输入分片
+
+--shard i/N 把输入集合确定地分为 N 份，第 i 份（从 1 开始）由一台机器
+处理，各机器之间不需要协调，可以写入同一个共享的输出目录。
+
+分片以输出路径（相对于输出目录）为单位，而不是以输入文件为单位：
+多个输入推导出同一个输出文件名时（如 xml2xlsx 中同一目录下的多个
+日期命名文件），它们总在同一个分片中，并按扫描顺序处理，"先到先得"
+的冲突处理与不分片时完全相同。
+
+分片方式:
+    hash  按输出路径的 SHA-1 取模，只依赖路径本身
+    size  按输入大小贪心装箱，使各分片的数据量接近（要求各机器看到相同的输入集合）
+
+分片运行时在输出目录的 _shards 子目录中写出清单（处理范围、计数和
+失败列表），由 shard_merge.py 合并为一份汇总。
+"""
+
+import os
+import json
+import socket
+import hashlib
+import argparse
+from datetime import datetime
+
+SHARD_STRATEGIES = ('hash', 'size')
+DEFAULT_SHARD_STRATEGY = 'hash'
+
+# 分片清单所在的子目录
+MANIFEST_DIR = '_shards'
+
+def shard_key(path, base_dir):
+    """输出路径相对于输出目录的键，各平台统一使用 '/' 分隔"""
+    return os.path.relpath(path, base_dir).replace(os.sep, '/')
+
+def _hash_bin(key, count):
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:16], 16) % count
+
+def _size_bins(sizes, count):
+    """
+    按大小从大到小依次放入当前最小的分片
+
+    Args:
+        sizes: {键: 大小}
+        count: 分片数
+    Returns:
+        {键: 分片序号（从 0 开始）}
+    """
+    loads = [0] * count
+    bins = {}
+    for key, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        target = min(range(count), key=lambda i: (loads[i], i))
+        bins[key] = target
+        loads[target] += size
+    return bins
+
+class Shard:
+    """
+    一个分片
+
+    Attributes:
+        index: 分片序号，从 1 开始
+        count: 分片总数
+        strategy: 'hash' 或 'size'
+    """
+
+    def __init__(self, index=1, count=1, strategy=DEFAULT_SHARD_STRATEGY):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"分片序号须在 1 到 {count} 之间: {index}")
+        if strategy not in SHARD_STRATEGIES:
+            raise ValueError(f"未知的分片方式: {strategy}，可选: {', '.join(SHARD_STRATEGIES)}")
+        self.index = index
+        self.count = count
+        self.strategy = strategy
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    @property
+    def sharded(self):
+        return self.count > 1
+
+    def select(self, items, key, size=None):
+        """
+        选出本分片负责的项，保持原有顺序
+
+        Args:
+            items: 项的列表
+            key: 函数，返回项的分片键（输出路径）；键相同的项总在同一分片
+            size: 函数，返回项的大小，size 方式使用
+        Returns:
+            本分片的项列表
+        """
+        items = list(items)
+        if not self.sharded:
+            return items
+        if self.strategy == 'hash':
+            return [item for item in items if _hash_bin(key(item), self.count) == self.index - 1]
+
+        sizes = {}
+        for item in items:
+            item_key = key(item)
+            sizes[item_key] = sizes.get(item_key, 0) + (size(item) if size else 1)
+        bins = _size_bins(sizes, self.count)
+        return [item for item in items if bins[key(item)] == self.index - 1]
+
+def parse_shard(text):
+    """解析 'i/N' 形式的分片参数"""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+        Shard(index, count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N（1 <= i <= N）: {text}")
+    return index, count
+
+def add_shard_arguments(parser):
+    """向批量脚本的参数解析器添加 --shard 和 --shard-by"""
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                        help='只处理第 i 份输入，如 2/4；同名输出总在同一分片')
+    parser.add_argument('--shard-by', choices=SHARD_STRATEGIES, default=DEFAULT_SHARD_STRATEGY,
+                        help='分片方式：hash 按输出路径哈希，size 按输入大小均衡 (默认 hash)')
+
+def shard_from_args(args):
+    """按命令行参数创建 Shard，未指定 --shard 时为包含全部输入的单个分片"""
+    if args.shard is None:
+        return Shard()
+    index, count = args.shard
+    return Shard(index, count, args.shard_by)
+
+def manifest_path(output_dir, shard):
+    """分片清单的默认路径"""
+    return os.path.join(output_dir, MANIFEST_DIR, f"shard-{shard.index}-of-{shard.count}.json")
+
+def write_manifest(path, shard, command, reporter, outputs, output_dir, started):
+    """
+    写出分片清单
+
+    Args:
+        path: 清单文件路径
+        shard: Shard
+        command: 批量脚本名称
+        reporter: 已完成的 RunReporter
+        outputs: 本分片负责的输出路径列表
+        output_dir: 输出目录，清单中的输出路径相对于它
+        started: 开始时间
+    """
+    manifest = {
+        'command': command,
+        'shard': str(shard),
+        'index': shard.index,
+        'count': shard.count,
+        'strategy': shard.strategy,
+        'host': socket.gethostname(),
+        'started': started.isoformat(timespec='seconds'),
+        'finished': datetime.now().isoformat(timespec='seconds'),
+        'inputs': reporter.total_files,
+        'bytes': reporter.total_bytes,
+        'success': reporter.success_count,
+        'skipped': reporter.skipped_count,
+        'failed': reporter.failed_count,
+        'report': os.path.abspath(reporter.report_path) if reporter.report_path else None,
+        'outputs': [shard_key(output, output_dir) for output in outputs],
+        'failures': reporter.failures,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
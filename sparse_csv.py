@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+稀疏CSV：设备字段只写在设备的第一行
+
+普通CSV中每个端口一行，设备字段（名称、IP地址、类型、MAC、厂商、
+运行状态）在该设备的每一行中重复。稀疏格式在最前面增加一列
+DeviceRow：
+
+    DeviceRow 为 1   新设备的第一行，所有列按原样写出
+    DeviceRow 为空   与上一行属于同一设备，设备字段留空
+
+只要设备字段与上一行不完全相同就写为新设备的第一行，因此不依赖输出
+顺序，空的设备字段（如没有IP地址）也不会和“省略”混淆。读取时把
+DeviceRow 为空的行的设备字段从上一个第一行向下填充，得到与普通CSV
+完全相同的记录：
+
+    iter_filled_records  流式逐行填充，产出与 d_xml2csv.write_csv 相同的字典记录
+    read_filled_frame    用 pandas 一次读入，按列向量化 ffill
+
+两者也接受普通CSV（没有 DeviceRow 列），原样返回。
+
+命令行把稀疏CSV展开为普通CSV：
+
+    python sparse_csv.py input.csv output.csv
+"""
+
+import io
+import sys
+import csv
+import argparse
+
+from csv_output import COMPRESSIONS, open_csv_output
+from memory_budget import PeakMemory
+from xml_sources import open_input
+
+# 标记设备第一行的列
+SPARSE_MARKER = 'DeviceRow'
+
+# 标记列的取值
+FIRST_ROW = '1'
+CONTINUATION_ROW = ''
+
+def sparse_fieldnames(columns):
+    """稀疏CSV的表头"""
+    return [SPARSE_MARKER] + list(columns)
+
+def sparse_rows(rows, device_indexes):
+    """
+    把元组记录转换为稀疏记录
+
+    Args:
+        rows: 元组记录的可迭代对象
+        device_indexes: 设备字段在记录中的位置
+    Yields:
+        开头为 DeviceRow 标记的元组记录
+    """
+    device_indexes = list(device_indexes)
+    width = len(device_indexes)
+    previous = None
+    if device_indexes == list(range(width)):
+        # 设备字段在最前面（默认的列）：直接比较和替换切片
+        blank = (CONTINUATION_ROW,) + ('',) * width
+        for row in rows:
+            device = row[:width]
+            if device != previous:
+                previous = device
+                yield (FIRST_ROW,) + row
+            else:
+                yield blank + row[width:]
+        return
+    device_set = set(device_indexes)
+    for row in rows:
+        device = tuple(row[index] for index in device_indexes)
+        if device != previous:
+            previous = device
+            yield (FIRST_ROW,) + tuple(row)
+        else:
+            yield (CONTINUATION_ROW,) + tuple('' if index in device_set else value
+                                              for index, value in enumerate(row))
+
+def default_device_columns(columns):
+    """columns 中属于设备字段的列（见 d_xml2csv.COLUMN_SOURCES）"""
+    from d_xml2csv import COLUMN_SOURCES
+    return [column for column in columns if column in COLUMN_SOURCES and not COLUMN_SOURCES[column][0]]
+
+def _open_text(csv_file):
+    """以文本方式打开CSV输入（路径可为 .gz/.bz2/.xz 压缩文件），返回 (文本流, 是否需要关闭)"""
+    if isinstance(csv_file, io.TextIOBase):
+        return csv_file, False
+    raw = csv_file if hasattr(csv_file, 'read') else open_input(csv_file)
+    return io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''), True
+
+def iter_filled_records(csv_file, device_columns=None):
+    """
+    逐行读取（稀疏）CSV，并填充省略的设备字段
+
+    Args:
+        csv_file: CSV文件路径、二进制或文本文件对象
+        device_columns: 需要填充的列，默认为表头中的设备字段
+    Yields:
+        {列名: 值}，不含 DeviceRow 列
+    """
+    f, owned = _open_text(csv_file)
+    try:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        if not header or header[0] != SPARSE_MARKER:
+            for row in reader:
+                yield dict(zip(header, row))
+            return
+        columns = header[1:]
+        if device_columns is None:
+            device_columns = default_device_columns(columns)
+        indexes = [columns.index(column) for column in device_columns]
+        device = None
+        for line, row in enumerate(reader, 2):
+            marker, values = row[0], row[1:]
+            if marker == FIRST_ROW:
+                device = [values[index] for index in indexes]
+            elif device is None:
+                raise ValueError(f"第 {line} 行：第一条记录的 {SPARSE_MARKER} 应为 {FIRST_ROW}")
+            else:
+                for index, value in zip(indexes, device):
+                    values[index] = value
+            yield dict(zip(columns, values))
+    finally:
+        if owned:
+            f.close()
+
+def read_filled_frame(csv_file, device_columns=None):
+    """
+    用 pandas 读取（稀疏）CSV，并填充省略的设备字段
+
+    所有列按字符串读取，空值为 ''，与普通CSV读入的结果相同。
+
+    Args:
+        csv_file: CSV文件路径（可为压缩文件）或文件对象
+        device_columns: 需要填充的列，默认为表头中的设备字段
+    Returns:
+        pandas.DataFrame，不含 DeviceRow 列
+    """
+    import pandas as pd
+
+    frame = pd.read_csv(csv_file, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    if frame.columns.empty or frame.columns[0] != SPARSE_MARKER:
+        return frame
+    first = frame.pop(SPARSE_MARKER) == FIRST_ROW
+    if len(frame) and not first.iloc[0]:
+        raise ValueError(f"第 2 行：第一条记录的 {SPARSE_MARKER} 应为 {FIRST_ROW}")
+    if device_columns is None:
+        device_columns = default_device_columns(frame.columns)
+    device_columns = list(device_columns)
+    if device_columns:
+        # 先把省略的值置为缺失，再向下填充
+        frame.loc[~first, device_columns] = None
+        frame[device_columns] = frame[device_columns].ffill()
+    return frame
+
+def expand_csv(csv_file, output_file, compression=None, compresslevel=None):
+    """
+    把稀疏CSV展开为普通CSV
+
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    try:
+        records = iter_filled_records(csv_file)
+        first = next(records, None)
+        if first is None:
+            return False, "CSV文件中没有记录"
+        fieldnames = list(first)
+        count = 1
+        with open_csv_output(output_file, compression, compresslevel) as f:
+            writer = csv.writer(f)
+            writer.writerow(fieldnames)
+            writer.writerow(first.values())
+            for record in records:
+                writer.writerow(record.values())
+                count += 1
+        return True, f"成功将 {count} 条记录写入 CSV 文件"
+    except Exception as e:
+        return False, f"处理失败: {str(e)}"
+
+def main():
+    parser = argparse.ArgumentParser(description='把稀疏CSV展开为每行包含完整设备字段的CSV')
+    parser.add_argument('csv_file', help='输入的（稀疏）CSV文件')
+    parser.add_argument('output_file', help="输出CSV文件，'-' 表示写到标准输出")
+    parser.add_argument('--compress', choices=list(COMPRESSIONS),
+                        help='压缩输出 (输出文件以 .gz/.bz2/.xz 结尾时自动启用)')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    args = parser.parse_args()
+
+    log = sys.stderr if args.output_file == '-' else sys.stdout
+    with PeakMemory() as memory:
+        success, message = expand_csv(args.csv_file, args.output_file, args.compress, args.level)
+    if success:
+        print(f"成功: {message}，{memory.describe()}", file=log)
+    else:
+        print(f"错误: {message}", file=log)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
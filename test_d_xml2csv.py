@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 d_xml2csv 流式引擎的外部排序：有序段溢出到临时文件时，输出与内存中排序逐字节相同
+
+运行: python -m pytest test_d_xml2csv.py
+"""
+
+import csv
+import io
+
+import pytest
+
+import d_xml2csv
+
+def _device(name, ip, ports):
+    port_elements = ''.join(
+        f'<Port><PortID>{port_id}</PortID><PortDesc>{desc}</PortDesc></Port>' for port_id, desc in ports)
+    return (f'<Device><NameOfStation>{name}</NameOfStation><IpAddress>{ip}</IpAddress>'
+            f'<Interfaces><PnInterface><PortList>{port_elements}</PortList></PnInterface></Interfaces></Device>')
+
+# 乱序的设备名称，数字位数不同的端口ID（自然排序与字典序不同），以及排序键完全相同的端口
+DEVICES = [
+    _device('plc-10', '10.0.0.10', [('port-10', 'a'), ('port-2', 'b'), ('port-1', 'c')]),
+    _device('plc-2', '10.0.0.2', [('port-3', 'd'), ('port-3', 'e'), ('port-20', 'f')]),
+    _device('plc-10', '10.0.0.10', [('port-2', 'g'), ('port-10', 'h')]),
+    _device('plc-1', '10.0.0.1', []),
+    _device('plc-2', '10.0.0.1', [('port-9', 'i'), ('port-11', 'j'), ('port-9', 'k')]),
+    _device('plc-1', '10.0.0.1', [('port-1', 'l'), ('port-1', 'm')]),
+]
+CONTENT = ('<Root><DeviceCollection>' + ''.join(DEVICES) + '</DeviceCollection></Root>').encode('utf-8')
+
+def _convert(tmp_path, name, **options):
+    path = tmp_path / name
+    success, message = d_xml2csv.xml_to_csv(CONTENT, str(path), **options)
+    assert success, message
+    return path.read_bytes()
+
+@pytest.fixture
+def spilled_runs(monkeypatch):
+    """统计写入临时文件的有序段数"""
+    runs = []
+    spill_run = d_xml2csv._spill_run
+    def counting_spill_run(run, key):
+        runs.append(len(run))
+        return spill_run(run, key)
+    monkeypatch.setattr(d_xml2csv, '_spill_run', counting_spill_run)
+    return runs
+
+@pytest.mark.parametrize('order', ['sorted', 'natural'])
+def test_external_sort_matches_in_memory_sort(tmp_path, spilled_runs, order):
+    expected = _convert(tmp_path, 'tree.csv', engine='tree', order=order)
+    actual = _convert(tmp_path, 'stream.csv', engine='stream', order=order, run_size=2)
+    assert len(spilled_runs) >= 3
+    assert actual == expected
+
+    # 内存足够时不使用临时文件
+    del spilled_runs[:]
+    assert _convert(tmp_path, 'memory.csv', engine='stream', order=order) == expected
+    assert spilled_runs == []
+
+def test_document_order_is_kept(tmp_path, spilled_runs):
+    output = _convert(tmp_path, 'document.csv', engine='stream', order='document', run_size=2)
+    assert spilled_runs == []
+    rows = list(csv.DictReader(io.StringIO(output.decode('utf-8-sig'))))
+    assert [row['Port_Desc'] for row in rows if row['Port_Desc']] == list('abcdefghijklm')
+    assert output == _convert(tmp_path, 'tree.csv', engine='tree', order='document')
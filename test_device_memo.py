@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 device_memo 只重新提取变化了的设备，输出与不使用设备缓存时逐字节相同
+
+运行: python -m pytest test_device_memo.py
+"""
+
+import xml.etree.ElementTree as ET
+from functools import partial
+
+import pytest
+
+import xml2csv
+from device_memo import DeviceStore, MemoStats, memoized_models
+
+DEVICE_COUNT = 8
+
+def _device(index, name=None, extra=''):
+    name = name or f'dev-{index}'
+    return (f'  <Device>\n    <NameOfStation>{name}</NameOfStation><IpAddress>10.0.0.{index}</IpAddress>{extra}\n'
+            f'    <Interfaces><PnInterface><PortList><Port><PortID>port-{index}</PortID>'
+            f'<PortDesc>说明&#x41;{index}</PortDesc></Port></PortList></PnInterface></Interfaces>\n  </Device>\n')
+
+def _document(devices):
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<Root>\n<DeviceCollection>\n' + ''.join(devices) +
+            '</DeviceCollection>\n</Root>\n').encode('utf-8')
+
+DEVICES = [_device(index) for index in range(DEVICE_COUNT)]
+
+def _write(tmp_path, name, devices):
+    path = tmp_path / name
+    path.write_bytes(_document(devices))
+    return str(path)
+
+def _memoized(store, path, engine):
+    stats = MemoStats()
+    models = list(memoized_models(store, path, xml2csv._profile(engine),
+                                  partial(xml2csv.extract_models, engine=engine), stats))
+    return models, stats
+
+@pytest.fixture
+def store(tmp_path):
+    return DeviceStore(str(tmp_path / 'memo' / 'devices.sqlite'))
+
+@pytest.mark.parametrize('engine', ['tree', 'stream'])
+def test_only_changed_devices_are_extracted(tmp_path, store, engine):
+    first = _write(tmp_path, 'first.xml', DEVICES)
+    models, stats = _memoized(store, first, engine)
+    assert stats.applied and stats.devices == DEVICE_COUNT and stats.reused == 0
+    assert models == list(xml2csv.extract_models(first, engine=engine))
+
+    changed = list(DEVICES)
+    changed[5] = _device(5, name='renamed')
+    second = _write(tmp_path, 'second.xml', changed)
+    models, stats = _memoized(store, second, engine)
+    # 第一个设备总是重新提取
+    assert stats.devices == DEVICE_COUNT and stats.reused == DEVICE_COUNT - 2
+    assert models == list(xml2csv.extract_models(second, engine=engine))
+
+    outputs = {}
+    for name, device_store in (('memo', store), ('plain', None)):
+        output = tmp_path / f'{name}.csv'
+        success, message = xml2csv.convert_file(second, str(output), engine=engine, device_store=device_store)
+        assert success, message
+        outputs[name] = output.read_bytes()
+    assert outputs['memo'] == outputs['plain']
+
+def test_parse_error_reparses_original_file(tmp_path, store):
+    _memoized(store, _write(tmp_path, 'first.xml', DEVICES), 'stream')
+
+    broken = list(DEVICES)
+    broken[6] = _device(6, extra='<RunState>run</Run>')
+    path = _write(tmp_path, 'broken.xml', broken)
+    with pytest.raises(ET.ParseError) as whole:
+        list(xml2csv.extract_models(path, engine='stream'))
+
+    sources = []
+    def extract(source):
+        sources.append(source)
+        return xml2csv.extract_models(source, engine='stream')
+
+    with pytest.raises(ET.ParseError) as memoized:
+        list(memoized_models(store, path, xml2csv._profile('stream'), extract))
+    # 先解析拼接的文档（只有第一个和出错的设备），出错后对原文件整体重新解析
+    assert isinstance(sources[0], bytes) and sources[1:] == [path]
+    assert memoized.value.position == whole.value.position
+    assert str(memoized.value) == str(whole.value)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 --shard i/N 的各分片互不重叠、合起来覆盖全部输入，推导出同一个输出文件的输入总在同一分片
+
+运行: python -m pytest test_sharding.py
+"""
+
+import os
+from datetime import datetime
+from functools import partial
+
+import pytest
+
+import xml2xlsx
+from run_report import RunReporter
+from shard_merge import load_manifests, merge_manifests
+from sharding import SHARD_STRATEGIES, Shard, manifest_path, write_manifest
+from xml_sources import inputs_in_directory
+
+def _make_tree(xml_dir):
+    """各区域的工厂目录中有多个日期命名的文件（输出到同一个 <工厂>.xlsx），另有非日期命名的文件"""
+    files = []
+    for region in ('north', 'south', 'east'):
+        for plant in range(4):
+            for day in range(1, 2 + plant % 3):
+                files.append(os.path.join(region, f'plant{plant}', f'2024010{day}.xml'))
+        files.append(os.path.join(region, f'{region}-summary.xml'))
+    files.append('root.xml')
+    for index, name in enumerate(files):
+        path = os.path.join(xml_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'<Root/>' + b' ' * (index * 37 % 101))
+
+def _planned(xml_dir, excel_dir):
+    """与 xml2xlsx.main 相同的扫描和输出路径推导"""
+    inputs = []
+    for root, dirs, files in os.walk(xml_dir):
+        dirs.sort()
+        inputs.extend(inputs_in_directory(root, sorted(files), xml_dir))
+    return [(xml_input,) + xml2xlsx.output_file_for(xml_input, excel_dir) for xml_input in inputs]
+
+@pytest.mark.parametrize('strategy', SHARD_STRATEGIES)
+@pytest.mark.parametrize('count', [2, 3, 5])
+def test_shards_partition_inputs(tmp_path, strategy, count):
+    xml_dir, excel_dir = str(tmp_path / 'xml'), str(tmp_path / 'excel')
+    _make_tree(xml_dir)
+    items = _planned(xml_dir, excel_dir)
+    key = partial(xml2xlsx._output_key, excel_dir=excel_dir)
+    # 同一工厂的日期文件推导出同一个输出文件
+    assert len({key(item) for item in items}) < len(items)
+
+    shards = [Shard(index, count, strategy).select(items, key=key, size=lambda item: item[0].size)
+              for index in range(1, count + 1)]
+    selected = [item[0].rel_path for shard in shards for item in shard]
+    assert sorted(selected) == sorted(item[0].rel_path for item in items)
+    assert len(selected) == len(set(selected))
+    assert sum(1 for shard in shards if shard) > 1
+    for shard in shards:
+        # 分片内保持扫描顺序
+        assert shard == [item for item in items if item in shard]
+
+    owners = {}
+    for index, shard in enumerate(shards, 1):
+        for item in shard:
+            owners.setdefault(key(item), set()).add(index)
+    assert all(len(indexes) == 1 for indexes in owners.values())
+
+    # 各分片的清单合并后没有缺少的分片，也没有由多个分片负责的输出
+    started = datetime.now()
+    for index, shard in enumerate(shards, 1):
+        with RunReporter('quiet') as reporter:
+            reporter.set_total(len(shard))
+            for xml_input, xlsx_file, _ in shard:
+                reporter.finished(xml_input, xlsx_file, True, "处理成功")
+        outputs = list(dict.fromkeys(xlsx_file for _, xlsx_file, _ in shard))
+        shard_info = Shard(index, count, strategy)
+        write_manifest(manifest_path(excel_dir, shard_info), shard_info, 'xml2xlsx', reporter, outputs,
+                       excel_dir, started)
+    summary = merge_manifests(load_manifests([excel_dir]))
+    assert summary['missing'] == [] and summary['conflicts'] == []
+    assert summary['outputs'] == len(owners)
+    assert summary['totals']['inputs'] == len(items)
+
+def test_unsharded_selects_everything(tmp_path):
+    items = list(range(10))
+    assert Shard().select(items, key=str) == items
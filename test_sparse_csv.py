@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 d_xml2csv --sparse 的输出填充设备字段后与普通CSV完全相同
+
+运行: python -m pytest test_sparse_csv.py
+"""
+
+import csv
+
+import pandas as pd
+import pytest
+
+import d_xml2csv
+from sparse_csv import SPARSE_MARKER, expand_csv, iter_filled_records, read_filled_frame
+
+def _device(name, ip='', ports=()):
+    port_elements = ''.join(f'<Port><PortID>{port}</PortID><OperStatus>up</OperStatus></Port>' for port in ports)
+    interfaces = ''
+    if ports:
+        interfaces = f'<Interfaces><PnInterface><PortList>{port_elements}</PortList></PnInterface></Interfaces>'
+    return (f'<Device><NameOfStation>{name}</NameOfStation><IpAddress>{ip}</IpAddress>'
+            f'<DeviceType>S7</DeviceType>{interfaces}</Device>')
+
+# 没有端口的设备、没有IP地址的设备，以及两个字段完全相同的相邻设备
+CONTENT = ('<Root><DeviceCollection>' + ''.join([
+    _device('plc-1', '10.0.0.1', ['p1', 'p2', 'p3']),
+    _device('no-ports', '10.0.0.2'),
+    _device('no-ports', '10.0.0.2'),
+    _device('twin', '10.0.0.3', ['p1']),
+    _device('twin', '10.0.0.3', ['p2', 'p3']),
+    _device('no-ip', '', ['p1', 'p2']),
+    _device('plc-0', '10.0.0.9', ['p9']),
+]) + '</DeviceCollection></Root>').encode('utf-8')
+
+def _convert(tmp_path, name, **options):
+    path = tmp_path / name
+    success, message = d_xml2csv.xml_to_csv(CONTENT, str(path), **options)
+    assert success, message
+    return str(path)
+
+@pytest.mark.parametrize('engine', ['tree', 'stream'])
+@pytest.mark.parametrize('order', d_xml2csv.ORDERS)
+def test_filled_sparse_output_equals_dense_csv(tmp_path, engine, order):
+    dense = _convert(tmp_path, 'dense.csv', engine=engine, order=order)
+    sparse = _convert(tmp_path, 'sparse.csv', engine=engine, order=order, sparse=True)
+
+    with open(sparse, encoding='utf-8-sig', newline='') as f:
+        header = next(csv.reader(f))
+    assert header[0] == SPARSE_MARKER
+
+    expected = pd.read_csv(dense, dtype=str, keep_default_na=False, encoding='utf-8-sig')
+    assert len(expected) == 11
+    pd.testing.assert_frame_equal(read_filled_frame(sparse), expected)
+
+    with open(dense, encoding='utf-8-sig', newline='') as f:
+        assert list(iter_filled_records(sparse)) == list(csv.DictReader(f))
+
+    expanded = tmp_path / 'expanded.csv'
+    success, message = expand_csv(sparse, str(expanded))
+    assert success, message
+    with open(dense, 'rb') as f:
+        assert expanded.read_bytes() == f.read()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 xlsx_assembly 拼接的区域工作簿中每个工作表与单独用 xml_to_xlsx 转换的结果相同
+
+运行: python -m pytest test_xlsx_assembly.py
+"""
+
+import openpyxl
+import pytest
+
+from xlsx_assembly import assemble_workbook, render_sheet_part, sheet_names
+from xlsx_grouping import GROUPINGS
+from xml2xlsx import xml_to_xlsx
+
+def _plant(prefix, port_counts):
+    devices = []
+    for index, count in enumerate(port_counts):
+        ports = ''.join(f'<Port><PortID>port-{port}</PortID><PortDesc>{prefix} 端口 {port}</PortDesc></Port>'
+                        for port in range(1, count + 1))
+        devices.append(f'<Device><NameOfStation>{prefix}-{index}</NameOfStation>'
+                       f'<IpAddress>10.0.{index}.1</IpAddress><DeviceType>S7 &amp; ET200</DeviceType>'
+                       f'<Interfaces><PnInterface><PortList>{ports}</PortList></PnInterface></Interfaces>'
+                       f'</Device>')
+    return ('<Root><DeviceCollection>' + ''.join(devices) + '</DeviceCollection></Root>').encode('utf-8')
+
+# 名称需要清理的工厂；设备有 0 到 4 个端口，分组和合并区域各不相同
+PLANTS = {
+    'north/plant:1': _plant('n', [3, 1, 0, 4]),
+    'south': _plant('s', [2, 2]),
+    'east': _plant('e', [0, 5, 1]),
+}
+
+def _sheet_contents(ws):
+    """单元格的值和样式、合并区域、行的大纲层级和列宽"""
+    cells = [[(cell.value, cell.fill.fill_type, cell.fill.fgColor.rgb, cell.font.b) for cell in row]
+             for row in ws.iter_rows()]
+    outline = {index: dimension.outline_level for index, dimension in ws.row_dimensions.items()
+               if dimension.outline_level}
+    widths = {letter: dimension.width for letter, dimension in ws.column_dimensions.items()}
+    return cells, sorted(str(cell_range) for cell_range in ws.merged_cells.ranges), outline, widths
+
+@pytest.mark.parametrize('grouping', GROUPINGS)
+def test_assembled_sheets_match_standalone_workbooks(tmp_path, grouping):
+    names = sheet_names(list(PLANTS))
+    assert names == ['north_plant_1', 'south', 'east']
+
+    parts = []
+    expected = {}
+    for name, content in zip(names, PLANTS.values()):
+        part_file = str(tmp_path / f'{name}.part')
+        success, message = render_sheet_part(content, part_file, grouping=grouping)
+        assert success, message
+        parts.append((name, part_file))
+
+        standalone = str(tmp_path / f'{name}.xlsx')
+        success, message = xml_to_xlsx(content, standalone, grouping=grouping)
+        assert success, message
+        expected[name] = _sheet_contents(openpyxl.load_workbook(standalone).active)
+
+    region = str(tmp_path / 'region.xlsx')
+    assemble_workbook(parts, region)
+    wb = openpyxl.load_workbook(region)
+    assert wb.sheetnames == names
+    for name in names:
+        assert _sheet_contents(wb[name]) == expected[name]
+
+    if grouping == 'band':
+        # 交替底色确实写进了拼接后的样式表
+        fills = {cell.fill.fgColor.rgb for row in wb['north_plant_1'].iter_rows(min_row=2) for cell in row}
+        assert 'FFDDEBF7' in fills
+    elif grouping == 'merge':
+        assert wb['east'].merged_cells.ranges
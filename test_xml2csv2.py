@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 xml2csv2 的订单号、固件版本和硬件版本与 device.find('.//字段名').text 一致
+
+运行: python -m pytest test_xml2csv2.py
+"""
+
+import io
+import csv
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import xml2csv2
+from xml_backends import BACKENDS, DESCENDANT_FIELDS, get_backend
+
+# Device 的直接叶子、排在 ImRecord 之前的 Modules、嵌套的非叶子元素
+FIXTURE = (
+    '<Root><DeviceCollection>'
+    '<Device><NameOfStation>direct</NameOfStation><OrderID>DEV-ORDER</OrderID>'
+    '<Modules><Module><OrderID>MODULE</OrderID><HardwareRevision>MOD-HW</HardwareRevision></Module></Modules>'
+    '<ImRecord><OrderID>IM</OrderID><SoftwareRevision>IM-SW</SoftwareRevision>'
+    '<HardwareRevision>IM-HW</HardwareRevision></ImRecord>'
+    '<PnInterface><PortList><Port><PortID>p1</PortID></Port></PortList></PnInterface></Device>'
+    '<Device><NameOfStation>modules-first</NameOfStation>'
+    '<Modules><Module><OrderID>MODULE</OrderID></Module></Modules>'
+    '<ImRecord><OrderID>IM</OrderID></ImRecord>'
+    '<PnInterface><PortList><Port><PortID>p1</PortID></Port></PortList></PnInterface></Device>'
+    '<Device><NameOfStation>nested</NameOfStation>'
+    '<Info><SoftwareRevision>outer<Detail>x</Detail>tail</SoftwareRevision></Info>'
+    '<Extra><OrderID/></Extra><ImRecord><OrderID>IM</OrderID></ImRecord>'
+    '<PnInterface><PortList><Port><PortID>p1</PortID></Port></PortList></PnInterface></Device>'
+    '</DeviceCollection></Root>').encode('utf-8')
+
+def _expected():
+    """基线实现的查找方式"""
+    expected = []
+    for device in ET.fromstring(FIXTURE).find('DeviceCollection').findall('Device'):
+        values = {}
+        for field in DESCENDANT_FIELDS:
+            element = device.find('.//' + field)
+            values[field] = (element.text or '') if element is not None else ''
+        expected.append(values)
+    return expected
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_descendant_fields_follow_document_order(backend):
+    models = list(get_backend(backend).iter_devices(FIXTURE))
+    actual = [{field: xml2csv2._first_descendant_text(model, field) for field in DESCENDANT_FIELDS}
+              for model in models]
+    assert actual == _expected()
+    assert actual[2]['SoftwareRevision'] == 'outer'
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_order_id_column(backend):
+    output = io.StringIO(newline='')
+    success, message = xml2csv2.xml_to_csv(FIXTURE, output, backend=backend)
+    assert success, message
+
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    column = rows[0].index('订单号')
+    device_rows = [row for row in rows[1:] if row[1]]
+    assert [row[column] for row in device_rows] == ['DEV-ORDER', 'MODULE', '']
+
+# Modules 之外的 Module 排在前面，与 device.findall('.//Module') 的文档顺序一致
+RACK_FIXTURE = (
+    '<Root><DeviceCollection><Device><NameOfStation>rack</NameOfStation>'
+    '<Rack><Module><OrderID>R1</OrderID></Module></Rack>'
+    '<Modules><Module><OrderID>M1</OrderID></Module><Module><OrderID>M2</OrderID></Module></Modules>'
+    '<PnInterface><PortList><Port><PortID>p1</PortID></Port><Port><PortID>p2</PortID></Port>'
+    '<Port><PortID>p3</PortID></Port><Port><PortID>p4</PortID></Port></PortList></PnInterface>'
+    '</Device></DeviceCollection></Root>').encode('utf-8')
+
+@pytest.mark.parametrize('backend', sorted(BACKENDS))
+def test_module_columns_follow_document_order(backend):
+    output = io.StringIO(newline='')
+    success, message = xml2csv2.xml_to_csv(RACK_FIXTURE, output, backend=backend)
+    assert success, message
+
+    rows = list(csv.reader(io.StringIO(output.getvalue())))
+    column = rows[0].index('订货号')
+    assert [row[column] for row in rows[1:5]] == ['R1', 'M1', 'M2', '']
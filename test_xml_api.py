@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 xml_api：各种输入方式产出相同的记录，错误转换为带类型的异常，convert_many 返回失败的任务
+
+运行: python -m pytest test_xml_api.py
+"""
+
+import io
+import asyncio
+
+import pytest
+
+from xml_api import (ConversionError, DeviceStructureError, EntityRefusedError, NoDevicesError, XmlSyntaxError,
+                     aiter_records, convert, convert_many, iter_records)
+
+def _device(index, ports):
+    port_elements = ''.join(f'<Port><PortID>port-{port}</PortID><OperStatus>{"down" if port % 2 else "up"}'
+                            f'</OperStatus></Port>' for port in range(ports))
+    return (f'<Device><NameOfStation>dev-{index}</NameOfStation><IpAddress>10.0.0.{index}</IpAddress>'
+            f'<Interfaces><PnInterface><PortList>{port_elements}</PortList></PnInterface></Interfaces></Device>')
+
+CONTENT = ('<?xml version="1.0" encoding="utf-8"?>\n<Root><DeviceCollection>\n' +
+           '\n'.join(_device(index, index % 4) for index in range(12)) +
+           '\n</DeviceCollection></Root>\n').encode('utf-8')
+
+# 第 3 行第 21 列（从 0 开始）的 </Run> 与开始标签不匹配
+SYNTAX_ERROR = b'<Root>\n<DeviceCollection>\n<Device><RunState>x</Run></Device>\n</DeviceCollection></Root>'
+ENTITY = b'<!DOCTYPE Root [<!ENTITY x "expanded">]>\n<Root><DeviceCollection/></Root>'
+NO_COLLECTION = b'<Root><Device/></Root>'
+NO_DEVICES = b'<Root><DeviceCollection></DeviceCollection></Root>'
+
+async def _collect(records):
+    return [record async for record in records]
+
+async def _chunks(data, size):
+    for start in range(0, len(data), size):
+        await asyncio.sleep(0)
+        yield data[start:start + size]
+
+async def _stream_records(data, **options):
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return await _collect(aiter_records(reader, chunk_size=64, **options))
+
+def test_all_inputs_produce_the_same_records(tmp_path):
+    expected = list(iter_records(CONTENT))
+    # 没有端口的设备保留一条记录
+    assert len(expected) == sum(max(index % 4, 1) for index in range(12))
+
+    path = tmp_path / 'plant.xml'
+    path.write_bytes(CONTENT)
+    assert list(iter_records(io.BytesIO(CONTENT))) == expected
+    assert list(iter_records(str(path))) == expected
+    assert asyncio.run(_collect(aiter_records(CONTENT, chunk_size=7))) == expected
+    assert asyncio.run(_collect(aiter_records(_chunks(CONTENT, 13)))) == expected
+    assert asyncio.run(_collect(aiter_records(io.BytesIO(CONTENT), chunk_size=100))) == expected
+    assert asyncio.run(_collect(aiter_records(str(path)))) == expected
+    assert asyncio.run(_stream_records(CONTENT)) == expected
+
+def test_columns_and_where_apply_to_every_input():
+    options = {'columns': ['NameOfStation', 'Port_ID'], 'where': ['OperStatus=down']}
+    expected = list(iter_records(CONTENT, **options))
+    assert expected and all(list(record) == options['columns'] for record in expected)
+    assert asyncio.run(_collect(aiter_records(_chunks(CONTENT, 5), **options))) == expected
+    assert asyncio.run(_stream_records(CONTENT, **options)) == expected
+
+def _errors(content):
+    """同步和异步接口抛出的异常"""
+    with pytest.raises(ConversionError) as sync:
+        list(iter_records(content))
+    with pytest.raises(ConversionError) as streamed:
+        asyncio.run(_collect(aiter_records(_chunks(content, 8))))
+    return sync.value, streamed.value
+
+def test_typed_errors():
+    for error in _errors(SYNTAX_ERROR):
+        assert type(error) is XmlSyntaxError
+        assert error.position == (3, 21)
+
+    for error in _errors(ENTITY):
+        assert isinstance(error, EntityRefusedError) and isinstance(error, XmlSyntaxError)
+        assert error.position[0] == 1
+
+    for error in _errors(NO_COLLECTION):
+        assert type(error) is DeviceStructureError
+
+def test_no_devices_and_xlsx_output(tmp_path):
+    with pytest.raises(NoDevicesError):
+        convert(NO_DEVICES, str(tmp_path / 'empty.csv'))
+    with pytest.raises(NoDevicesError):
+        convert(CONTENT, str(tmp_path / 'filtered.csv'), where=['NameOfStation=missing'])
+    convert(io.BytesIO(CONTENT), str(tmp_path / 'plant.xlsx'), format='xlsx')
+    assert (tmp_path / 'plant.xlsx').stat().st_size > 0
+
+async def _convert_all(jobs, **options):
+    return [result async for result in convert_many(jobs, workers=2, **options)]
+
+def test_convert_many_returns_exceptions(tmp_path):
+    sources = [CONTENT, SYNTAX_ERROR, io.BytesIO(CONTENT), NO_DEVICES, _chunks(NO_COLLECTION, 4)]
+    jobs = [(source, str(tmp_path / f'{index}.csv')) for index, source in enumerate(sources)]
+    results = sorted(asyncio.run(_convert_all(jobs, return_exceptions=True)), key=lambda result: result.index)
+
+    assert [result.index for result in results] == list(range(len(sources)))
+    assert [result.output for result in results] == [output for _, output in jobs]
+    assert [type(result.error) for result in results] == [
+        type(None), XmlSyntaxError, type(None), NoDevicesError, DeviceStructureError]
+    assert results[1].error.position == (3, 21)
+    for result in results:
+        if result.error is None:
+            assert result.message and result.seconds >= 0
+        else:
+            assert (result.error.index, result.error.output) == (result.index, result.output)
+    with open(results[0].output, 'rb') as first, open(results[2].output, 'rb') as second:
+        assert first.read() == second.read()
+
+def test_convert_many_raises_first_failure(tmp_path):
+    jobs = [(SYNTAX_ERROR, str(tmp_path / 'bad.csv'))]
+    with pytest.raises(XmlSyntaxError) as raised:
+        asyncio.run(_convert_all(jobs))
+    assert (raised.value.index, raised.value.output) == (0, str(tmp_path / 'bad.csv'))
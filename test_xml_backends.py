@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 etree 和 expat 两个解析后端对同一份XML产出完全相同的设备模型和CSV记录
+
+运行: python -m pytest test_xml_backends.py
+"""
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from d_xml2csv import records_from_models
+from xml_backends import BACKENDS, EntityError, StructureError, compare_backends, get_backend, iter_ports
+
+def _document(*devices, prolog=''):
+    return (prolog + '<Root><DeviceCollection>' + ''.join(devices) +
+            '</DeviceCollection></Root>').encode('utf-8')
+
+# 各种边界情况的设备
+FIXTURES = {
+    'empty_im_record_and_modules': _document(
+        '<Device><NameOfStation>plc-1</NameOfStation><ImRecord/><Modules></Modules></Device>'),
+    'interface_without_port_list': _document(
+        '<Device><NameOfStation>plc-2</NameOfStation>'
+        '<PnInterface><Name>X1</Name></PnInterface>'
+        '<PnInterface><PortList/></PnInterface>'
+        '<PnInterface><PortList><Port><PortID>port-001</PortID></Port></PortList></PnInterface>'
+        '</Device>'),
+    'duplicate_children': _document(
+        '<Device><NameOfStation>first</NameOfStation><NameOfStation>second</NameOfStation>'
+        '<ImRecord><OrderID>A</OrderID><OrderID>B</OrderID></ImRecord><ImRecord><OrderID>C</OrderID></ImRecord>'
+        '<Modules><Module><ModuleName>m1</ModuleName></Module></Modules>'
+        '<Modules><Module><ModuleName>m2</ModuleName></Module></Modules>'
+        '<PnInterface><PortList><Port><PortID>p1</PortID><PortID>p2</PortID></Port></PortList>'
+        '<PortList><Port><PortID>p3</PortID></Port></PortList></PnInterface>'
+        '</Device>'),
+    'unusual_device_placement': (
+        '<Root><Device><NameOfStation>outside</NameOfStation></Device>'
+        '<DeviceCollection>'
+        '<Device><NameOfStation>outer</NameOfStation>'
+        '<Device><NameOfStation>nested</NameOfStation></Device>'
+        '<Group><PnInterface><PortList><Port><PortID>deep</PortID></Port></PortList>'
+        '<PnInterface><PortList><Port><PortID>inner</PortID></Port></PortList></PnInterface>'
+        '</PnInterface></Group>'
+        '</Device>'
+        '<Other><Device><NameOfStation>other</NameOfStation></Device></Other>'
+        '</DeviceCollection>'
+        '<DeviceCollection><Device><NameOfStation>second-collection</NameOfStation></Device></DeviceCollection>'
+        '</Root>').encode('utf-8'),
+    'character_references': _document(
+        '<Device><NameOfStation>a&amp;b &lt;c&gt; &quot;d&quot; &apos;e&apos;</NameOfStation>'
+        '<DeviceType>&#x41;&#66;&#x4e2d;</DeviceType><MAC><![CDATA[00:11 <raw>]]></MAC>'
+        '<PnInterface><PortList><Port><PortDesc>  spaced\n text  </PortDesc><PortID/></Port></PortList>'
+        '</PnInterface></Device>'),
+    'mixed_content_and_attributes': _document(
+        '<Device id="1"><NameOfStation>plc<!-- note -->-3</NameOfStation>'
+        '<IpAddress>10.0.0.1<Extra/></IpAddress><?pi data?>'
+        '<ImRecord><OrderID>6ES7</OrderID><Nested><OrderID>inner</OrderID></Nested></ImRecord></Device>'),
+    'no_devices': _document(),
+}
+
+# 模块自带的 PnInterface：CSV 只取 Device/Interfaces 下的端口，XLSX 取所有端口
+MODULE_INTERFACES = _document(
+    '<Device><NameOfStation>plc-4</NameOfStation>'
+    '<Modules><Module><ModuleName>m1</ModuleName><Interfaces><PnInterface><PortList>'
+    '<Port><PortID>mp1</PortID></Port></PortList></PnInterface></Interfaces></Module></Modules>'
+    '<Interfaces><PnInterface><PortList><Port><PortID>p1</PortID></Port></PortList></PnInterface></Interfaces>'
+    '<Interfaces><PnInterface><PortList><Port><PortID>second</PortID></Port></PortList></PnInterface></Interfaces>'
+    '</Device>')
+
+def _models(name, content, fields=None):
+    return list(get_backend(name).iter_devices(content, fields))
+
+@pytest.mark.parametrize('fixture', sorted(FIXTURES))
+def test_backends_produce_identical_models(fixture):
+    content = FIXTURES[fixture]
+    same, message = compare_backends(content)
+    assert same, message
+
+@pytest.mark.parametrize('fixture', sorted(FIXTURES))
+def test_backends_produce_identical_rows(fixture):
+    content = FIXTURES[fixture]
+    rows = {name: records_from_models(_models(name, content), 'document') for name in BACKENDS}
+    assert rows['etree'] == rows['expat']
+
+@pytest.mark.parametrize('fixture', sorted(FIXTURES))
+def test_backends_agree_on_selected_fields(fixture):
+    content = FIXTURES[fixture]
+    fields = {'NameOfStation', 'OrderID', 'PortID'}
+    assert _models('etree', content, fields) == _models('expat', content, fields)
+
+def test_fixture_expectations():
+    # 防止两个后端以同样的方式出错
+    [model] = _models('expat', FIXTURES['interface_without_port_list'])
+    assert model['interfaces'] == [None, [], [{'PortID': 'port-001'}]]
+
+    [model] = _models('expat', FIXTURES['duplicate_children'])
+    assert model['device']['NameOfStation'] == 'first'
+    assert model['im_record'] == {'OrderID': 'A'}
+    assert model['modules'] == [{'ModuleName': 'm1'}]
+    assert model['interfaces'] == [[{'PortID': 'p1'}]]
+
+    models = _models('expat', FIXTURES['unusual_device_placement'])
+    assert [model['device']['NameOfStation'] for model in models] == ['outer']
+    assert models[0]['interfaces'] == [[{'PortID': 'deep'}], [{'PortID': 'inner'}]]
+
+    [model] = _models('expat', FIXTURES['character_references'])
+    assert model['device']['NameOfStation'] == 'a&b <c> "d" \'e\''
+    assert model['device']['DeviceType'] == 'AB中'
+    assert model['device']['MAC'] == '00:11 <raw>'
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_csv_reads_only_device_interfaces(name):
+    [model] = _models(name, MODULE_INTERFACES)
+    assert model['direct_interfaces'] == [False, True, False]
+    assert [port['PortID'] for port in iter_ports(model)] == ['mp1', 'p1', 'second']
+    assert [port['PortID'] for port in iter_ports(model, direct_only=True)] == ['p1']
+
+    # 与基线 d_xml2csv 的 device.find('Interfaces').findall('PnInterface') 一致
+    records = records_from_models(_models(name, MODULE_INTERFACES), 'document')
+    assert [record['Port_ID'] for record in records] == ['p1']
+
+# 设备不都在 DeviceCollection 下，但没有嵌套的 Device
+SCATTERED_DEVICES = (
+    '<Root><Device><NameOfStation>before</NameOfStation></Device>'
+    '<Site><Device><NameOfStation>in-site</NameOfStation>'
+    '<PnInterface><PortList><Port><PortID>p1</PortID></Port></PortList></PnInterface></Device></Site>'
+    '<DeviceCollection><Device><NameOfStation>listed</NameOfStation></Device></DeviceCollection>'
+    '<DeviceCollection><Device><NameOfStation>second</NameOfStation></Device></DeviceCollection>'
+    '</Root>').encode('utf-8')
+
+def _names(models):
+    return [model['device'].get('NameOfStation') for model in models]
+
+def test_all_devices_matches_findall():
+    models = {name: list(get_backend(name).iter_devices(SCATTERED_DEVICES, all_devices=True)) for name in BACKENDS}
+    assert models['etree'] == models['expat']
+    assert _names(models['expat']) == ['before', 'in-site', 'listed', 'second']
+
+    # 没有 DeviceCollection 也不报错
+    for name in BACKENDS:
+        assert _names(get_backend(name).iter_devices(b'<Root><Device/></Root>', all_devices=True)) == [None]
+
+def test_all_devices_emits_nested_devices():
+    content = FIXTURES['unusual_device_placement']
+    etree_models = list(get_backend('etree').iter_devices(content, all_devices=True))
+    expat_models = list(get_backend('expat').iter_devices(content, all_devices=True))
+    assert _names(etree_models) == ['outside', 'outer', 'nested', 'other', 'second-collection']
+    assert expat_models == etree_models
+
+# 多层嵌套的 Device，内层的接口、模块和订单号同时属于外层设备
+NESTED_DEVICES = (
+    '<Root><Device><NameOfStation>A</NameOfStation>'
+    '<Device><NameOfStation>A1</NameOfStation><OrderID>A1-ORDER</OrderID>'
+    '<Modules><Module><ModuleName>a1m</ModuleName></Module></Modules>'
+    '<Interfaces><PnInterface><PortList><Port><PortID>a1p</PortID></Port></PortList></PnInterface></Interfaces>'
+    '<Device><NameOfStation>A11</NameOfStation><Device/></Device></Device>'
+    '<Interfaces><PnInterface><PortList><Port><PortID>ap</PortID></Port></PortList></PnInterface></Interfaces>'
+    '<Device/></Device>'
+    '<Device><NameOfStation>Z</NameOfStation></Device></Root>').encode('utf-8')
+
+def test_nested_devices_match_findall():
+    models = {name: list(get_backend(name).iter_devices(NESTED_DEVICES, all_devices=True)) for name in BACKENDS}
+    assert models['expat'] == models['etree']
+    assert _names(models['expat']) == ['A', 'A1', 'A11', None, None, 'Z']
+    outer = models['expat'][0]
+    assert [port['PortID'] for port in iter_ports(outer)] == ['a1p', 'ap']
+    assert [port['PortID'] for port in iter_ports(outer, direct_only=True)] == ['ap']
+    assert outer['descendants'] == {'OrderID': 'A1-ORDER'}
+    # 各模型互不共用字典
+    outer['interfaces'][0][0]['PortID'] = 'changed'
+    assert models['expat'][1]['interfaces'][0][0]['PortID'] == 'a1p'
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_declared_entities_are_refused(name):
+    content = _document('<Device><NameOfStation>&x;</NameOfStation></Device>',
+                        prolog='<!DOCTYPE Root [<!ENTITY x "expanded">]>')
+    with pytest.raises(EntityError) as refused:
+        _models(name, content)
+    # expat 报告的是实体声明中的位置（声明从第 16 列开始）
+    line, column = refused.value.position
+    assert line == 1 and 16 <= column < 16 + len('<!ENTITY x "expanded">')
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_errors_match(name):
+    with pytest.raises(StructureError):
+        _models(name, b'<Root><Device/></Root>')
+    with pytest.raises(ET.ParseError):
+        _models(name, _document('<Device><NameOfStation>x</Device>'))
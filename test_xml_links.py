@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 xml_links.LinkIndex.resolve 的各种链路状态，以及互相指向的链路只输出一次
+
+运行: python -m pytest test_xml_links.py
+"""
+
+from xml_backends import get_backend
+from xml_links import LINK_FIELDS, LINK_STATUSES, LinkIndex
+
+def _port(port_id, remote_station='', remote_port='', remote_mac='', status='up'):
+    return (f'<Port><PortID>{port_id}</PortID><OperStatus>{status}</OperStatus>'
+            f'<RemoteNameOfStation>{remote_station}</RemoteNameOfStation><RemotePortID>{remote_port}</RemotePortID>'
+            f'<RemoteMAC>{remote_mac}</RemoteMAC></Port>')
+
+def _device(name, mac, *ports):
+    return (f'<Device><NameOfStation>{name}</NameOfStation><MAC>{mac}</MAC><Interfaces><PnInterface>'
+            f'<PortList>{"".join(ports)}</PortList></PnInterface></Interfaces></Device>')
+
+CONTENT = ('<Root><DeviceCollection>' + ''.join([
+    _device('A', '00:00:00:00:00:0a',
+            _port('port-001', 'B', 'port-001.B'),           # 与 B/port-001 互相指向
+            _port('port-002', 'B', 'port-002'),             # B/port-002 指向别处
+            _port('port-003', 'X', 'port-001')),            # X 不在采集中
+    _device('B', '00:00:00:00:00:0b',
+            _port('port-001', 'A', 'port-001'),
+            _port('port-002', 'C', 'port-009', status='down')),  # C 没有 port-009
+    _device('C', '00:00:00:00:00:0c', _port('port-001')),
+    _device('D', '00:00:00:00:00:0d',
+            _port('port-001', '', 'port-001', '00-00-00-00-00-0E')),  # 只有 RemoteMAC
+    _device('E', '00:00:00:00:00:0e', _port('port-001', 'D', 'port-001')),
+    _device('F', '', _port('port-001'), _port('port-001')),          # 重复的端口ID
+    _device('G', '', _port('port-001', 'F', 'port-001')),
+]) + '</DeviceCollection></Root>').encode('utf-8')
+
+def _resolved():
+    index = LinkIndex()
+    for _ in index.track(get_backend('expat').iter_devices(CONTENT)):
+        pass
+    names = [(port[0], port[2]) for port in index.ports]
+    links = [(status, names[local], names[partner] if partner is not None else None, mismatch, resolved_by)
+             for status, local, partner, mismatch, resolved_by in index.resolve()]
+    return index, links
+
+def test_link_statuses():
+    index, links = _resolved()
+    assert links == [
+        ('ok', ('A', 'port-001'), ('B', 'port-001'), '', 'name'),
+        ('asymmetric', ('A', 'port-002'), ('B', 'port-002'), 'OperStatus', 'name'),
+        ('dangling', ('A', 'port-003'), None, '', ''),
+        ('unknown_port', ('B', 'port-002'), None, '', ''),
+        ('ok', ('D', 'port-001'), ('E', 'port-001'), '', 'mac'),
+        ('ambiguous', ('G', 'port-001'), None, '', 'name'),
+    ]
+    assert {link[0] for link in links} == set(LINK_STATUSES)
+
+def test_symmetric_links_are_reported_once():
+    index, links = _resolved()
+    # B/port-001 和 E/port-001 指回已输出的链路，不再单独输出
+    local_ports = [link[1] for link in links]
+    assert ('B', 'port-001') not in local_ports and ('E', 'port-001') not in local_ports
+    pairs = [frozenset((link[1], link[2])) for link in links if link[0] == 'ok']
+    assert len(pairs) == len(set(pairs)) == 2
+
+    rows = index.links()
+    assert len(rows) == len(links) and all(len(row) == len(LINK_FIELDS) for row in rows)
+    assert rows[0][:3] == ['ok', '', 'name']
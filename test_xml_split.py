@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+检查 xml_split 拆分并行解析的结果与整体解析相同，段中的解析错误报告原文件中的位置
+
+运行: python -m pytest test_xml_split.py
+"""
+
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import d_xml2csv
+import xml_split
+
+def _device(index, extra=''):
+    return (f'  <Device note="a>b \'{index}\'">\n'
+            f'    <NameOfStation>dev-{index:02d}</NameOfStation><IpAddress>10.0.0.{index}</IpAddress>\n'
+            f'    <DeviceType><![CDATA[</Device> <Device>]]></DeviceType>\n'
+            f'    <Interfaces><PnInterface><PortList><Port><PortID>port-{index}</PortID>'
+            f'<PortDesc>中文 {index}</PortDesc></Port></PortList></PnInterface></Interfaces>{extra}\n'
+            f'  </Device>\n')
+
+def _document(devices):
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<!-- <DeviceCollection> -->\n<Root>\n'
+            '<DeviceCollection>\n' +
+            ''.join(devices) +
+            '</DeviceCollection>\n<!-- </Device> -->\n</Root>\n').encode('utf-8')
+
+# 设备之间的注释中也有 Device 标签，CDATA 和属性值中有 '>' 和 '</Device>'
+DEVICES = [_device(index) + ('  <!-- <Device> </Device> -->\n' if index % 3 == 0 else '')
+           for index in range(24)]
+
+def _write(tmp_path, content):
+    path = tmp_path / 'plant.xml'
+    path.write_bytes(content)
+    return str(path)
+
+@pytest.mark.parametrize('order', d_xml2csv.ORDERS)
+def test_parallel_output_matches_single_process(tmp_path, order):
+    path = _write(tmp_path, _document(DEVICES))
+    layout = xml_split.split_layout(path)
+    assert layout is not None and layout.complete
+    assert len(layout.segments(2 * xml_split.SEGMENTS_PER_JOB)) > 2
+
+    outputs = {}
+    for jobs in (1, 2):
+        output = tmp_path / f'jobs{jobs}.csv'
+        success, message = d_xml2csv.xml_to_csv(path, str(output), engine='stream', order=order, jobs=jobs)
+        assert success, message
+        outputs[jobs] = output.read_bytes()
+    assert outputs[2] == outputs[1]
+    assert outputs[1].count(b'dev-') == len(DEVICES)
+
+def test_error_position_in_later_segment(tmp_path):
+    # 出错的行中有多字节字符，列号按字符计
+    devices = list(DEVICES)
+    devices[20] = _device(20, extra='<RunState>run</Run>')
+    path = _write(tmp_path, _document(devices))
+    with pytest.raises(ET.ParseError) as whole:
+        ET.parse(path)
+
+    layout = xml_split.split_layout(path)
+    segments = layout.segments(8)
+    assert len(segments) > 2
+    errors = []
+    for segment in segments:
+        try:
+            xml_split._run_segment(ET.fromstring, path, layout.header_end, layout.footer_start, segment)
+        except ET.ParseError as e:
+            errors.append((segment, e))
+    [(segment, error)] = errors
+    assert segment != segments[0]
+    assert error.position == whole.value.position
+    assert f'line {whole.value.position[0]}, column {whole.value.position[1]}' in str(error)
+
+    # 经由进程池的并行转换报告同样的位置
+    success, message = d_xml2csv.xml_to_csv(path, str(tmp_path / 'out.csv'), engine='stream', jobs=2)
+    assert not success
+    assert f'line {whole.value.position[0]}, column {whole.value.position[1]}' in message
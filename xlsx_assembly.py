@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+区域汇总工作簿：每个区域一个工作簿，每个工厂一个工作表
+
+用一个 openpyxl 工作簿依次写出所有工厂时，全部工作都在一个进程中
+串行完成。这里把每个工厂交给一个工作进程：工作进程用 xml_to_xlsx
+按与单独转换完全相同的方式（Combined 布局、分组方式、过滤条件）生成
+该工厂的工作簿，再取出其中的工作表部件，压缩为一个只含工作表的
+部件文件。最后一步只把各部件中已压缩的工作表数据原样复制进同一个
+.xlsx 压缩包，并生成工作簿、关系和内容类型清单，不再重新生成或解压
+任何单元格。
+
+工作表中的字符串在工作进程中改为内联字符串（openpyxl 3.1 本身即如此
+写出），因此不需要合并共享字符串表；各工厂的样式表相同（使用样式的
+工作表的 styles.xml 必须一致，只有 band 方式会用到样式），取其中一份。
+
+区域和工厂的划分与 xml2xlsx 的输出相同：xml2xlsx 写到输出目录第一级
+目录 <区域>/ 中的每个 <工厂>.xlsx 在这里成为 <区域>.xlsx 中名为
+<工厂> 的工作表；直接位于源目录中的文件归入以源目录名命名的区域。
+同名工厂只保留扫描中的第一个，复制文件跳过。
+
+    python xlsx_assembly.py xml_dir excel_dir --jobs 8
+
+一个区域的所有工厂完成后立即拼接该区域的工作簿，并删除其部件文件。
+"""
+
+import os
+import re
+import sys
+import time
+import zlib
+import struct
+import zipfile
+import argparse
+import tempfile
+from datetime import datetime
+from functools import partial
+from xml.sax.saxutils import escape, quoteattr
+
+from batch_runner import add_isolation_arguments, run_conversions
+from d_xml2csv import natural_key
+from memory_budget import ENGINES, parse_size
+from model_cache import DEFAULT_CACHE_SIZE, ModelCache
+from xlsx_grouping import DEFAULT_GROUPING, GROUPINGS
+from xml_backends import BACKENDS, DEFAULT_BACKEND
+from xml_filter import add_filter_arguments, filter_from_args
+from xml_sources import scan_inputs
+from xml2xlsx import output_file_for, xml_to_xlsx
+
+# 部件文件中的条目
+SHEET_PART = 'sheet.xml'
+STYLES_PART = 'styles.xml'
+THEME_PART = 'theme.xml'
+
+# 部件文件的注释，标记工作表是否引用了样式
+STYLED_COMMENT = b'styled'
+
+# 复制和改写工作表时每次读取的大小
+COPY_CHUNK_SIZE = 1 << 20
+
+# Excel 工作表名称的长度上限和不允许的字符
+SHEET_NAME_LIMIT = 31
+_INVALID_SHEET_CHARS = re.compile(r'[\\/?*\[\]:]')
+
+_SHARED_STRING = re.compile(rb'<si>(.*?)</si>|<si\s*/>', re.S)
+_SHARED_CELL = re.compile(rb'<c ([^>]*?)t="s"([^>]*)><v>(\d+)</v></c>')
+_STYLED_CELL = re.compile(rb'<c [^>]*\bs="[1-9]')
+_TAB_SELECTED = re.compile(rb'\s+tabSelected="(?:1|true)"')
+
+_MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_PACKAGE_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.'
+
+def _shared_strings(source):
+    """工作簿中共享字符串的内容（<si> 的内部XML），没有共享字符串表时为空列表"""
+    if 'xl/sharedStrings.xml' not in source.namelist():
+        return []
+    return [match.group(1) or b'' for match in _SHARED_STRING.finditer(source.read('xl/sharedStrings.xml'))]
+
+def _rewrite_sheet(sheet, out, strings):
+    """
+    逐段复制工作表XML：共享字符串单元格改为内联字符串，去掉选中标记
+
+    Returns:
+        工作表是否引用了默认以外的样式
+    """
+    def inline(match):
+        return (b'<c ' + match.group(1) + b't="inlineStr"' + match.group(2) + b'><is>' +
+                strings[int(match.group(3))] + b'</is></c>')
+
+    styled = False
+    first = True
+    buffer = b''
+    while True:
+        chunk = sheet.read(COPY_CHUNK_SIZE)
+        buffer += chunk
+        # 按整行切分，单元格不会跨段
+        cut = buffer.rfind(b'</row>') + len(b'</row>') if chunk else len(buffer)
+        if chunk and cut < len(b'</row>'):
+            continue
+        piece, buffer = buffer[:cut], buffer[cut:]
+        if first:
+            # 每个工厂的工作簿中它都是选中的工作表，拼接后只保留活动工作表
+            piece = _TAB_SELECTED.sub(b'', piece, count=1)
+            first = False
+        if strings:
+            piece = _SHARED_CELL.sub(inline, piece)
+        styled = styled or _STYLED_CELL.search(piece) is not None
+        out.write(piece)
+        if not chunk:
+            return styled
+
+def render_sheet_part(xml_input, part_file, backend=None, engine='auto', cache=None,
+                      grouping=DEFAULT_GROUPING, model_filter=None):
+    """
+    在工作进程中生成一个工厂的工作表部件
+
+    工作表与 xml_to_xlsx 生成的 Combined 工作表完全相同。
+
+    Args:
+        xml_input: XmlInput 或已读取的字节内容
+        part_file: 部件文件路径
+        其他参数见 xml2xlsx.xml_to_xlsx
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(part_file))) as directory:
+        xlsx_file = os.path.join(directory, 'plant.xlsx')
+        success, message = xml_to_xlsx(xml_input, xlsx_file, backend, engine, cache, grouping,
+                                       model_filter)
+        if not success:
+            return success, message
+        try:
+            with zipfile.ZipFile(xlsx_file) as source, \
+                    zipfile.ZipFile(part_file, 'w', zipfile.ZIP_DEFLATED) as part:
+                strings = _shared_strings(source)
+                with source.open('xl/worksheets/sheet1.xml') as sheet, \
+                        part.open(SHEET_PART, 'w', force_zip64=True) as out:
+                    styled = _rewrite_sheet(sheet, out, strings)
+                part.writestr(STYLES_PART, source.read('xl/styles.xml'))
+                part.writestr(THEME_PART, source.read('xl/theme/theme1.xml'))
+                part.comment = STYLED_COMMENT if styled else b''
+        except Exception as e:
+            return False, f"生成工作表部件失败: {str(e)}"
+    return True, message
+
+def sheet_names(names):
+    """
+    把工厂名称转换为合法且不重复（不区分大小写）的工作表名称
+
+    不允许的字符替换为 '_'，超过 31 个字符时截断，重复的名称加上序号。
+    """
+    result = []
+    used = set()
+    for name in names:
+        base = _INVALID_SHEET_CHARS.sub('_', name).strip("'") or 'Sheet'
+        candidate = base[:SHEET_NAME_LIMIT]
+        number = 1
+        while candidate.lower() in used:
+            number += 1
+            suffix = f" ({number})"
+            candidate = base[:SHEET_NAME_LIMIT - len(suffix)] + suffix
+        used.add(candidate.lower())
+        result.append(candidate)
+    return result
+
+class _ZipWriter:
+    """
+    写出 .xlsx 压缩包，可以直接复制其他压缩包中已压缩的条目
+
+    不支持 ZIP64：条目数和每个偏移、大小都必须在普通 ZIP 格式的范围内。
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._entries = []
+        now = datetime.now()
+        self._time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
+        self._date = ((max(now.year, 1980) - 1980) << 9) | (now.month << 5) | now.day
+
+    def _begin(self, name, crc, compressed_size, size):
+        offset = self._f.tell()
+        if max(offset, compressed_size, size) >= 0xFFFFFFFF or len(self._entries) >= 0xFFFF:
+            raise ValueError("汇总工作簿超过普通 ZIP 格式的大小上限（4GB）")
+        name = name.encode('utf-8')
+        self._f.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x800, zipfile.ZIP_DEFLATED, self._time,
+                                  self._date, crc, compressed_size, size, len(name), 0) + name)
+        self._entries.append((name, crc, compressed_size, size, offset))
+
+    def write(self, name, data):
+        """压缩并写入一个条目"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self._begin(name, zlib.crc32(data), len(compressed), len(data))
+        self._f.write(compressed)
+
+    def copy(self, name, archive, member):
+        """
+        原样复制另一个压缩包中已压缩的条目
+
+        Args:
+            name: 新的条目名
+            archive: 源压缩包路径
+            member: 源条目名
+        """
+        with zipfile.ZipFile(archive) as source:
+            info = source.getinfo(member)
+        if info.compress_type != zipfile.ZIP_DEFLATED:
+            raise ValueError(f"{archive} 中的 {member} 不是 deflate 压缩")
+        self._begin(name, info.CRC, info.compress_size, info.file_size)
+        with open(archive, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            remaining = info.compress_size
+            while remaining:
+                data = f.read(min(remaining, COPY_CHUNK_SIZE))
+                if not data:
+                    raise ValueError(f"{archive} 中的 {member} 不完整")
+                self._f.write(data)
+                remaining -= len(data)
+
+    def close(self):
+        """写出中央目录"""
+        start = self._f.tell()
+        for name, crc, compressed_size, size, offset in self._entries:
+            self._f.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x800, zipfile.ZIP_DEFLATED,
+                                      self._time, self._date, crc, compressed_size, size, len(name),
+                                      0, 0, 0, 0, 0, offset) + name)
+        end = self._f.tell()
+        if end >= 0xFFFFFFFF:
+            raise ValueError("汇总工作簿超过普通 ZIP 格式的大小上限（4GB）")
+        self._f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self._entries), len(self._entries),
+                                  end - start, start, 0))
+
+def _content_types(count):
+    overrides = [('/xl/workbook.xml', 'spreadsheetml.sheet.main+xml'),
+                 ('/xl/styles.xml', 'spreadsheetml.styles+xml'),
+                 ('/xl/theme/theme1.xml', 'theme+xml')]
+    overrides += [(f'/xl/worksheets/sheet{number}.xml', 'spreadsheetml.worksheet+xml')
+                  for number in range(1, count + 1)]
+    return ('<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>' +
+            ''.join(f'<Override PartName="{part}" ContentType="{_CONTENT_TYPE}{kind}"/>' for part, kind in overrides) +
+            '</Types>')
+
+def _workbook(names):
+    sheets = ''.join(f'<sheet name={quoteattr(name)} sheetId="{number}" r:id="rId{number}"/>'
+                     for number, name in enumerate(names, 1))
+    return (f'<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><bookViews><workbookView activeTab="0"/></bookViews>'
+            f'<sheets>{sheets}</sheets><calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>')
+
+def _workbook_relationships(count):
+    relationships = [(f'rId{number}', 'worksheet', f'worksheets/sheet{number}.xml') for number in range(1, count + 1)]
+    relationships += [(f'rId{count + 1}', 'styles', 'styles.xml'), (f'rId{count + 2}', 'theme', 'theme/theme1.xml')]
+    return (f'<Relationships xmlns="{_PACKAGE_REL_NS}">' +
+            ''.join(f'<Relationship Id="{rid}" Type="{_REL_NS}/{kind}" Target="{escape(target)}"/>'
+                    for rid, kind, target in relationships) +
+            '</Relationships>')
+
+def assemble_workbook(parts, xlsx_file):
+    """
+    把工作表部件拼接为一个工作簿，工作表按 parts 的顺序排列
+
+    Args:
+        parts: [(工作表名称, 部件文件路径), ...]，名称应已合法且不重复（见 sheet_names）
+        xlsx_file: 输出的XLSX文件路径
+    """
+    if not parts:
+        raise ValueError("没有可以拼接的工作表")
+    styles = theme = styled_source = None
+    for name, part_file in parts:
+        with zipfile.ZipFile(part_file) as part:
+            if theme is None:
+                styles, theme = part.read(STYLES_PART), part.read(THEME_PART)
+            if part.comment == STYLED_COMMENT:
+                part_styles = part.read(STYLES_PART)
+                if styled_source is None:
+                    styles, styled_source = part_styles, name
+                elif part_styles != styles:
+                    raise ValueError(f"工作表 {styled_source} 和 {name} 的样式表不一致，无法拼接")
+
+    names = [name for name, _ in parts]
+    temporary = xlsx_file + '.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            writer = _ZipWriter(f)
+            writer.write('[Content_Types].xml', _content_types(len(parts)))
+            writer.write('_rels/.rels',
+                         f'<Relationships xmlns="{_PACKAGE_REL_NS}"><Relationship Id="rId1" '
+                         f'Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+            writer.write('xl/workbook.xml', _workbook(names))
+            writer.write('xl/_rels/workbook.xml.rels', _workbook_relationships(len(parts)))
+            writer.write('xl/styles.xml', styles)
+            writer.write('xl/theme/theme1.xml', theme)
+            for number, (_, part_file) in enumerate(parts, 1):
+                writer.copy(f'xl/worksheets/sheet{number}.xml', part_file, SHEET_PART)
+            writer.close()
+        os.replace(temporary, xlsx_file)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+def plan_regions(xml_dir, inputs):
+    """
+    按 xml2xlsx 的输出文件划分区域和工厂
+
+    Args:
+        xml_dir: 源目录
+        inputs: 扫描到的 XmlInput 列表
+    Returns:
+        (regions, skipped): regions 为 {区域: [(工厂名称, XmlInput), ...]}；
+                            skipped 为 [(XmlInput, 原因), ...]
+    """
+    root_region = os.path.basename(os.path.normpath(os.path.abspath(xml_dir)))
+    regions = {}
+    seen = set()
+    skipped = []
+    for xml_input in inputs:
+        xlsx_file, _ = output_file_for(xml_input, '')
+        if xlsx_file is None:
+            skipped.append((xml_input, "复制文件"))
+            continue
+        if xlsx_file in seen:
+            skipped.append((xml_input, "同名工厂已存在"))
+            continue
+        seen.add(xlsx_file)
+        region = os.path.dirname(xlsx_file) or root_region
+        plant = os.path.splitext(os.path.basename(xlsx_file))[0]
+        regions.setdefault(region, []).append((plant, xml_input))
+    # 区域和工作表按名称的自然顺序排列，与扫描顺序无关
+    return ({region: sorted(regions[region], key=lambda item: natural_key(item[0]))
+             for region in sorted(regions, key=natural_key)}, skipped)
+
+def main():
+    parser = argparse.ArgumentParser(description='并行生成每个工厂的工作表，拼接为每个区域一个的汇总工作簿')
+    parser.add_argument('xml_dir', help='XML文件源目录，第一级子目录为区域')
+    parser.add_argument('excel_dir', help='汇总工作簿的目标目录，每个区域生成 <区域>.xlsx')
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--jobs', type=int, default=1, help='并行生成工作表的进程数 (默认 1)')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='转换引擎：tree 整体解析并逐单元格构建工作簿（慢），stream 流式解析和写出，'
+                             'auto 即 stream (默认 auto)')
+    parser.add_argument('--cache-dir', default=None, help='设备模型缓存目录，命中时不再解析XML')
+    parser.add_argument('--cache-size', default=None, help='缓存目录大小上限，如 500M、2G (默认 1G)')
+    parser.add_argument('--grouping', choices=GROUPINGS, default=DEFAULT_GROUPING,
+                        help='同一设备多行的分组方式：merge 逐列合并，block 只合并第一列，'
+                             'outline 大纲折叠，band 交替底色 (默认 merge)')
+    add_filter_arguments(parser)
+    add_isolation_arguments(parser)
+    args = parser.parse_args()
+    cache = None
+    if args.cache_dir:
+        cache = ModelCache(args.cache_dir, parse_size(args.cache_size) if args.cache_size else DEFAULT_CACHE_SIZE)
+
+    xml_dir = args.xml_dir
+    excel_dir = args.excel_dir
+    if not os.path.isdir(xml_dir):
+        print(f"错误: 源目录 '{xml_dir}' 不存在")
+        sys.exit(1)
+    os.makedirs(excel_dir, exist_ok=True)
+
+    print(f"\n开始扫描目录: {xml_dir}")
+    regions, skipped = plan_regions(xml_dir, scan_inputs(xml_dir))
+    for xml_input, reason in skipped:
+        print(f"⚠ 跳过: {xml_input.rel_path}（{reason}）")
+    for region in list(regions):
+        xlsx_file = os.path.join(excel_dir, region + '.xlsx')
+        if os.path.exists(xlsx_file):
+            print(f"⚠ 跳过区域 {region}: 目标文件已存在")
+            del regions[region]
+    if not regions:
+        print("\n警告: 没有需要生成的区域工作簿")
+        sys.exit(0)
+
+    total_plants = sum(len(plants) for plants in regions.values())
+    print(f"\n共 {len(regions)} 个区域、{total_plants} 个工厂，开始处理...")
+    print("=" * 50)
+
+    plant_failures = 0
+    region_results = []
+    with tempfile.TemporaryDirectory(prefix='.parts-', dir=excel_dir) as directory:
+        tasks = []
+        owners = {}
+        parts = {}
+        for region_number, (region, plants) in enumerate(regions.items()):
+            names = sheet_names([plant for plant, _ in plants])
+            parts[region] = []
+            for plant_number, ((_, xml_input), name) in enumerate(zip(plants, names)):
+                part_file = os.path.join(directory, f"{region_number}-{plant_number}.part")
+                tasks.append((xml_input, part_file))
+                owners[part_file] = (region, name)
+                parts[region].append((name, part_file))
+        remaining = {region: len(plants) for region, plants in regions.items()}
+        rendered = set()
+
+        convert = partial(render_sheet_part, backend=args.backend, engine=args.engine, cache=cache,
+                          grouping=args.grouping, model_filter=filter_from_args(args))
+        results = run_conversions(tasks, convert, args.jobs, timed=True,
+                                  timeout=args.timeout, memory_limit=args.worker_memory)
+        for (xml_input, part_file), success, message, seconds in results:
+            region, name = owners[part_file]
+            if success:
+                rendered.add(part_file)
+                print(f"✓ {region}/{name}: {message}")
+            else:
+                plant_failures += 1
+                print(f"✗ {region}/{name}: {message}")
+            remaining[region] -= 1
+            if remaining[region]:
+                continue
+
+            # 该区域的所有工厂都已完成，拼接工作簿并删除部件
+            region_parts = [(name, part) for name, part in parts[region] if part in rendered]
+            xlsx_file = os.path.join(excel_dir, region + '.xlsx')
+            started = time.perf_counter()
+            try:
+                assemble_workbook(region_parts, xlsx_file)
+                region_results.append(True)
+                print(f"✓ 区域 {region}: 拼接 {len(region_parts)} 个工作表到 {xlsx_file}，"
+                      f"用时 {time.perf_counter() - started:.2f} 秒")
+            except Exception as e:
+                region_results.append(False)
+                print(f"✗ 区域 {region}: 拼接失败: {str(e)}")
+            for _, part in region_parts:
+                os.remove(part)
+
+    print("\n" + "=" * 50)
+    print("处理完成:")
+    print(f"区域: {len(region_results)}，成功 {region_results.count(True)}，失败 {region_results.count(False)}")
+    print(f"工厂: {total_plants}，成功 {total_plants - plant_failures}，失败 {plant_failures}")
+    if plant_failures or not all(region_results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
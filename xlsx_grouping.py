@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+工作表中同一设备多行的分组显示方式
+
+    merge    设备的每一列各合并一次（原有方式，每个设备约 20 个合并区域）
+    block    每个设备只合并第一列，其余设备列在后续行留空
+    outline  设备列在后续行留空，后续行设为大纲第 1 级，可按设备折叠
+    band     设备列在后续行留空，相邻设备交替使用底色
+
+openpyxl 每登记一个合并区域都要与已有区域比较，合并区域多时保存时间
+和Excel打开、筛选的速度都由 <mergeCells> 决定；后三种方式只生成少量
+合并区域或不生成合并区域。
+"""
+
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.worksheet.dimensions import RowDimension
+from openpyxl.worksheet.properties import Outline
+
+GROUPINGS = ('merge', 'block', 'outline', 'band')
+DEFAULT_GROUPING = 'merge'
+
+# band 方式的底色
+BAND_FILL = PatternFill(fill_type='solid', start_color='FFDDEBF7', end_color='FFDDEBF7')
+
+def check_grouping(grouping):
+    """检查分组方式名称，未知时抛出 ValueError"""
+    if grouping not in GROUPINGS:
+        raise ValueError(f"未知的分组方式: {grouping}，可选: {', '.join(GROUPINGS)}")
+    return grouping
+
+def merge_ranges(start_row, end_row, columns, grouping):
+    """
+    一个设备的行需要登记的合并区域
+
+    Args:
+        start_row, end_row: 设备的首行和末行
+        columns: 设备列的列号列表
+        grouping: 分组方式
+    Returns:
+        ranges: 形如 'A2:A5' 的区域字符串列表
+    """
+    if end_row <= start_row:
+        return []
+    if grouping == 'merge':
+        merged = columns
+    elif grouping == 'block':
+        merged = columns[:1]
+    else:
+        return []
+    return [f"{get_column_letter(col)}{start_row}:{get_column_letter(col)}{end_row}" for col in merged]
+
+def prepare_outline(ws):
+    """设置大纲的汇总行在上方（设备首行），并声明行大纲的层数"""
+    ws.sheet_properties.outlinePr = Outline(summaryBelow=False)
+    ws.sheet_format.outlineLevelRow = 1
+
+def apply_grouping(ws, groups, columns, grouping=DEFAULT_GROUPING):
+    """
+    在已写入数据的普通工作表上按设备分组
+
+    Args:
+        ws: openpyxl 工作表
+        groups: 每个设备的 (首行, 末行)，按行号顺序
+        columns: 设备列的列号列表
+        grouping: 分组方式
+    """
+    check_grouping(grouping)
+    if grouping == 'outline':
+        prepare_outline(ws)
+
+    for number, (start_row, end_row) in enumerate(groups):
+        if grouping == 'merge':
+            # 保持原有的逐列合并
+            if end_row > start_row:
+                for col in columns:
+                    ws.merge_cells(start_row=start_row, start_column=col, end_row=end_row, end_column=col)
+            continue
+
+        for row in range(start_row + 1, end_row + 1):
+            for col in columns:
+                ws.cell(row=row, column=col).value = None
+            if grouping == 'outline':
+                ws.row_dimensions[row].outline_level = 1
+        if grouping == 'block' and end_row > start_row:
+            ws.merge_cells(start_row=start_row, start_column=columns[0], end_row=end_row, end_column=columns[0])
+        elif grouping == 'band' and number % 2:
+            for row in ws.iter_rows(min_row=start_row, max_row=end_row):
+                for cell in row:
+                    cell.fill = BAND_FILL
+
+def append_grouped_rows(ws, headers, groups, columns, grouping=DEFAULT_GROUPING):
+    """
+    向只写模式的工作表写入表头和按设备分组的行
+
+    设备列在后续行中应已为 None。合并区域以字符串登记，写尾部时输出；
+    大纲层级只在写出对应行时临时登记，不为每行保留 RowDimension。
+
+    Args:
+        ws: 尚未写入任何行的只写模式工作表（列宽应已设置）
+        headers: 表头
+        groups: 每个设备的行列表
+        columns: 设备列的列号列表
+        grouping: 分组方式
+    """
+    check_grouping(grouping)
+    # 工作表属性在写入第一行时输出
+    if grouping == 'outline':
+        prepare_outline(ws)
+    ws.append(headers)
+
+    row_index = 2
+    for number, rows in enumerate(groups):
+        end_row = row_index + len(rows) - 1
+        for merged in merge_ranges(row_index, end_row, columns, grouping):
+            ws.merged_cells.ranges.add(merged)
+
+        banded = grouping == 'band' and number % 2
+        for offset, row in enumerate(rows):
+            if banded:
+                row = [_band_cell(ws, value) for value in row]
+            if grouping == 'outline' and offset:
+                ws.row_dimensions[row_index] = RowDimension(ws, index=row_index, outlineLevel=1)
+                ws.append(row)
+                del ws.row_dimensions[row_index]
+            else:
+                ws.append(row)
+            row_index += 1
+
+def _band_cell(ws, value):
+    cell = WriteOnlyCell(ws, value)
+    cell.fill = BAND_FILL
+    return cell
@@ -5,36 +5,50 @@ import sys
 import os
 import re
 import csv
-from d_xml2csv import xml_to_csv
+import argparse
+import itertools
+from datetime import datetime
+from functools import partial
+from d_xml2csv import FIELDNAMES, model_rows, models_to_csv
+from consolidated import PARTS_DIR, SOURCE_COLUMNS, PartTarget, append_capture, finalize_dataset, reset_parts, snapshot_of
+from csv_output import COMPRESSIONS, output_suffix
+from memory_budget import ENGINES, PeakMemory, choose_engine, parse_size
+from model_cache import DEFAULT_CACHE_SIZE, PROFILE_STRIPPED, PROFILE_STRIPPED_STREAM, ModelCache, cached_models
+from device_memo import DEFAULT_STORE_SIZE, DeviceStore, MemoStats, memoized_models
+from xml_backends import BACKENDS, DEFAULT_BACKEND, StructureError, check_entities, get_backend
+from xml_sources import open_cleaned, read_input, scan_inputs, group_by_directory
+from batch_runner import add_isolation_arguments, run_conversions
+from run_report import RunReporter, add_report_arguments, reporter_from_args
+from sharding import Shard, add_shard_arguments, manifest_path, shard_from_args, shard_key, write_manifest
+
+def remove_char_references(content):
+    """移除所有数字字符引用"""
+    # 移除所有 &#x 开头的十六进制字符引用
+    content = re.sub(r'&#x[0-9a-fA-F]+;', '', content)
+    # 移除所有 &# 开头的十进制字符引用
+    content = re.sub(r'&#\d+;', '', content)
+    return content
 
 def clean_xml_content(xml_path):
     """
     清理XML文件中的无效字符引用
     
     Args:
-        xml_path: XML文件路径
+        xml_path: XML文件路径、XmlInput（压缩文件或归档成员）或已读取的字节内容
     Returns:
         cleaned_content: 清理后的XML内容
     """
+    raw_content = read_input(xml_path)
     try:
-        with open(xml_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = raw_content.decode('utf-8')
             
         # 替换无效的字符引用
-        # 移除所有 &#x 开头的十六进制字符引用
-        content = re.sub(r'&#x[0-9a-fA-F]+;', '', content)
-        # 移除所有 &# 开头的十进制字符引用
-        content = re.sub(r'&#\d+;', '', content)
-        
-        return content
+        return remove_char_references(content)
     except UnicodeDecodeError:
         # 如果UTF-8解码失败，尝试其他编码
         try:
-            with open(xml_path, 'r', encoding='latin1') as f:
-                content = f.read()
-            content = re.sub(r'&#x[0-9a-fA-F]+;', '', content)
-            content = re.sub(r'&#\d+;', '', content)
-            return content
+            content = raw_content.decode('latin1')
+            return remove_char_references(content)
         except Exception as e:
             raise Exception(f"无法读取文件编码: {str(e)}")
 
@@ -49,6 +63,7 @@ def validate_xml_structure(xml_content):
     """
     try:
         from xml.etree import ElementTree as ET
+        check_entities(xml_content)
         root = ET.fromstring(xml_content)
         
         devices = root.find('DeviceCollection')
@@ -65,15 +80,213 @@ def validate_xml_structure(xml_content):
     except Exception as e:
         return False, f"验证XML结构失败: {str(e)}"
 
-def process_directory(input_dir, output_dir):
+def extract_models(xml_path, backend=None, engine='tree'):
+    """
+    清理、验证并解析单个XML输入，逐个产出设备模型
+    
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+        backend: 解析后端名称，默认 etree；流式引擎总是使用 expat
+        engine: 'tree' 或 'stream'
+    Raises:
+        StructureError: XML结构不满足转换要求
+    """
+    if engine == 'stream':
+        # 清理、结构检查和解析在同一遍流式读取中完成
+        with open_cleaned(xml_path, remove_char_references, ('utf-8', 'latin1')) as cleaned:
+            yield from get_backend('expat').iter_devices(cleaned)
+        return
+    
+    # 清理XML内容
+    cleaned_content = clean_xml_content(xml_path)
+    
+    # 验证清理后的XML结构
+    valid, message = validate_xml_structure(cleaned_content)
+    if not valid:
+        raise StructureError(message)
+    
+    # 清理后的内容直接在内存中解析，不再写临时文件
+    yield from get_backend(backend).iter_devices(cleaned_content.encode('utf-8'))
+
+def _profile(engine):
+    """引擎对应的提取方式：两种引擎解码编码混杂的文件的方式不同，不能共用缓存"""
+    return PROFILE_STRIPPED_STREAM if engine == 'stream' else PROFILE_STRIPPED
+
+def _extraction(xml_path, backend, engine, device_store, stats):
+    """提取设备模型的无参数函数；给出 device_store 时逐个设备复用已提取的模型"""
+    return partial(memoized_models, device_store, xml_path, _profile(engine),
+                   partial(extract_models, backend=backend, engine=engine), stats)
+
+def convert_file(xml_path, csv_path, backend=None, compression=None, compresslevel=None,
+                 engine='auto', max_memory=None, cache=None, device_store=None):
+    """
+    清理、验证并转换单个XML输入
+    
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+        csv_path: CSV文件输出路径
+        backend: 解析后端名称，默认 etree
+        compression: 输出压缩格式
+        compresslevel: 压缩级别
+        engine: 'tree'、'stream' 或 'auto'（按输入大小和 max_memory 选择）
+        max_memory: auto 引擎的内存预算（字节）
+        cache: ModelCache，命中时不再清理和解析XML
+        device_store: device_memo.DeviceStore，只重新提取新的或变化了的设备
+    Returns:
+        (bool, str): (是否成功, 信息)，信息中附带本文件的内存峰值
+    """
+    with PeakMemory() as memory:
+        try:
+            engine = choose_engine(xml_path, engine, max_memory)
+            stats = MemoStats()
+            models, cached = cached_models(cache, xml_path, _profile(engine),
+                                           _extraction(xml_path, backend, engine, device_store, stats))
+            success, message = models_to_csv(models, csv_path, engine, compression, compresslevel, cached)
+            if success and device_store is not None and not cached:
+                message = f"{message}，{stats.describe()}"
+        except StructureError as e:
+            success, message = False, str(e)
+        except Exception as e:
+            success, message = False, f"处理失败: {str(e)}"
+    return success, f"{message}，{memory.describe()}"
+
+def convert_to_part(xml_path, target, backend=None, compression=None, compresslevel=None,
+                    engine='auto', max_memory=None, cache=None, device_store=None):
+    """
+    清理、验证并转换单个XML输入，把记录追加到合并数据集的分片文件
+
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+        target: consolidated.PartTarget
+        其他参数见 convert_file
+    Returns:
+        (bool, str): (是否成功, 信息)，信息中附带本文件的内存峰值
+    """
+    with PeakMemory() as memory:
+        try:
+            engine = choose_engine(xml_path, engine, max_memory)
+            stats = MemoStats()
+            models, cached = cached_models(cache, xml_path, _profile(engine),
+                                           _extraction(xml_path, backend, engine, device_store, stats))
+            rows = model_rows(models, engine)
+            first = next(rows, None)
+            if first is None:
+                success, message = False, "没有找到任何设备数据"
+            else:
+                count = append_capture(target, itertools.chain([first], rows), compression, compresslevel)
+                source = "缓存" if cached else f"{engine} 引擎"
+                success, message = True, f"成功将 {count} 条记录写入合并数据集（{source}）"
+                if device_store is not None and not cached:
+                    message = f"{message}，{stats.describe()}"
+        except StructureError as e:
+            success, message = False, str(e)
+        except Exception as e:
+            success, message = False, f"处理失败: {str(e)}"
+    return success, f"{message}，{memory.describe()}"
+
+def consolidate_directory(input_dir, output_dir, backend=None, jobs=1, compression=None, compresslevel=None,
+                          engine='auto', max_memory=None, cache=None, reporter=None,
+                          timeout=None, memory_limit=None, device_store=None):
+    """
+    批量处理指定目录下的所有XML文件，合并为按第一级目录分区的数据集
+
+    每个分区写为 输出目录/<分区>.csv（根目录下的文件以输入目录名为分区），
+    每行前面增加 SourceFile（相对于输入目录的路径）和 Snapshot 列，
+    格式见 consolidated。已有的分区文件会被替换。
+
+    Args:
+        参数见 process_directory
+    """
+    if reporter is None:
+        reporter = RunReporter()
+    os.makedirs(output_dir, exist_ok=True)
+    reset_parts(output_dir)
+    parts_root = os.path.join(output_dir, PARTS_DIR)
+    root_partition = os.path.basename(os.path.abspath(input_dir))
+
+    failed_files = []
+    success_count = 0
+
+    candidates = []
+    for number, xml_input in enumerate(scan_inputs(input_dir), 1):
+        path_parts = xml_input.rel_path.split(os.sep)
+        partition = path_parts[0] if len(path_parts) > 1 else root_partition
+        target = PartTarget(os.path.join(output_dir, partition + '.csv' + output_suffix(compression)),
+                            os.path.join(parts_root, partition), number,
+                            xml_input.rel_path.replace(os.sep, '/'), snapshot_of(xml_input))
+        candidates.append((xml_input, target))
+    reporter.set_total(len(candidates), sum(xml_input.size for xml_input, _ in candidates))
+
+    convert = partial(convert_to_part, backend=backend, compression=compression, compresslevel=compresslevel,
+                      engine=engine, max_memory=max_memory, cache=cache, device_store=device_store)
+    results = run_conversions(candidates, convert, jobs, timed=True, timeout=timeout,
+                              memory_limit=memory_limit)
+    for (xml_input, target), success, message, seconds in results:
+        reporter.finished(xml_input, str(target), success, message, seconds)
+        if success:
+            success_count += 1
+        else:
+            failed_files.append((xml_input.display_name, message))
+        if not reporter.verbose:
+            continue
+        print(f"[{target.number}] 处理文件：")
+        print(f"源文件：{xml_input.display_name}")
+        print(f"分区文件：{target}")
+        if success:
+            print(f"✓ 成功：{message}")
+        else:
+            print(f"✗ 失败：{message}")
+        print("=" * 60)
+    reporter.close()
+
+    # 所有转换结束后按采集顺序拼接分片，不再解析XML
+    written = finalize_dataset(output_dir, SOURCE_COLUMNS + FIELDNAMES, compression, compresslevel)
+
+    print("\n处理完成：")
+    print(f"总文件数：{len(candidates)}")
+    print(f"成功：{success_count}")
+    print(f"失败：{len(failed_files)}")
+    print("\n合并数据集：")
+    for dataset_file, captures in written:
+        print(f"- {dataset_file}（{captures} 个采集）")
+
+    if failed_files:
+        print("\n失败文件列表：")
+        for file_path, error in failed_files:
+            print(f"- {file_path}")
+            print(f"  错误：{error}")
+
+def process_directory(input_dir, output_dir, backend=None, jobs=1, compression=None, compresslevel=None,
+                      engine='auto', max_memory=None, cache=None, reporter=None, shard=None,
+                      timeout=None, memory_limit=None, device_store=None):
     """
     批量处理指定目录下的所有XML文件，只保留第一级目录结构
     如果目标文件已存在则跳过处理
     
+    压缩文件 (.xml.gz/.xml.bz2/.xml.xz) 和归档 (.zip/.tar*) 中的XML成员
+    同样会被处理，归档视为与其同名的目录。
+    
     Args:
         input_dir: XML文件所在目录
         output_dir: CSV文件输出目录
+        backend: 解析后端名称，默认 etree
+        jobs: 并行进程数，默认顺序处理
+        compression: 输出压缩格式 ('gz'、'bz2' 或 'xz')，默认不压缩
+        compresslevel: 压缩级别
+        engine: 'auto'（按文件大小选择）、'tree' 或 'stream'
+        max_memory: 单个文件的内存预算（字节）
+        cache: ModelCache，命中时不再清理和解析XML
+        device_store: device_memo.DeviceStore，只重新提取新的或变化了的设备
+        reporter: RunReporter，决定每个文件的输出方式并写运行报告，处理结束时关闭
+        shard: Shard，只处理其中一个分片的输入，并在输出目录的 _shards 中写出清单
+        timeout: 单个文件的转换时间上限（秒），超时的隔离工作进程被终止
+        memory_limit: 单个隔离工作进程的内存上限（字节）
     """
+    if reporter is None:
+        reporter = RunReporter()
+    if shard is None:
+        shard = Shard()
+    
     # 确保输出目录存在
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -84,90 +297,100 @@ def process_directory(input_dir, output_dir):
     skipped_count = 0
     failed_files = []
     
-    # 遍历输入目录
-    for root, dirs, files in os.walk(input_dir):
-        # 过滤出XML文件
-        xml_files = [f for f in files if f.lower().endswith('.xml')]
-        
-        if not xml_files:
-            continue
-            
-        # 获取相对于输入目录的路径
-        rel_path = os.path.relpath(root, input_dir)
-        path_parts = rel_path.split(os.sep)
+    # 每个输出文件对应的序号
+    file_numbers = {}
+    # 本分片负责的输出文件
+    planned_outputs = []
+    started = datetime.now()
+    
+    def plan_outputs():
+        """确定每个输入的输出路径，只保留本分片负责的输入"""
+        inputs = scan_inputs(input_dir)
+        candidates = []
         
-        # 只取第一级目录
-        if len(path_parts) > 1:
-            output_subdir = os.path.join(output_dir, path_parts[0])
-        else:
-            output_subdir = output_dir
+        # 遍历输入目录（归档成员按其虚拟目录分组）
+        for rel_path, xml_inputs in group_by_directory(inputs).items():
+            path_parts = rel_path.split(os.sep)
             
-        # 确保输出子目录存在
-        if not os.path.exists(output_subdir):
-            os.makedirs(output_subdir)
-            
-        for file in xml_files:
-            total_files += 1
-            xml_path = os.path.join(root, file)
-            
-            # 生成输出文件名
-            # 如果当前目录只有一个XML文件，使用最后一级目录名作为文件名
-            if len(xml_files) == 1:
-                csv_filename = os.path.basename(root) + '.csv'
+            # 只取第一级目录
+            if len(path_parts) > 1:
+                output_subdir = os.path.join(output_dir, path_parts[0])
             else:
-                csv_filename = os.path.splitext(file)[0] + '.csv'
+                output_subdir = output_dir
+                
+            root = os.path.join(input_dir, rel_path) if rel_path else input_dir
             
-            csv_path = os.path.join(output_subdir, csv_filename)
+            for xml_input in xml_inputs:
+                file = os.path.basename(xml_input.rel_path)
+                
+                # 生成输出文件名
+                # 如果当前目录只有一个XML文件，使用最后一级目录名作为文件名
+                if len(xml_inputs) == 1:
+                    csv_filename = os.path.basename(root) + '.csv' + output_suffix(compression)
+                else:
+                    csv_filename = os.path.splitext(file)[0] + '.csv' + output_suffix(compression)
+                
+                candidates.append((xml_input, os.path.join(output_subdir, csv_filename)))
+        
+        # 按输出路径分片，同名输出总在同一分片
+        return shard.select(candidates, key=lambda item: shard_key(item[1], output_dir),
+                            size=lambda item: item[0].size)
+    
+    def plan_tasks():
+        nonlocal total_files, skipped_count
+        
+        candidates = plan_outputs()
+        planned_outputs.extend(csv_path for _, csv_path in candidates)
+        reporter.set_total(len(candidates), sum(xml_input.size for xml_input, _ in candidates))
+        
+        for xml_input, csv_path in candidates:
+            total_files += 1
             
-            print(f"[{total_files}] 处理文件：")
-            print(f"源文件：{xml_path}")
-            print(f"目标文件：{csv_path}")
+            # 确保输出子目录存在
+            os.makedirs(os.path.dirname(csv_path), exist_ok=True)
             
-            # 检查目标文件是否已存在
-            if os.path.exists(csv_path):
-                print("✓ 跳过：目标文件已存在")
+            # 检查目标文件是否已存在（包括本次运行中已安排的）
+            if os.path.exists(csv_path) or csv_path in file_numbers:
+                if reporter.verbose:
+                    print(f"[{total_files}] 处理文件：")
+                    print(f"源文件：{xml_input.display_name}")
+                    print(f"目标文件：{csv_path}")
+                    print("✓ 跳过：目标文件已存在")
+                    print("=" * 60)
                 skipped_count += 1
-                print("=" * 60)
+                reporter.skipped(xml_input, csv_path, "目标文件已存在")
                 continue
             
-            try:
-                # 清理XML内容
-                cleaned_content = clean_xml_content(xml_path)
-                
-                # 验证清理后的XML结构
-                valid, message = validate_xml_structure(cleaned_content)
-                if not valid:
-                    print(f"✗ 失败：{message}")
-                    failed_files.append((xml_path, message))
-                    continue
-                
-                # 创建临时文件存储清理后的内容
-                import tempfile
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False, encoding='utf-8') as temp_file:
-                    temp_file.write(cleaned_content)
-                    temp_path = temp_file.name
-                
-                try:
-                    # 使用临时文件进行转换
-                    success, message = xml_to_csv(temp_path, csv_path)
-                    if success:
-                        success_count += 1
-                        print(f"✓ 成功：{message}")
-                    else:
-                        failed_files.append((xml_path, message))
-                        print(f"✗ 失败：{message}")
-                finally:
-                    # 删除临时文件
-                    os.unlink(temp_path)
-                    
-            except Exception as e:
-                failed_files.append((xml_path, str(e)))
-                print(f"✗ 失败：处理文件时发生错误 - {str(e)}")
-            
-            print("=" * 60)
+            file_numbers[csv_path] = total_files
+            yield xml_input, csv_path
+    
+    convert = partial(convert_file, backend=backend, compression=compression, compresslevel=compresslevel,
+                      engine=engine, max_memory=max_memory, cache=cache, device_store=device_store)
+    results = run_conversions(plan_tasks(), convert, jobs, timed=True, timeout=timeout,
+                              memory_limit=memory_limit)
+    for (xml_input, csv_path), success, message, seconds in results:
+        reporter.finished(xml_input, csv_path, success, message, seconds)
+        if success:
+            success_count += 1
+        else:
+            failed_files.append((xml_input.display_name, message))
+        if not reporter.verbose:
+            continue
+        print(f"[{file_numbers[csv_path]}] 处理文件：")
+        print(f"源文件：{xml_input.display_name}")
+        print(f"目标文件：{csv_path}")
+        if success:
+            print(f"✓ 成功：{message}")
+        else:
+            print(f"✗ 失败：{message}")
+        print("=" * 60)
+    reporter.close()
+    if shard.sharded:
+        write_manifest(manifest_path(output_dir, shard), shard, 'xml2csv', reporter,
+                       planned_outputs, output_dir, started)
     
     # 打印处理总结
-    print("\n处理完成：")
+    print("\n处理完成：" if not shard.sharded else f"\n分片 {shard} 处理完成：")
     print(f"总文件数：{total_files}")
     print(f"成功：{success_count}")
     print(f"跳过：{skipped_count}")
@@ -181,12 +404,35 @@ def process_directory(input_dir, output_dir):
             print(f"  错误：{error}")
 
 def main():
-    if len(sys.argv) != 3:
-        print("用法: python batch_xml2csv.py <输入目录> <输出目录>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='批量将XML文件转换为CSV文件')
+    parser.add_argument('input_dir', help='输入目录')
+    parser.add_argument('output_dir', help='输出目录')
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--jobs', type=int, default=1, help='并行进程数 (默认 1)')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), help='压缩输出的CSV文件')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='转换引擎：tree 整体解析，stream 流式解析，auto 按文件大小选择 (默认 auto)')
+    parser.add_argument('--max-memory', default=None,
+                        help='auto 引擎的单文件内存预算，如 256M、1G (默认 512M)')
+    parser.add_argument('--cache-dir', default=None, help='设备模型缓存目录，命中时不再解析XML')
+    parser.add_argument('--cache-size', default=None, help='缓存目录大小上限，如 500M、2G (默认 1G)')
+    parser.add_argument('--device-cache', default=None,
+                        help='设备模型库文件（SQLite），相邻采集中未变化的设备直接复用，只重新提取变化了的设备')
+    parser.add_argument('--device-cache-size', default=None, help='设备模型库大小上限，如 500M、2G (默认 1G)')
+    parser.add_argument('--consolidate', action='store_true',
+                        help='把所有输入合并为按第一级目录分区的数据集（每个分区一个CSV，'
+                             '增加 SourceFile 和 Snapshot 列），而不是每个输入一个CSV')
+    add_report_arguments(parser)
+    add_shard_arguments(parser)
+    add_isolation_arguments(parser)
+    args = parser.parse_args()
+    if args.consolidate and args.shard is not None:
+        parser.error("--consolidate 不能与 --shard 同时使用")
     
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
+    input_dir = args.input_dir
+    output_dir = args.output_dir
     
     # 检查输入目录是否存在
     if not os.path.exists(input_dir):
@@ -195,7 +441,23 @@ def main():
     
     # 开始处理
     try:
-        process_directory(input_dir, output_dir)
+        max_memory = parse_size(args.max_memory) if args.max_memory else None
+        cache = None
+        if args.cache_dir:
+            cache_size = parse_size(args.cache_size) if args.cache_size else DEFAULT_CACHE_SIZE
+            cache = ModelCache(args.cache_dir, cache_size)
+        device_store = None
+        if args.device_cache:
+            store_size = parse_size(args.device_cache_size) if args.device_cache_size else DEFAULT_STORE_SIZE
+            device_store = DeviceStore(args.device_cache, store_size)
+        if args.consolidate:
+            consolidate_directory(input_dir, output_dir, args.backend, args.jobs, args.compress, args.level,
+                                  args.engine, max_memory, cache, reporter_from_args(args),
+                                  args.timeout, args.worker_memory, device_store)
+        else:
+            process_directory(input_dir, output_dir, args.backend, args.jobs, args.compress, args.level,
+                              args.engine, max_memory, cache, reporter_from_args(args), shard_from_args(args),
+                              args.timeout, args.worker_memory, device_store)
     except Exception as e:
         print(f"处理过程中发生错误: {str(e)}")
         sys.exit(1)
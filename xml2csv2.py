@@ -1,24 +1,36 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
 import sys
 import os
 import re
 import csv
+import argparse
 import xml.etree.ElementTree as ET
+from datetime import datetime
+from functools import partial
+from csv_output import COMPRESSIONS, open_csv_output, output_suffix
+from xml_sources import read_input, scan_inputs, group_by_directory
+from xml_backends import StructureError, check_entities, get_backend
+from memory_budget import parse_size
+from model_cache import DEFAULT_CACHE_SIZE, PROFILE_STRIPPED, ModelCache, cached_models
+from batch_runner import add_isolation_arguments, run_conversions
+from run_report import RunReporter, add_report_arguments, reporter_from_args
+from sharding import Shard, add_shard_arguments, manifest_path, shard_from_args, shard_key, write_manifest
 
 def clean_xml_content(xml_path):
     """
     清理XML文件中的无效字符引用
     
     Args:
-        xml_path: XML文件路径
+        xml_path: XML文件路径、XmlInput（压缩文件或归档成员）或已读取的字节内容
     Returns:
         cleaned_content: 清理后的XML内容
     """
+    raw_content = read_input(xml_path)
     try:
-        with open(xml_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = raw_content.decode('utf-8')
             
         # 替换无效的字符引用
         # 移除所有 &#x 开头的十六进制字符引用
@@ -30,8 +42,7 @@ def clean_xml_content(xml_path):
     except UnicodeDecodeError:
         # 如果UTF-8解码失败，尝试其他编码
         try:
-            with open(xml_path, 'r', encoding='latin1') as f:
-                content = f.read()
+            content = raw_content.decode('latin1')
             content = re.sub(r'&#x[0-9a-fA-F]+;', '', content)
             content = re.sub(r'&#\d+;', '', content)
             return content
@@ -48,6 +59,7 @@ def validate_xml_structure(xml_content):
         (bool, str): (是否有效, 错误信息)
     """
     try:
+        check_entities(xml_content)
         root = ET.fromstring(xml_content)
         
         devices = root.find('DeviceCollection')
@@ -64,132 +76,235 @@ def validate_xml_structure(xml_content):
     except Exception as e:
         return False, f"验证XML结构失败: {str(e)}"
 
-def xml_to_csv(xml_path, csv_path):
+# CSV表头（部分列名重复，重复的列写入相同的值）
+HEADERS = [
+    '#', '名称', '设备类型', 'IP 地址', '子网掩码', 'MAC 地址', '角色', 
+    '供应商名称', '订单号', '固件版本', '硬件版本',
+    '#', '名称', 'IP 地址', '子网掩码', 'MAC 地址',
+    '#', '端口 ID', '端口说明', '伙伴端口 ID', '伙伴设备名称', '功率预算 [dB]',
+    '#', '模块名称', '供应商', '订货号', '序列号', '固件版本', '硬件版本', ''
+]
+
+def _first_descendant_text(model, field):
+    """与 device.find('.//字段名').text 相同：设备下任意深度、按文档顺序第一个同名元素的文本"""
+    return model['descendants'].get(field, '')
+
+def device_group_rows(model, device_number, processed_devices):
     """
-    将XML文件转换为CSV格式，合并相同设备的基本信息
+    生成一个设备的分组行：每个端口一行，设备信息只在第一行出现，末尾加一个空行
+    
+    Args:
+        model: 设备模型
+        device_number: 设备序号（从 1 开始）
+        processed_devices: 已输出过设备信息的 (名称, IP, MAC)，会被更新
+    Returns:
+        rows: 以表头为键的字典列表，没有 PortList 的设备没有任何行
     """
-    try:
-        # 定义CSV表头
-        headers = [
-            '#', '名称', '设备类型', 'IP 地址', '子网掩码', 'MAC 地址', '角色', 
-            '供应商名称', '订单号', '固件版本', '硬件版本',
-            '#', '名称', 'IP 地址', '子网掩码', 'MAC 地址',
-            '#', '端口 ID', '端口说明', '伙伴端口 ID', '伙伴设备名称', '功率预算 [dB]',
-            '#', '模块名称', '供应商', '订货号', '序列号', '固件版本', '硬件版本', ''
-        ]
+    device = model['device']
+    
+    # 设备唯一标识
+    device_key = (
+        device.get('NameOfStation', ''),
+        device.get('IpAddress', ''),
+        device.get('MAC', '')
+    )
+    
+    # 获取基本设备信息
+    base_info = {
+        '#': str(device_number),
+        '名称': device_key[0],
+        '设备类型': device.get('DeviceType', ''),
+        'IP 地址': device_key[1],
+        '子网掩码': device.get('NetworkMask', ''),
+        'MAC 地址': device_key[2],
+        '角色': device.get('Role', ''),
+        '供应商名称': device.get('ManufacturerName', ''),
+        '订单号': _first_descendant_text(model, 'OrderID'),
+        '固件版本': _first_descendant_text(model, 'SoftwareRevision'),
+        '硬件版本': _first_descendant_text(model, 'HardwareRevision')
+    }
+    
+    # 复制设备基本信息到第二组
+    device_info_2 = {
+        '#': '1',
+        '名称': device_key[0],
+        'IP 地址': device_key[1],
+        '子网掩码': base_info['子网掩码'],
+        'MAC 地址': device_key[2]
+    }
+    
+    # 获取第一个接口的端口信息
+    rows = []
+    ports = model['interfaces'][0] if model['interfaces'] else None
+    if ports is None:
+        return rows
+    
+    modules = model['descendant_modules']
+    first_row = True
+    for port_count, port in enumerate(ports, 1):
+        row = {header: '' for header in HEADERS}
         
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        # 只在第一行显示设备基本信息
+        if first_row and device_key not in processed_devices:
+            row.update(base_info)
+            row.update(device_info_2)
+            processed_devices[device_key] = True
+            first_row = False
         
-        devices = root.find('DeviceCollection')
-        if devices is None:
-            return False, "找不到DeviceCollection元素"
-            
-        rows = []
-        device_count = 1
+        # 填充端口信息
+        row['#'] = str(port_count)
+        row['端口 ID'] = port.get('PortID', '')
+        row['端口说明'] = port.get('PortDesc', '')
+        row['伙伴端口 ID'] = port.get('RemotePortID', '')
+        row['伙伴设备名称'] = port.get('RemoteNameOfStation', '')
+        row['功率预算 [dB]'] = port.get('PowerBudget', '')
         
-        # 用于存储已处理的设备信息
-        processed_devices = {}
+        # 添加模块信息
+        if modules and port_count <= len(modules):
+            module = modules[port_count - 1]
+            row['#'] = str(port_count)
+            row['模块名称'] = module.get('OrderID', '')
+            row['供应商'] = base_info['供应商名称']
+            row['订货号'] = module.get('OrderID', '')
+            row['序列号'] = module.get('SerialNumber', '')
+            row['固件版本'] = module.get('SoftwareRevision', '')
+            row['硬件版本'] = module.get('HardwareRevision', '')
         
-        for device in devices.findall('Device'):
-            # 设备唯一标识
-            device_key = (
-                device.find('NameOfStation').text if device.find('NameOfStation') is not None else '',
-                device.find('IpAddress').text if device.find('IpAddress') is not None else '',
-                device.find('MAC').text if device.find('MAC') is not None else ''
-            )
-            
-            # 获取基本设备信息
-            base_info = {
-                '#': str(device_count),
-                '名称': device_key[0],
-                '设备类型': device.find('DeviceType').text if device.find('DeviceType') is not None else '',
-                'IP 地址': device_key[1],
-                '子网掩码': device.find('NetworkMask').text if device.find('NetworkMask') is not None else '',
-                'MAC 地址': device_key[2],
-                '角色': device.find('Role').text if device.find('Role') is not None else '',
-                '供应商名称': device.find('ManufacturerName').text if device.find('ManufacturerName') is not None else '',
-                '订单号': device.find('.//OrderID').text if device.find('.//OrderID') is not None else '',
-                '固件版本': device.find('.//SoftwareRevision').text if device.find('.//SoftwareRevision') is not None else '',
-                '硬件版本': device.find('.//HardwareRevision').text if device.find('.//HardwareRevision') is not None else ''
-            }
-            
-            # 复制设备基本信息到第二组
-            device_info_2 = {
-                '#': '1',
-                '名称': device_key[0],
-                'IP 地址': device_key[1],
-                '子网掩码': base_info['子网掩码'],
-                'MAC 地址': device_key[2]
-            }
-            
-            # 获取端口信息
-            interface = device.find('.//PnInterface')
-            if interface is not None:
-                port_list = interface.find('PortList')
-                if port_list is not None:
-                    port_count = 1
-                    first_row = True
-                    for port in port_list.findall('Port'):
-                        row = {header: '' for header in headers}
-                        
-                        # 只在第一行显示设备基本信息
-                        if first_row and device_key not in processed_devices:
-                            row.update(base_info)
-                            row.update(device_info_2)
-                            processed_devices[device_key] = True
-                            first_row = False
-                        
-                        # 填充端口信息
-                        row['#'] = str(port_count)
-                        row['端口 ID'] = port.find('PortID').text if port.find('PortID') is not None else ''
-                        row['端口说明'] = port.find('PortDesc').text if port.find('PortDesc') is not None else ''
-                        row['伙伴端口 ID'] = port.find('RemotePortID').text if port.find('RemotePortID') is not None else ''
-                        row['伙伴设备名称'] = port.find('RemoteNameOfStation').text if port.find('RemoteNameOfStation') is not None else ''
-                        row['功率预算 [dB]'] = port.find('PowerBudget').text if port.find('PowerBudget') is not None else ''
-                        
-                        # 添加模块信息
-                        modules = device.findall('.//Module')
-                        if modules and port_count <= len(modules):
-                            module = modules[port_count - 1]
-                            row['#'] = str(port_count)
-                            row['模块名称'] = module.find('OrderID').text if module.find('OrderID') is not None else ''
-                            row['供应商'] = base_info['供应商名称']
-                            row['订货号'] = module.find('OrderID').text if module.find('OrderID') is not None else ''
-                            row['序列号'] = module.find('SerialNumber').text if module.find('SerialNumber') is not None else ''
-                            row['固件版本'] = module.find('SoftwareRevision').text if module.find('SoftwareRevision') is not None else ''
-                            row['硬件版本'] = module.find('HardwareRevision').text if module.find('HardwareRevision') is not None else ''
-                        
-                        rows.append(row)
-                        port_count += 1
-                    
-                    # 添加空行
-                    rows.append({header: '' for header in headers})
-                
-            device_count += 1
+        rows.append(row)
+    
+    # 添加空行
+    rows.append({header: '' for header in HEADERS})
+    return rows
+
+def grouped_rows(models):
+    """按文档顺序生成所有设备的分组行"""
+    rows = []
+    # 用于存储已处理的设备信息
+    processed_devices = {}
+    for device_number, model in enumerate(models, 1):
+        rows.extend(device_group_rows(model, device_number, processed_devices))
+    return rows
+
+def write_grouped_csv(rows, f):
+    """将分组行写入已打开的文本文件对象"""
+    writer = csv.DictWriter(f, fieldnames=HEADERS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def models_to_csv(models, csv_path, compression=None, compresslevel=None):
+    """
+    将设备模型写为按设备分组的CSV
+    
+    Args:
+        models: 设备模型的可迭代对象
+        csv_path: CSV文件路径、'-'（标准输出）或已打开的文件对象
+        compression: 输出压缩格式
+        compresslevel: 压缩级别
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    rows = grouped_rows(models)
+    
+    # 写入CSV文件
+    with open_csv_output(csv_path, compression, compresslevel) as f:
+        write_grouped_csv(rows, f)
         
-        # 写入CSV文件
-        with open(csv_path, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(rows)
-            
-        return True, f"成功转换 {len(rows)} 条记录"
+    return True, f"成功转换 {len(rows)} 条记录"
+
+def xml_to_csv(xml_path, csv_path, compression=None, compresslevel=None, backend=None):
+    """
+    将XML文件转换为CSV格式，合并相同设备的基本信息
+    
+    Args:
+        xml_path: XML文件路径、二进制文件对象或字节内容
+        csv_path: CSV文件路径、'-'（标准输出）或已打开的文件对象
+        compression: 输出压缩格式 ('gz'、'bz2' 或 'xz')，路径以对应后缀结尾时自动启用
+        compresslevel: 压缩级别
+        backend: 解析后端名称，默认 etree
+    """
+    try:
+        return models_to_csv(get_backend(backend).iter_devices(xml_path), csv_path, compression, compresslevel)
         
+    except StructureError:
+        return False, "找不到DeviceCollection元素"
+    except ET.ParseError as e:
+        return False, f"XML解析错误: {str(e)}"
+    except Exception as e:
+        return False, f"转换失败: {str(e)}"
+
+def extract_models(xml_path):
+    """
+    清理、验证并解析单个XML输入，逐个产出设备模型
+    
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+    Raises:
+        StructureError: XML结构不满足转换要求
+    """
+    # 清理XML内容
+    cleaned_content = clean_xml_content(xml_path)
+    
+    # 验证清理后的XML结构
+    valid, message = validate_xml_structure(cleaned_content)
+    if not valid:
+        raise StructureError(message)
+    
+    # 清理后的内容直接在内存中解析，不再写临时文件
+    yield from get_backend().iter_devices(io.BytesIO(cleaned_content.encode('utf-8')))
+
+def convert_file(xml_path, csv_path, compression=None, compresslevel=None, cache=None):
+    """
+    清理、验证并转换单个XML输入
+    
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+        csv_path: CSV文件输出路径
+        compression: 输出压缩格式
+        compresslevel: 压缩级别
+        cache: ModelCache，命中时不再清理和解析XML
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    try:
+        models, cached = cached_models(cache, xml_path, PROFILE_STRIPPED, partial(extract_models, xml_path))
+        success, message = models_to_csv(models, csv_path, compression, compresslevel)
+    except StructureError as e:
+        return False, str(e)
     except ET.ParseError as e:
         return False, f"XML解析错误: {str(e)}"
     except Exception as e:
         return False, f"转换失败: {str(e)}"
+    if cached:
+        message += "（缓存）"
+    return success, message
 
-def process_directory(input_dir, output_dir):
+def process_directory(input_dir, output_dir, jobs=1, compression=None, compresslevel=None, cache=None,
+                      reporter=None, shard=None,
+                      timeout=None, memory_limit=None):
     """
     批量处理指定目录下的所有XML文件，只保留第一级目录结构
     如果目标文件已存在则跳过处理
     
+    压缩文件 (.xml.gz/.xml.bz2/.xml.xz) 和归档 (.zip/.tar*) 中的XML成员
+    同样会被处理，归档视为与其同名的目录。
+    
     Args:
         input_dir: XML文件所在目录
         output_dir: CSV文件输出目录
+        jobs: 并行进程数，默认顺序处理
+        compression: 输出压缩格式 ('gz'、'bz2' 或 'xz')，默认不压缩
+        compresslevel: 压缩级别
+        cache: ModelCache，命中时不再清理和解析XML
+        reporter: RunReporter，决定每个文件的输出方式并写运行报告，处理结束时关闭
+        shard: Shard，只处理其中一个分片的输入，并在输出目录的 _shards 中写出清单
+        timeout: 单个文件的转换时间上限（秒），超时的隔离工作进程被终止
+        memory_limit: 单个隔离工作进程的内存上限（字节）
     """
+    if reporter is None:
+        reporter = RunReporter()
+    if shard is None:
+        shard = Shard()
+    
     # 确保输出目录存在
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -200,90 +315,99 @@ def process_directory(input_dir, output_dir):
     skipped_count = 0
     failed_files = []
     
-    # 遍历输入目录
-    for root, dirs, files in os.walk(input_dir):
-        # 过滤出XML文件
-        xml_files = [f for f in files if f.lower().endswith('.xml')]
-        
-        if not xml_files:
-            continue
-            
-        # 获取相对于输入目录的路径
-        rel_path = os.path.relpath(root, input_dir)
-        path_parts = rel_path.split(os.sep)
+    # 每个输出文件对应的序号
+    file_numbers = {}
+    # 本分片负责的输出文件
+    planned_outputs = []
+    started = datetime.now()
+    
+    def plan_outputs():
+        """确定每个输入的输出路径，只保留本分片负责的输入"""
+        inputs = scan_inputs(input_dir)
+        candidates = []
         
-        # 只取第一级目录
-        if len(path_parts) > 1:
-            output_subdir = os.path.join(output_dir, path_parts[0])
-        else:
-            output_subdir = output_dir
+        # 遍历输入目录（归档成员按其虚拟目录分组）
+        for rel_path, xml_inputs in group_by_directory(inputs).items():
+            path_parts = rel_path.split(os.sep)
             
-        # 确保输出子目录存在
-        if not os.path.exists(output_subdir):
-            os.makedirs(output_subdir)
-            
-        for file in xml_files:
-            total_files += 1
-            xml_path = os.path.join(root, file)
-            
-            # 生成输出文件名
-            # 如果当前目录只有一个XML文件，使用最后一级目录名作为文件名
-            if len(xml_files) == 1:
-                csv_filename = os.path.basename(root) + '.csv'
+            # 只取第一级目录
+            if len(path_parts) > 1:
+                output_subdir = os.path.join(output_dir, path_parts[0])
             else:
-                csv_filename = os.path.splitext(file)[0] + '.csv'
+                output_subdir = output_dir
+                
+            root = os.path.join(input_dir, rel_path) if rel_path else input_dir
             
-            csv_path = os.path.join(output_subdir, csv_filename)
+            for xml_input in xml_inputs:
+                file = os.path.basename(xml_input.rel_path)
+                
+                # 生成输出文件名
+                # 如果当前目录只有一个XML文件，使用最后一级目录名作为文件名
+                if len(xml_inputs) == 1:
+                    csv_filename = os.path.basename(root) + '.csv' + output_suffix(compression)
+                else:
+                    csv_filename = os.path.splitext(file)[0] + '.csv' + output_suffix(compression)
+                
+                candidates.append((xml_input, os.path.join(output_subdir, csv_filename)))
+        
+        # 按输出路径分片，同名输出总在同一分片
+        return shard.select(candidates, key=lambda item: shard_key(item[1], output_dir),
+                            size=lambda item: item[0].size)
+    
+    def plan_tasks():
+        nonlocal total_files, skipped_count
+        
+        candidates = plan_outputs()
+        planned_outputs.extend(csv_path for _, csv_path in candidates)
+        reporter.set_total(len(candidates), sum(xml_input.size for xml_input, _ in candidates))
+        
+        for xml_input, csv_path in candidates:
+            total_files += 1
             
-            print(f"[{total_files}] 处理文件：")
-            print(f"源文件：{xml_path}")
-            print(f"目标文件：{csv_path}")
+            # 确保输出子目录存在
+            os.makedirs(os.path.dirname(csv_path), exist_ok=True)
             
-            # 检查目标文件是否已存在
-            if os.path.exists(csv_path):
-                print("✓ 跳过：目标文件已存在")
+            # 检查目标文件是否已存在（包括本次运行中已安排的）
+            if os.path.exists(csv_path) or csv_path in file_numbers:
+                if reporter.verbose:
+                    print(f"[{total_files}] 处理文件：")
+                    print(f"源文件：{xml_input.display_name}")
+                    print(f"目标文件：{csv_path}")
+                    print("✓ 跳过：目标文件已存在")
+                    print("=" * 60)
                 skipped_count += 1
-                print("=" * 60)
+                reporter.skipped(xml_input, csv_path, "目标文件已存在")
                 continue
             
-            try:
-                # 清理XML内容
-                cleaned_content = clean_xml_content(xml_path)
-                
-                # 验证清理后的XML结构
-                valid, message = validate_xml_structure(cleaned_content)
-                if not valid:
-                    print(f"✗ 失败：{message}")
-                    failed_files.append((xml_path, message))
-                    continue
-                
-                # 创建临时文件存储清理后的内容
-                import tempfile
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False, encoding='utf-8') as temp_file:
-                    temp_file.write(cleaned_content)
-                    temp_path = temp_file.name
-                
-                try:
-                    # 使用临时文件进行转换
-                    success, message = xml_to_csv(temp_path, csv_path)
-                    if success:
-                        success_count += 1
-                        print(f"✓ 成功：{message}")
-                    else:
-                        failed_files.append((xml_path, message))
-                        print(f"✗ 失败：{message}")
-                finally:
-                    # 删除临时文件
-                    os.unlink(temp_path)
-                    
-            except Exception as e:
-                failed_files.append((xml_path, str(e)))
-                print(f"✗ 失败：处理文件时发生错误 - {str(e)}")
-            
-            print("=" * 60)
+            file_numbers[csv_path] = total_files
+            yield xml_input, csv_path
+    
+    convert = partial(convert_file, compression=compression, compresslevel=compresslevel, cache=cache)
+    results = run_conversions(plan_tasks(), convert, jobs, timed=True, timeout=timeout,
+                              memory_limit=memory_limit)
+    for (xml_input, csv_path), success, message, seconds in results:
+        reporter.finished(xml_input, csv_path, success, message, seconds)
+        if success:
+            success_count += 1
+        else:
+            failed_files.append((xml_input.display_name, message))
+        if not reporter.verbose:
+            continue
+        print(f"[{file_numbers[csv_path]}] 处理文件：")
+        print(f"源文件：{xml_input.display_name}")
+        print(f"目标文件：{csv_path}")
+        if success:
+            print(f"✓ 成功：{message}")
+        else:
+            print(f"✗ 失败：{message}")
+        print("=" * 60)
+    reporter.close()
+    if shard.sharded:
+        write_manifest(manifest_path(output_dir, shard), shard, 'xml2csv2', reporter,
+                       planned_outputs, output_dir, started)
     
     # 打印处理总结
-    print("\n处理完成：")
+    print("\n处理完成：" if not shard.sharded else f"\n分片 {shard} 处理完成：")
     print(f"总文件数：{total_files}")
     print(f"成功：{success_count}")
     print(f"跳过：{skipped_count}")
@@ -297,12 +421,21 @@ def process_directory(input_dir, output_dir):
             print(f"  错误：{error}")
 
 def main():
-    if len(sys.argv) != 3:
-        print("用法: python xml2csv.py <输入目录> <输出目录>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='批量将XML文件转换为按设备分组的CSV文件')
+    parser.add_argument('input_dir', help='输入目录')
+    parser.add_argument('output_dir', help='输出目录')
+    parser.add_argument('--jobs', type=int, default=1, help='并行进程数 (默认 1)')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), help='压缩输出的CSV文件')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    parser.add_argument('--cache-dir', default=None, help='设备模型缓存目录，命中时不再解析XML')
+    parser.add_argument('--cache-size', default=None, help='缓存目录大小上限，如 500M、2G (默认 1G)')
+    add_report_arguments(parser)
+    add_shard_arguments(parser)
+    add_isolation_arguments(parser)
+    args = parser.parse_args()
     
-    input_dir = sys.argv[1]
-    output_dir = sys.argv[2]
+    input_dir = args.input_dir
+    output_dir = args.output_dir
     
     # 检查输入目录是否存在
     if not os.path.exists(input_dir):
@@ -311,7 +444,13 @@ def main():
     
     # 开始处理
     try:
-        process_directory(input_dir, output_dir)
+        cache = None
+        if args.cache_dir:
+            cache_size = parse_size(args.cache_size) if args.cache_size else DEFAULT_CACHE_SIZE
+            cache = ModelCache(args.cache_dir, cache_size)
+        process_directory(input_dir, output_dir, args.jobs, args.compress, args.level, cache,
+                          reporter_from_args(args), shard_from_args(args),
+                          args.timeout, args.worker_memory)
     except Exception as e:
         print(f"处理过程中发生错误: {str(e)}")
         sys.exit(1)
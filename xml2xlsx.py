@@ -1,208 +1,536 @@
 import sys  # 添加此行以导入sys模块
 import xml.etree.ElementTree as ET
 from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
 import os
 import re
+import argparse
+from datetime import datetime
+from functools import partial
+from batch_runner import add_isolation_arguments, run_conversions
+from run_report import add_report_arguments, reporter_from_args
+from sharding import add_shard_arguments, manifest_path, shard_from_args, shard_key, write_manifest
+from memory_budget import ENGINES, PeakMemory, choose_engine, parse_size
+from model_cache import DEFAULT_CACHE_SIZE, PROFILE_XLSX, PROFILE_XLSX_ALL, PROFILE_XLSX_STREAM, ModelCache, cached_models
+from xlsx_grouping import DEFAULT_GROUPING, GROUPINGS, append_grouped_rows, apply_grouping, check_grouping
+from xml_sources import inputs_in_directory, open_cleaned, read_input
+from xml_backends import BACKENDS, DEFAULT_BACKEND, check_entities, device_model_from_element, get_backend, iter_ports
+from xml_filter import add_filter_arguments, filter_from_args
+from xml_links import LinkIndex, append_links_sheet
+from port_counters import PortCounters, append_counter_sheets
+from xml_preview import DEFAULT_SAMPLE_BYTES, add_preview_arguments, preview_models, sample_bytes_from_args
 
-def xml_to_xlsx(xml_file, xlsx_file):
+# 设备、ImRecord 和端口的提取字段
+DEVICE_FIELDS = ['NameOfStation', 'IpAddress', 'DeviceType', 'MAC', 'ManufacturerID',
+                 'ManufacturerName', 'Role', 'RunState', 'DeviceID', 'GatewayIp', 'NetworkMask']
+IM_RECORD_FIELDS = ['OrderID', 'SerialNumber', 'HardwareRevision', 'SoftwareRevision',
+                    'RevisionCounter', 'ProfileID', 'ProfileDetails', 'IMVersion', 'IMSupported']
+PORT_FIELDS = ['PortID', 'PortDesc', 'OperStatus', 'RemotePortID', 'RemoteNameOfStation',
+               'RemoteMAC', 'NetworkLoadIn', 'NetworkLoadOut', 'IsWireless', 'PowerBudget',
+               'RxPortErrorsFrames', 'RemChassisIdSubtype', 'SwitchGroup', 'CableDelay', 'MauType']
+
+# 工作表的表头
+DEVICE_HEADERS = DEVICE_FIELDS + IM_RECORD_FIELDS
+PORT_HEADERS = ['PortID', 'PortDesc', 'OperStatus', 'RemotePortID', 'RemoteNameOfStation',
+                'RemoteMAC', 'CableDelay', 'MauType']
+
+def decode_xml_content(xml_content):
     """
-    从XML文件提取设备信息并保存为XLSX格式
+    解码XML原始字节内容并清理无效字符
+    
+    Args:
+        xml_content: XML文件的原始字节内容
+    Returns:
+        xml_text: 清理后的XML文本
     """
-    try:
-        # 首先尝试直接读取并清理内容
-        with open(xml_file, 'rb') as f:  # 使用二进制模式读取
-            xml_content = f.read()
-            
-        # 尝试不同的编码方式
-        encodings = ['utf-8', 'utf-8-sig', 'utf-16', 'gb2312', 'gbk', 'iso-8859-1']
-        xml_text = None
-        
-        for encoding in encodings:
-            try:
-                xml_text = xml_content.decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-                
-        if xml_text is None:
-            # 如果所有编码都失败，使用忽略错误的方式
-            xml_text = xml_content.decode('utf-8', errors='ignore')
-        
-        # 清理XML内容
-        xml_text = xml_text.replace('&#x0;', '')
-        xml_text = xml_text.replace('&#0;', '')
-        xml_text = ''.join(char for char in xml_text if char.isprintable() or char in '\n\r\t')
-        
-        # 移除任何可能的BOM标记
-        if xml_text.startswith('\ufeff'):
-            xml_text = xml_text[1:]
-            
-        # 尝试解析清理后的XML
+    # 尝试不同的编码方式
+    encodings = ['utf-8', 'utf-8-sig', 'utf-16', 'gb2312', 'gbk', 'iso-8859-1']
+    xml_text = None
+    
+    for encoding in encodings:
         try:
-            root = ET.fromstring(xml_text.encode('utf-8'))
-        except ET.ParseError as e:
-            # 如果解析失败，尝试更激进的清理
-            xml_text = re.sub(r'&#x[0-9a-fA-F]+;', '', xml_text)  # 移除所有十六进制字符引用
-            xml_text = re.sub(r'&#\d+;', '', xml_text)  # 移除所有十进制字符引用
-            root = ET.fromstring(xml_text.encode('utf-8'))
-        
-        devices = []
-        interfaces = []
-        ports = []
-
-        # 提取设备和接口信息
-        for device in root.findall('.//Device'):
-            # 获取ImRecord信息
-            im_record = device.find('ImRecord')
-            device_info = {
-                'NameOfStation': device.find('NameOfStation').text if device.find('NameOfStation') is not None else '',
-                'IpAddress': device.find('IpAddress').text if device.find('IpAddress') is not None else '',
-                'DeviceType': device.find('DeviceType').text if device.find('DeviceType') is not None else '',
-                'MAC': device.find('MAC').text if device.find('MAC') is not None else '',
-                'ManufacturerID': device.find('ManufacturerID').text if device.find('ManufacturerID') is not None else '',
-                'ManufacturerName': device.find('ManufacturerName').text if device.find('ManufacturerName') is not None else '',
-                'Role': device.find('Role').text if device.find('Role') is not None else '',
-                'RunState': device.find('RunState').text if device.find('RunState') is not None else '',
-                'DeviceID': device.find('DeviceID').text if device.find('DeviceID') is not None else '',
-                'GatewayIp': device.find('GatewayIp').text if device.find('GatewayIp') is not None else '',
-                'NetworkMask': device.find('NetworkMask').text if device.find('NetworkMask') is not None else '',
-                # ImRecord信息
-                'OrderID': im_record.find('OrderID').text if im_record is not None and im_record.find('OrderID') is not None else '',
-                'SerialNumber': im_record.find('SerialNumber').text if im_record is not None and im_record.find('SerialNumber') is not None else '',
-                'HardwareRevision': im_record.find('HardwareRevision').text if im_record is not None and im_record.find('HardwareRevision') is not None else '',
-                'SoftwareRevision': im_record.find('SoftwareRevision').text if im_record is not None and im_record.find('SoftwareRevision') is not None else '',
-                'RevisionCounter': im_record.find('RevisionCounter').text if im_record is not None and im_record.find('RevisionCounter') is not None else '',
-                'ProfileID': im_record.find('ProfileID').text if im_record is not None and im_record.find('ProfileID') is not None else '',
-                'ProfileDetails': im_record.find('ProfileDetails').text if im_record is not None and im_record.find('ProfileDetails') is not None else '',
-                'IMVersion': im_record.find('IMVersion').text if im_record is not None and im_record.find('IMVersion') is not None else '',
-                'IMSupported': im_record.find('IMSupported').text if im_record is not None and im_record.find('IMSupported') is not None else '',
-            }
-
-            # 获取Modules信息
-            modules = device.find('Modules')
-            if modules is not None:
-                for i, module in enumerate(modules.findall('Module')):  # 添加 enumerate 来获取索引
-                    module_info = {
-                        'ModuleIdentNumber': module.find('ModuleIdentNumber').text if module.find('ModuleIdentNumber') is not None else '',
-                        'ModuleName': module.find('ModuleName').text if module.find('ModuleName') is not None else '',
-                        'ModuleOrderNumber': module.find('OrderNumber').text if module.find('OrderNumber') is not None else '',
-                    }
-                    # 将模块信息添加到设备信息中
-                    device_info.update({
-                        f'Module_{i+1}_IdentNumber': module_info['ModuleIdentNumber'],
-                        f'Module_{i+1}_Name': module_info['ModuleName'],
-                        f'Module_{i+1}_OrderNumber': module_info['ModuleOrderNumber'],
-                    })
-
-            devices.append(device_info)
-
-            # 提取端口信息
-            for interface in device.findall('.//PnInterface'):
-                port_list = interface.find('PortList')
-                if port_list is not None:
-                    for port in port_list.findall('Port'):
-                        port_info = {
-                            'DeviceName': device_info['NameOfStation'],
-                            'PortID': port.find('PortID').text if port.find('PortID') is not None else '',
-                            'PortDesc': port.find('PortDesc').text if port.find('PortDesc') is not None else '',
-                            'OperStatus': port.find('OperStatus').text if port.find('OperStatus') is not None else '',
-                            'RemotePortID': port.find('RemotePortID').text if port.find('RemotePortID') is not None else '',
-                            'RemoteNameOfStation': port.find('RemoteNameOfStation').text if port.find('RemoteNameOfStation') is not None else '',
-                            'RemoteMAC': port.find('RemoteMAC').text if port.find('RemoteMAC') is not None else '',
-                            'NetworkLoadIn': port.find('NetworkLoadIn').text if port.find('NetworkLoadIn') is not None else '',
-                            'NetworkLoadOut': port.find('NetworkLoadOut').text if port.find('NetworkLoadOut') is not None else '',
-                            'IsWireless': port.find('IsWireless').text if port.find('IsWireless') is not None else '',
-                            'PowerBudget': port.find('PowerBudget').text if port.find('PowerBudget') is not None else '',
-                            'RxPortErrorsFrames': port.find('RxPortErrorsFrames').text if port.find('RxPortErrorsFrames') is not None else '',
-                            'RemChassisIdSubtype': port.find('RemChassisIdSubtype').text if port.find('RemChassisIdSubtype') is not None else '',
-                            'SwitchGroup': port.find('SwitchGroup').text if port.find('SwitchGroup') is not None else '',
-                            'CableDelay': port.find('CableDelay').text if port.find('CableDelay') is not None else '',
-                            'MauType': port.find('MauType').text if port.find('MauType') is not None else '',
-                        }
-                        ports.append(port_info)
-
-        # 创建 Excel 工作簿
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Combined"
-
-        # 写入表头
-        device_headers = ['NameOfStation', 'IpAddress', 'DeviceType', 'MAC', 'ManufacturerID', 
-                         'ManufacturerName', 'Role', 'RunState', 'DeviceID', 'GatewayIp', 'NetworkMask',
-                         'OrderID', 'SerialNumber', 'HardwareRevision', 'SoftwareRevision', 
-                         'RevisionCounter', 'ProfileID', 'ProfileDetails', 'IMVersion', 'IMSupported']
+            xml_text = xml_content.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+            
+    if xml_text is None:
+        # 如果所有编码都失败，使用忽略错误的方式
+        xml_text = xml_content.decode('utf-8', errors='ignore')
+    
+    # 清理XML内容
+    xml_text = xml_text.replace('&#x0;', '')
+    xml_text = xml_text.replace('&#0;', '')
+    xml_text = ''.join(char for char in xml_text if char.isprintable() or char in '\n\r\t')
+    
+    # 移除任何可能的BOM标记
+    if xml_text.startswith('\ufeff'):
+        xml_text = xml_text[1:]
         
-        # 添加模块表头
-        module_headers = []
-        max_modules = 3
+    return xml_text
+
+def strip_char_references(xml_text):
+    """移除所有数字字符引用，用于解析失败后的激进清理"""
+    xml_text = re.sub(r'&#x[0-9a-fA-F]+;', '', xml_text)  # 移除所有十六进制字符引用
+    xml_text = re.sub(r'&#\d+;', '', xml_text)  # 移除所有十进制字符引用
+    return xml_text
+
+def parse_xml_content(xml_content):
+    """
+    解码并清理XML原始字节内容，返回解析后的根元素
+    
+    Args:
+        xml_content: XML文件的原始字节内容
+    Returns:
+        root: 解析后的根元素
+    """
+    xml_text = decode_xml_content(xml_content)
+    check_entities(xml_text)
         
-        # 添加端口表头定义
-        port_headers = ['PortID', 'PortDesc', 'OperStatus', 'RemotePortID', 'RemoteNameOfStation',
-                       'RemoteMAC', 'CableDelay', 'MauType']
+    # 尝试解析清理后的XML
+    try:
+        root = ET.fromstring(xml_text.encode('utf-8'))
+    except ET.ParseError as e:
+        # 如果解析失败，尝试更激进的清理
+        xml_text = strip_char_references(xml_text)
+        root = ET.fromstring(xml_text.encode('utf-8'))
+    
+    return root
+
+def load_device_models(xml_content, backend=None):
+    """
+    解码并清理XML原始字节内容，提取所有设备模型
+    
+    ElementTree 后端沿用 './/Device' 查找所有设备；其他后端只处理
+    DeviceCollection 下的 Device。
+    
+    Args:
+        xml_content: XML文件的原始字节内容
+        backend: 解析后端名称，默认 etree
+    Returns:
+        models: 设备模型列表
+    """
+    if backend in (None, 'etree'):
+        root = parse_xml_content(xml_content)
+        return [device_model_from_element(device) for device in root.findall('.//Device')]
 
-        all_headers = device_headers + module_headers + port_headers
-        ws.append(all_headers)
+    parser = get_backend(backend)
+    xml_text = decode_xml_content(xml_content)
+    try:
+        return list(parser.iter_devices(xml_text.encode('utf-8')))
+    except ET.ParseError:
+        # 如果解析失败，尝试更激进的清理
+        xml_text = strip_char_references(xml_text)
+        return list(parser.iter_devices(xml_text.encode('utf-8')))
 
-        # 为每个设备写入数据
-        current_row = 2
-        for device in devices:
-            device_ports = [port for port in ports if port['DeviceName'] == device['NameOfStation']]
-            
-            if device_ports:
-                for port in device_ports:
-                    row_data = []
-                    for header in device_headers:
-                        row_data.append(device[header])
-                    for header in module_headers:
-                        row_data.append(device[header])
-                    for header in port_headers:
-                        row_data.append(port.get(header, ''))
-                    ws.append(row_data)
-                
-                if len(device_ports) > 1:
-                    for col in range(1, len(device_headers) + 1):
-                        ws.merge_cells(
-                            start_row=current_row,
-                            start_column=col,
-                            end_row=current_row + len(device_ports) - 1,
-                            end_column=col
-                        )
-                current_row += len(device_ports)
-            else:
+# 与 decode_xml_content 相同的候选编码（UTF-16 由 BOM 识别，utf-8-sig 与 utf-8 等价）
+STREAM_ENCODINGS = ('utf-8', 'gb2312', 'gbk', 'iso-8859-1')
+
+def clean_xml_text(xml_text):
+    """对一段已解码的文本做与 decode_xml_content 相同的清理"""
+    xml_text = xml_text.replace('&#x0;', '')
+    xml_text = xml_text.replace('&#0;', '')
+    return ''.join(char for char in xml_text if char.isprintable() or char in '\n\r\t')
+
+def stream_device_models(xml_file, strip_references=False):
+    """
+    流式解码、清理并解析XML输入，逐个产出设备模型（expat 后端）
+
+    与 ElementTree 后端的 load_device_models 一样处理所有 .//Device，包括
+    嵌套在另一个 Device 中的 Device（见 xml_backends）。
+
+    Args:
+        xml_file: XML文件路径、XmlInput 或已读取的字节内容
+        strip_references: 是否同时移除所有数字字符引用
+    """
+    clean_text = clean_xml_text
+    if strip_references:
+        clean_text = lambda text: strip_char_references(clean_xml_text(text))
+
+    with open_cleaned(xml_file, clean_text, STREAM_ENCODINGS) as f:
+        yield from get_backend('expat').iter_devices(f, all_devices=True)
+
+def extract_device_fields(model):
+    """从设备模型中提取设备、ImRecord 和模块信息"""
+    device = model['device']
+    im_record = model['im_record']
+    device_info = {field: device.get(field, '') for field in DEVICE_FIELDS}
+    device_info.update({field: im_record.get(field, '') for field in IM_RECORD_FIELDS})
+
+    # 将模块信息添加到设备信息中
+    for i, module in enumerate(model['modules']):
+        device_info.update({
+            f'Module_{i+1}_IdentNumber': module.get('ModuleIdentNumber', ''),
+            f'Module_{i+1}_Name': module.get('ModuleName', ''),
+            f'Module_{i+1}_OrderNumber': module.get('OrderNumber', ''),
+        })
+
+    return device_info
+
+def build_workbook(models, grouping=DEFAULT_GROUPING):
+    """
+    从设备模型生成按设备分组（默认合并相同设备单元格）的工作簿
+    
+    Args:
+        models: 设备模型列表
+        grouping: 分组方式，见 xlsx_grouping.GROUPINGS
+    Returns:
+        wb: openpyxl 工作簿
+    """
+    devices = []
+    # 按设备名称归组的端口，保持文档顺序
+    ports_by_name = {}
+
+    # 提取设备和端口信息
+    for model in models:
+        device_info = extract_device_fields(model)
+        devices.append(device_info)
+
+        for port in iter_ports(model):
+            port_info = {field: port.get(field, '') for field in PORT_FIELDS}
+            port_info['DeviceName'] = device_info['NameOfStation']
+            ports_by_name.setdefault(device_info['NameOfStation'], []).append(port_info)
+
+    # 创建 Excel 工作簿
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Combined"
+
+    # 写入表头
+    device_headers = DEVICE_HEADERS
+    
+    # 添加模块表头
+    module_headers = []
+    max_modules = 3
+    
+    # 添加端口表头定义
+    port_headers = PORT_HEADERS
+
+    all_headers = device_headers + module_headers + port_headers
+    ws.append(all_headers)
+
+    # 为每个设备写入数据
+    current_row = 2
+    groups = []
+    for device in devices:
+        device_ports = ports_by_name.get(device['NameOfStation'], [])
+        
+        if device_ports:
+            for port in device_ports:
                 row_data = []
                 for header in device_headers:
                     row_data.append(device[header])
-                row_data.extend([''] * len(module_headers))
-                row_data.extend([''] * len(port_headers))
+                for header in module_headers:
+                    row_data.append(device[header])
+                for header in port_headers:
+                    row_data.append(port.get(header, ''))
                 ws.append(row_data)
-                current_row += 1
-
-        # 设置列宽
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column].width = adjusted_width
+            
+            groups.append((current_row, current_row + len(device_ports) - 1))
+            current_row += len(device_ports)
+        else:
+            row_data = []
+            for header in device_headers:
+                row_data.append(device[header])
+            row_data.extend([''] * len(module_headers))
+            row_data.extend([''] * len(port_headers))
+            ws.append(row_data)
+            groups.append((current_row, current_row))
+            current_row += 1
+
+    # 按设备分组，合并或留空的设备单元格在计算列宽时按 'None' 计
+    apply_grouping(ws, groups, list(range(1, len(device_headers) + 1)), grouping)
+
+    # 设置列宽
+    for col in ws.columns:
+        max_length = 0
+        column = col[0].column_letter
+        for cell in col:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
+            except:
+                pass
+        adjusted_width = (max_length + 2)
+        ws.column_dimensions[column].width = adjusted_width
+
+    return wb
+
+def device_sheet_rows(model):
+    """
+    将一个设备模型压缩为工作表所需的元组
+
+    Returns:
+        (device_row, name, port_rows): 设备列的元组、设备名称和端口列元组列表
+    """
+    device = model['device']
+    im_record = model['im_record']
+    device_row = (tuple(device.get(field, '') for field in DEVICE_FIELDS) +
+                  tuple(im_record.get(field, '') for field in IM_RECORD_FIELDS))
+    port_rows = [tuple(port.get(field, '') for field in PORT_HEADERS) for port in iter_ports(model)]
+    return device_row, device.get('NameOfStation', ''), port_rows
+
+def collect_rows(models):
+    """
+    将设备模型压缩为写出工作表所需的元组
+
+    Returns:
+        (devices, ports_by_name): 设备行元组列表，以及按设备名称归组的端口行元组
+    """
+    devices = []
+    ports_by_name = {}
+    for model in models:
+        device_row, name, port_rows = device_sheet_rows(model)
+        devices.append(device_row)
+        if port_rows:
+            ports_by_name.setdefault(name, []).extend(port_rows)
+    return devices, ports_by_name
 
+def _device_groups(devices, ports_by_name):
+    """
+    按 build_workbook 的布局产出每个设备的数据行列表
+
+    被合并的设备单元格（同一设备的非首行）为 None。
+    """
+    name_index = DEVICE_FIELDS.index('NameOfStation')
+    merged_device = (None,) * len(DEVICE_HEADERS)
+    empty_port = ('',) * len(PORT_HEADERS)
+    for device in devices:
+        device_ports = ports_by_name.get(device[name_index])
+        if not device_ports:
+            yield [device + empty_port]
+            continue
+        yield [device + device_ports[0]] + [merged_device + port for port in device_ports[1:]]
+
+def write_workbook_streaming(devices, ports_by_name, xlsx_file, grouping=DEFAULT_GROUPING, link_index=None,
+                             counters=None):
+    """
+    以 openpyxl 只写模式直接写出与 build_workbook 相同内容的工作簿
+
+    行数据逐行写入压缩包，不在内存中保留单元格对象；列宽在写入前
+    按与 build_workbook 相同的规则（合并掉的单元格按 'None' 计）计算。
+
+    Args:
+        devices, ports_by_name: collect_rows 的结果
+        xlsx_file: XLSX文件路径
+        grouping: 分组方式，见 xlsx_grouping.GROUPINGS
+        link_index: xml_links.LinkIndex，给出时追加链路表工作表
+        counters: port_counters.PortCounters，给出时追加端口计数器和汇总工作表
+    """
+    headers = DEVICE_HEADERS + PORT_HEADERS
+    widths = [len(header) for header in headers]
+    for rows in _device_groups(devices, ports_by_name):
+        for row in rows:
+            for col, value in enumerate(row):
+                length = len(str(value))
+                if length > widths[col]:
+                    widths[col] = length
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Combined")
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width + 2
+
+    # 合并区域以字符串登记，只写模式的工作表在写尾部时按字符串输出；
+    # 用字符串代替 CellRange 对象，每个区域只占几十字节
+    append_grouped_rows(ws, headers, _device_groups(devices, ports_by_name),
+                        list(range(1, len(DEVICE_HEADERS) + 1)), grouping)
+    if link_index is not None:
+        append_links_sheet(wb, link_index)
+    if counters is not None:
+        append_counter_sheets(wb, counters)
+    wb.save(xlsx_file)
+
+def _filtered(models, model_filter, link_index=None, counters=None):
+    """
+    按条件过滤设备模型（缓存写入的是过滤前的完整模型）
+
+    给出 link_index 时同时登记端口；链路在过滤之前登记，对端不受过滤条件影响。
+    计数器在过滤之后登记，汇总只包括写出的设备和端口。
+    """
+    if link_index is not None:
+        models = link_index.track(models)
+    if model_filter:
+        models = model_filter.apply(models)
+    if counters is not None:
+        models = counters.track(models)
+    return models
+
+def write_xlsx(xml_file, xlsx_file, backend=None, engine='auto', cache=None,
+               grouping=DEFAULT_GROUPING, model_filter=None, links=False, counters=False,
+               head=None, sample=None, seed=None, sample_bytes=DEFAULT_SAMPLE_BYTES):
+    """
+    从XML文件提取设备信息并保存为XLSX格式，出错时抛出异常
+
+    参数见 xml_to_xlsx。
+
+    Returns:
+        str: 模型来源的说明（缓存、引擎名称或预览结果）
+    """
+    check_grouping(grouping)
+    engine = choose_engine(xml_file, engine, tree_factor=None)
+    link_index = LinkIndex() if links else None
+    port_counters = PortCounters() if counters else None
+    if head is not None or sample is not None:
+        # 与流式引擎相同的解码和清理，解析失败时同样改用更激进的清理
+        try:
+            preview = preview_models(xml_file, head, sample, seed, sample_bytes, model_filter=model_filter,
+                                     clean_text=clean_xml_text, encodings=STREAM_ENCODINGS, all_devices=True)
+        except ET.ParseError:
+            preview = preview_models(xml_file, head, sample, seed, sample_bytes, model_filter=model_filter,
+                                     clean_text=lambda text: strip_char_references(clean_xml_text(text)),
+                                     encodings=STREAM_ENCODINGS, all_devices=True)
+        wb = build_workbook(_filtered(preview.models, None, link_index, port_counters), grouping)
+        if link_index is not None:
+            append_links_sheet(wb, link_index)
+        if port_counters is not None:
+            append_counter_sheets(wb, port_counters)
         wb.save(xlsx_file)
-        return True, "处理成功"
-        
-    except Exception as e:
-        return False, f"处理失败: {str(e)}"
+        return f"预览 {len(preview.models)} 个设备，{preview.describe()}"
+    if engine == 'stream':
+        # 流式解码和解析，只保留写出所需的元组
+        try:
+            models, cached = cached_models(cache, xml_file, PROFILE_XLSX_STREAM,
+                                           lambda: stream_device_models(xml_file))
+            devices, ports_by_name = collect_rows(_filtered(models, model_filter, link_index,
+                                                            port_counters))
+        except ET.ParseError:
+            # 重新解析时重新登记端口
+            link_index = LinkIndex() if links else None
+            port_counters = PortCounters() if counters else None
+            # 如果解析失败，尝试更激进的清理
+            models, cached = cached_models(cache, xml_file, PROFILE_XLSX_STREAM,
+                                           lambda: stream_device_models(xml_file, True))
+            devices, ports_by_name = collect_rows(_filtered(models, model_filter, link_index,
+                                                            port_counters))
+        write_workbook_streaming(devices, ports_by_name, xlsx_file, grouping, link_index, port_counters)
+    else:
+        # ElementTree 后端查找所有 .//Device，提取结果与其他后端不同
+        profile = PROFILE_XLSX_ALL if backend in (None, 'etree') else PROFILE_XLSX
+        # 首先尝试直接读取并清理内容（压缩文件和归档成员会被自动解压）
+        models, cached = cached_models(cache, xml_file, profile,
+                                       lambda: iter(load_device_models(read_input(xml_file), backend)))
+        wb = build_workbook(_filtered(models, model_filter, link_index, port_counters), grouping)
+        if link_index is not None:
+            append_links_sheet(wb, link_index)
+        if port_counters is not None:
+            append_counter_sheets(wb, port_counters)
+        wb.save(xlsx_file)
+    return "缓存" if cached else f"{engine} 引擎"
+
+def xml_to_xlsx(xml_file, xlsx_file, backend=None, engine='auto', cache=None,
+                grouping=DEFAULT_GROUPING, model_filter=None, links=False, counters=False,
+                head=None, sample=None, seed=None, sample_bytes=DEFAULT_SAMPLE_BYTES):
+    """
+    从XML文件提取设备信息并保存为XLSX格式
+    
+    Args:
+        xml_file: XML文件路径、XmlInput 或已读取的字节内容
+        xlsx_file: XLSX文件路径
+        backend: 解析后端名称 ('etree' 或 'expat')，默认 etree；流式引擎总是使用 expat
+        engine: 'tree'、'stream' 或 'auto'（总是选择 stream，见 memory_budget）
+        cache: ModelCache，命中时不再解码、清理和解析XML
+        grouping: 同一设备多行的分组方式 ('merge'、'block'、'outline' 或 'band')
+        model_filter: xml_filter.ModelFilter，只写出满足条件的设备和端口
+        links: 是否追加链路表工作表 Links（见 xml_links）
+        counters: 是否追加端口计数器工作表 Counters 和汇总工作表 Summary（见 port_counters）
+        head: 预览：只写出前 head 个设备，得到后立即停止读取（不使用缓存）
+        sample: 预览：随机抽取 sample 个设备，见 xml_preview
+        seed: 抽样的随机种子
+        sample_bytes: 抽样时最多读取的解压后数据量
+    Returns:
+        (bool, str): (是否成功, 信息)，信息中附带本文件的内存峰值
+    """
+    with PeakMemory() as memory:
+        try:
+            source = write_xlsx(xml_file, xlsx_file, backend, engine, cache, grouping, model_filter,
+                                links, counters, head, sample, seed, sample_bytes)
+            success, message = True, f"处理成功（{source}）"
+            
+        except Exception as e:
+            success, message = False, f"处理失败: {str(e)}"
+    return success, f"{message}，{memory.describe()}"
+
+def output_file_for(xml_input, excel_dir):
+    """
+    推导XML输入对应的Excel文件路径
+    
+    日期命名（或以数字开头）的文件使用父目录名，其他文件使用原文件名；
+    只保留第一级目录。
+    
+    Args:
+        xml_input: XmlInput
+        excel_dir: Excel文件目标目录
+    Returns:
+        (xlsx_file, is_dated)；文件名包含"copy"的复制文件返回 (None, False)
+    """
+    # 获取相对于源目录的路径（归档成员视为在与归档同名的目录中）
+    rel_path = xml_input.rel_path
+    # 获取文件名和父目录名
+    file_name = os.path.basename(rel_path)
+    parent_dir = os.path.basename(os.path.dirname(xml_input.virtual_path))
+    
+    if "copy" in file_name.lower():
+        return None, False
+    
+    # 确定输出文件名
+    is_dated = file_name.startswith(('20', '19')) or any(c.isdigit() for c in file_name[:2])
+    if is_dated:
+        # 如果文件名是日期格式或以数字开头，使用父目录名
+        output_name = f"{parent_dir}.xlsx"
+    else:
+        # 否则使用原文件名（去掉.xml后缀）
+        output_name = os.path.splitext(file_name)[0] + '.xlsx'
+    
+    # 获取第一级目录
+    path_parts = rel_path.split(os.sep)
+    if len(path_parts) > 1:
+        # 如果文件在子目录中，使用第一级目录
+        first_level_dir = path_parts[0]
+        return os.path.join(excel_dir, first_level_dir, output_name), is_dated
+    # 如果文件在根目录，直接放在目标目录
+    return os.path.join(excel_dir, output_name), is_dated
+
+def _output_key(item, excel_dir):
+    """分片键：输出文件路径；复制文件没有输出，按输入路径分片"""
+    xml_input, xlsx_file, _ = item
+    if xlsx_file is None:
+        return 'copy:' + xml_input.rel_path.replace(os.sep, '/')
+    return shard_key(xlsx_file, excel_dir)
 
 def main():
-    if len(sys.argv) != 3:
-        print("用法: python xml2xlsx.py <XML文件源目录> <Excel文件目标目录>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='批量将XML文件转换为Excel文件')
+    parser.add_argument('xml_dir', help='XML文件源目录')
+    parser.add_argument('excel_dir', help='Excel文件目标目录')
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--jobs', type=int, default=1, help='并行进程数 (默认 1)')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='转换引擎：tree 整体解析并逐单元格构建工作簿（慢），stream 流式解析和写出，'
+                             'auto 即 stream (默认 auto)')
+    parser.add_argument('--cache-dir', default=None, help='设备模型缓存目录，命中时不再解析XML')
+    parser.add_argument('--cache-size', default=None, help='缓存目录大小上限，如 500M、2G (默认 1G)')
+    parser.add_argument('--grouping', choices=GROUPINGS, default=DEFAULT_GROUPING,
+                        help='同一设备多行的分组方式：merge 逐列合并，block 只合并第一列，'
+                             'outline 大纲折叠，band 交替底色 (默认 merge)')
+    parser.add_argument('--links', action='store_true',
+                        help='追加链路表工作表 Links：解析各端口的对端，标出不一致和悬空的链路')
+    parser.add_argument('--counters', action='store_true',
+                        help='追加 Counters（端口负载、错误帧、线缆延迟和功率预算，数值单元格）'
+                             '和 Summary（按设备汇总）工作表')
+    add_report_arguments(parser)
+    add_filter_arguments(parser)
+    add_preview_arguments(parser)
+    add_shard_arguments(parser)
+    add_isolation_arguments(parser)
+    args = parser.parse_args()
+    shard = shard_from_args(args)
+    cache = None
+    if args.cache_dir:
+        cache = ModelCache(args.cache_dir, parse_size(args.cache_size) if args.cache_size else DEFAULT_CACHE_SIZE)
         
-    xml_dir = sys.argv[1]
-    excel_dir = sys.argv[2]
+    xml_dir = args.xml_dir
+    excel_dir = args.excel_dir
     
     # 确保源目录存在
     if not os.path.isdir(xml_dir):
@@ -212,112 +540,125 @@ def main():
     # 确保目标目录存在，如果不存在则创建
     os.makedirs(excel_dir, exist_ok=True)
     
-    # 递归遍历源目录下的所有文件
+    reporter = reporter_from_args(args)
+    verbose = reporter.verbose
+    
+    # 递归遍历源目录下的所有文件（包括压缩文件和归档中的XML）
     xml_files = []
     print(f"\n开始扫描目录: {xml_dir}")
     for root, dirs, files in os.walk(xml_dir):
         # 显示当前正在扫描的目录
         current_dir = os.path.relpath(root, xml_dir)
-        if current_dir == '.':
-            print(f"扫描根目录...")
-        else:
-            print(f"扫描目录: {current_dir}")
+        if verbose:
+            if current_dir == '.':
+                print(f"扫描根目录...")
+            else:
+                print(f"扫描目录: {current_dir}")
             
         # 收集当前目录中的XML文件
-        xml_count = 0
-        for file in files:
-            if file.lower().endswith('.xml'):
-                xml_files.append(os.path.join(root, file))
-                xml_count += 1
+        xml_inputs = inputs_in_directory(root, files, xml_dir)
+        xml_files.extend(xml_inputs)
+        xml_count = len(xml_inputs)
         
-        if xml_count > 0:
+        if xml_count > 0 and verbose:
             print(f"  |- 找到 {xml_count} 个XML文件")
     
     if not xml_files:
         print(f"\n警告: 在目录树中未找到任何XML文件")
         sys.exit(0)
     
+    # 按输出文件分片：推导出同一个Excel文件的输入总在同一分片，并保持扫描顺序，
+    # 日期文件"先到先得"和非日期重名文件的跳过规则与不分片时相同
+    started = datetime.now()
+    xml_files = [(xml_input,) + output_file_for(xml_input, excel_dir) for xml_input in xml_files]
+    xml_files = shard.select(xml_files, key=partial(_output_key, excel_dir=excel_dir),
+                             size=lambda item: item[0].size)
+    
     # 处理所有找到的XML文件
     total_files = len(xml_files)
     success_count = 0
     failed_count = 0
     
-    print(f"\n总共找到 {total_files} 个XML文件，开始处理...")
+    if shard.sharded:
+        print(f"\n分片 {shard} 负责 {total_files} 个XML文件，开始处理...")
+    else:
+        print(f"\n总共找到 {total_files} 个XML文件，开始处理...")
     print("=" * 50)
+    reporter.set_total(total_files, sum(xml_input.size for xml_input, _, _ in xml_files))
     
     # 用于跟踪已处理的文件名
     processed_files = set()
+    # 每个输出文件对应的序号
+    file_numbers = {}
     
-    for i, xml_file in enumerate(xml_files, 1):
-        # 获取相对于源目录的路径
-        rel_path = os.path.relpath(xml_file, xml_dir)
-        # 获取文件名和父目录名
-        file_name = os.path.basename(xml_file)
-        parent_dir = os.path.basename(os.path.dirname(xml_file))
-        
-        # 如果文件名包含"copy"，跳过处理
-        if "copy" in file_name.lower():
-            print(f"\n[{i}/{total_files}] 处理文件:")
-            print(f"源文件: {rel_path}")
-            print("⚠ 跳过: 复制文件")
-            continue
-        
-        # 确定输出文件名
-        if file_name.startswith(('20', '19')) or any(c.isdigit() for c in file_name[:2]):
-            # 如果文件名是日期格式或以数字开头，使用父目录名
-            output_name = f"{parent_dir}.xlsx"
-        else:
-            # 否则使用原文件名（去掉.xml后缀）
-            output_name = os.path.splitext(file_name)[0] + '.xlsx'
-        
-        # 获取第一级目录
-        path_parts = rel_path.split(os.sep)
-        if len(path_parts) > 1:
-            # 如果文件在子目录中，使用第一级目录
-            first_level_dir = path_parts[0]
-            xlsx_file = os.path.join(excel_dir, first_level_dir, output_name)
-        else:
-            # 如果文件在根目录，直接放在目标目录
-            xlsx_file = os.path.join(excel_dir, output_name)
-            
-        # 检查目标文件是否已存在
-        if os.path.exists(xlsx_file):
-            print(f"\n[{i}/{total_files}] 处理文件:")
-            print(f"源文件: {rel_path}")
-            print(f"目标文件: {os.path.relpath(xlsx_file, excel_dir)}")
-            print("⚠ 跳过: 目标文件已存在")
-            continue
+    def plan_tasks():
+        for i, (xml_input, xlsx_file, is_dated) in enumerate(xml_files, 1):
+            rel_path = xml_input.rel_path
             
-        # 检查是否是重复文件（仅对非日期格式文件）
-        if not (file_name.startswith(('20', '19')) or any(c.isdigit() for c in file_name[:2])):
-            if xlsx_file in processed_files:
-                print(f"\n[{i}/{total_files}] 处理文件:")
-                print(f"源文件: {rel_path}")
-                print(f"目标文件: {os.path.relpath(xlsx_file, excel_dir)}")
-                print("⚠ 跳过: 文件已存在")
+            # 如果文件名包含"copy"，跳过处理
+            if xlsx_file is None:
+                if verbose:
+                    print(f"\n[{i}/{total_files}] 处理文件:")
+                    print(f"源文件: {rel_path}")
+                    print("⚠ 跳过: 复制文件")
+                reporter.skipped(xml_input, None, "复制文件")
                 continue
-        
-        # 记录已处理的文件
-        processed_files.add(xlsx_file)
-        
-        # 确保目标文件的���录存在
-        os.makedirs(os.path.dirname(xlsx_file), exist_ok=True)
-        
-        print(f"\n[{i}/{total_files}] 处理文件:")
-        print(f"源文件: {rel_path}")
-        print(f"目标文件: {os.path.relpath(xlsx_file, excel_dir)}")
-        
-        try:
-            success, message = xml_to_xlsx(xml_file, xlsx_file)
-            if success:
-                print(f"✓ 成功: {message}")
-                success_count += 1
-            else:
-                print(f"✗ 失败: {message}")
-                failed_count += 1
-        except Exception as e:
-            print(f"✗ 错误: {str(e)}")
+                
+            # 检查目标文件是否已存在（并行处理时前一个同名文件可能尚未写完）
+            if os.path.exists(xlsx_file) or (is_dated and xlsx_file in processed_files):
+                if verbose:
+                    print(f"\n[{i}/{total_files}] 处理文件:")
+                    print(f"源文件: {rel_path}")
+                    print(f"目标文件: {os.path.relpath(xlsx_file, excel_dir)}")
+                    print("⚠ 跳过: 目标文件已存在")
+                reporter.skipped(xml_input, xlsx_file, "目标文件已存在")
+                continue
+                
+            # 检查是否是重复文件（仅对非日期格式文件）
+            if not is_dated:
+                if xlsx_file in processed_files:
+                    if verbose:
+                        print(f"\n[{i}/{total_files}] 处理文件:")
+                        print(f"源文件: {rel_path}")
+                        print(f"目标文件: {os.path.relpath(xlsx_file, excel_dir)}")
+                        print("⚠ 跳过: 文件已存在")
+                    reporter.skipped(xml_input, xlsx_file, "文件已存在")
+                    continue
+            
+            # 记录已处理的文件
+            processed_files.add(xlsx_file)
+            file_numbers[xlsx_file] = i
+            
+            # 确保目标文件的目录存在
+            os.makedirs(os.path.dirname(xlsx_file), exist_ok=True)
+            
+            yield xml_input, xlsx_file
+    
+    convert = partial(xml_to_xlsx, backend=args.backend, engine=args.engine, cache=cache,
+                      grouping=args.grouping, model_filter=filter_from_args(args), links=args.links,
+                      counters=args.counters, head=args.head, sample=args.sample, seed=args.seed,
+                      sample_bytes=sample_bytes_from_args(args))
+    results = run_conversions(plan_tasks(), convert, args.jobs, timed=True,
+                              timeout=args.timeout, memory_limit=args.worker_memory)
+    for (xml_input, xlsx_file), success, message, seconds in results:
+        reporter.finished(xml_input, xlsx_file, success, message, seconds)
+        if success:
+            success_count += 1
+        else:
             failed_count += 1
+        if not verbose:
+            continue
+        print(f"\n[{file_numbers[xlsx_file]}/{total_files}] 处理文件:")
+        print(f"源文件: {xml_input.rel_path}")
+        print(f"目标文件: {os.path.relpath(xlsx_file, excel_dir)}")
+        if success:
+            print(f"✓ 成功: {message}")
+        else:
+            print(f"✗ 失败: {message}")
+    reporter.close()
+    if shard.sharded:
+        outputs = list(dict.fromkeys(xlsx_file for _, xlsx_file, _ in xml_files if xlsx_file))
+        write_manifest(manifest_path(excel_dir, shard), shard, 'xml2xlsx', reporter, outputs, excel_dir, started)
     
     # 打印最终统计信息
     print("\n" + "=" * 50)
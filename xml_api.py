@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+供其他程序嵌入使用的转换接口（包括 asyncio 服务）
+
+命令行脚本中的 xml_to_csv / xml_to_xlsx 以路径为参数，把错误转换为
+(False, 信息) 返回。这里的接口直接接受字节内容、文件对象或异步字节
+流，不打印任何内容，失败时抛出 ConversionError 的子类：
+
+    iter_records(source)         同步迭代器，按文档顺序产出每个端口一条的记录
+    aiter_records(source)        异步迭代器，边接收数据边解析，解析在线程中进行
+    convert(source, output)      同步转换为 CSV 或 XLSX，返回结果信息
+    convert_many(jobs)           异步生成器，在有界的进程池中并行转换
+
+记录为 {列名: 值} 的字典，列与 d_xml2csv 的CSV列相同（可用 columns
+选择），没有端口的设备保留一条端口列为空的记录。
+
+    async for record in aiter_records(request.stream(), where=['OperStatus=down']):
+        ...
+
+    async for result in convert_many(jobs, 'xlsx', workers=4):
+        print(result.index, result.output, result.message)
+
+convert_many 同时提交的任务数不超过 max_pending：达到上限时暂停从
+jobs 中取任务（包括读入上传的数据），直到有任务完成，因此 jobs 可以
+是源源不断的异步上传队列，内存中的待处理输入总是有界的。
+"""
+
+import os
+import time
+import asyncio
+import inspect
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from d_xml2csv import COLUMN_SOURCES, DEFAULT_ORDER, FIELDNAMES, SORT_COLUMNS, SORT_RUN_SIZE, models_to_csv, row_builder
+from xlsx_grouping import DEFAULT_GROUPING
+from xml_backends import READ_CHUNK_SIZE, DeviceParser, EntityError, StructureError, get_backend
+from xml_filter import ModelFilter, extraction_fields, parse_where
+from xml_sources import open_input
+from xml2xlsx import write_xlsx
+
+# 支持的输出格式
+FORMATS = ('csv', 'xlsx')
+
+class ConversionError(Exception):
+    """
+    转换失败
+
+    convert_many 抛出或返回的异常还带有 index 和 output 属性，指出失败的任务。
+    """
+
+class XmlSyntaxError(ConversionError):
+    """XML格式错误；position 为 (行, 列)，未知时为 None"""
+
+class EntityRefusedError(XmlSyntaxError):
+    """文档声明了实体，拒绝处理"""
+
+class DeviceStructureError(ConversionError):
+    """XML结构不满足转换要求（找不到设备集合）"""
+
+class NoDevicesError(ConversionError):
+    """没有（满足条件的）设备数据，没有写出输出"""
+
+class WorkerCrashedError(ConversionError):
+    """工作进程异常退出"""
+
+@contextmanager
+def _typed_errors():
+    """把解析错误转换为 ConversionError 的子类"""
+    try:
+        yield
+    except EntityError as e:
+        raise _with_position(EntityRefusedError(str(e)), e) from e
+    except ET.ParseError as e:
+        raise _with_position(XmlSyntaxError(str(e)), e) from e
+    except StructureError as e:
+        raise DeviceStructureError(str(e)) from e
+
+def _with_position(error, cause):
+    error.position = getattr(cause, 'position', None)
+    return error
+
+def _model_filter(where):
+    """
+    Args:
+        where: ModelFilter，或 'OperStatus=down' 形式的条件列表（同时满足）
+    """
+    if where is None or isinstance(where, ModelFilter):
+        return where or None
+    if isinstance(where, str):
+        where = [where]
+    try:
+        return ModelFilter([parse_where(text) for text in where]) or None
+    except Exception as e:
+        raise ValueError(str(e)) from None
+
+def _record_columns(columns):
+    columns = list(columns) if columns else FIELDNAMES
+    unknown = [column for column in columns if column not in COLUMN_SOURCES]
+    if unknown:
+        raise ValueError(f"未知的列: {', '.join(unknown)}，可选: {', '.join(FIELDNAMES)}")
+    return columns
+
+class _Records:
+    """把设备模型转换为字典记录"""
+
+    def __init__(self, columns, where):
+        self.columns = _record_columns(columns)
+        self.model_filter = _model_filter(where)
+        self.fields = extraction_fields((COLUMN_SOURCES[column][1] for column in self.columns), self.model_filter)
+        self._build = row_builder(self.columns)
+
+    def __call__(self, models):
+        if self.model_filter:
+            models = self.model_filter.apply(models)
+        columns = self.columns
+        return [dict(zip(columns, row)) for model in models for row in self._build(model)]
+
+def iter_records(source, columns=None, where=None):
+    """
+    解析XML并按文档顺序产出记录（expat 流式解析，内存占用只与单个设备有关）
+
+    Args:
+        source: 文件路径（可为压缩文件）、XmlInput、二进制文件对象或字节内容
+        columns: 记录的列，默认 d_xml2csv.FIELDNAMES
+        where: 过滤条件，ModelFilter 或条件字符串列表
+    Yields:
+        {列名: 值}
+    Raises:
+        ConversionError: XML格式或结构错误
+    """
+    records = _Records(columns, where)
+    with _typed_errors():
+        for model in get_backend('expat').iter_devices(source, records.fields):
+            yield from records([model])
+
+async def _achunks(source, chunk_size):
+    """把各种输入源统一为异步的数据块序列；同步读取在线程中进行"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+        return
+    if hasattr(source, '__aiter__'):
+        async for chunk in source:
+            if chunk:
+                yield bytes(chunk)
+        return
+
+    loop = asyncio.get_running_loop()
+    if hasattr(source, 'read'):
+        f, owned = source, False
+    else:
+        f, owned = await loop.run_in_executor(None, open_input, source), True
+    try:
+        asynchronous = inspect.iscoroutinefunction(f.read)
+        while True:
+            if asynchronous:
+                chunk = await f.read(chunk_size)
+            else:
+                chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                return
+            yield bytes(chunk)
+    finally:
+        if owned:
+            f.close()
+
+async def aiter_records(source, columns=None, where=None, chunk_size=READ_CHUNK_SIZE):
+    """
+    边接收数据边解析，按文档顺序产出记录
+
+    每块数据的解析和记录生成在默认线程池中进行，不阻塞事件循环；
+    同一输入的数据块按顺序依次解析。
+
+    Args:
+        source: 异步字节流（有 async read(n) 方法，如 asyncio.StreamReader，或异步迭代产出
+                字节块，如 aiohttp 的 request.content.iter_chunked(n)）、字节内容、二进制文件
+                对象或文件路径
+        columns: 记录的列，默认 d_xml2csv.FIELDNAMES
+        where: 过滤条件，ModelFilter 或条件字符串列表
+        chunk_size: 从输入中每次读取的大小
+    Yields:
+        {列名: 值}
+    Raises:
+        ConversionError: XML格式或结构错误
+    """
+    records = _Records(columns, where)
+    parser = DeviceParser(records.fields)
+    loop = asyncio.get_running_loop()
+
+    def parse(chunk):
+        return records(parser.feed(chunk) if chunk is not None else parser.close())
+
+    chunks = _achunks(source, chunk_size)
+    try:
+        with _typed_errors():
+            async for chunk in chunks:
+                for record in await loop.run_in_executor(None, parse, chunk):
+                    yield record
+            for record in await loop.run_in_executor(None, parse, None):
+                yield record
+    finally:
+        await chunks.aclose()
+
+def convert(source, output, format='csv', columns=None, where=None, order=DEFAULT_ORDER, compression=None,
+            grouping=DEFAULT_GROUPING, engine='auto'):
+    """
+    转换为 CSV 或 XLSX
+
+    CSV 与 d_xml2csv 的流式引擎相同（内存占用有界，排序时使用临时文件）；
+    XLSX 与 xml2xlsx 相同。
+
+    Args:
+        source: 文件路径（可为压缩文件）、XmlInput、二进制文件对象或字节内容
+        output: 输出文件路径或二进制文件对象
+        format: 'csv' 或 'xlsx'
+        columns: CSV的列，默认 d_xml2csv.FIELDNAMES（只用于 csv）
+        where: 过滤条件，ModelFilter 或条件字符串列表
+        order: CSV的输出顺序，见 d_xml2csv.ORDERS
+        compression: CSV的压缩格式
+        grouping: XLSX中同一设备多行的分组方式
+        engine: XLSX的转换引擎，见 xml2xlsx.xml_to_xlsx
+    Returns:
+        str: 结果信息
+    Raises:
+        ConversionError: 输入无法转换；其他异常（如 OSError）原样抛出
+        ValueError: 参数无效
+    """
+    model_filter = _model_filter(where)
+    if format == 'csv':
+        columns = _record_columns(columns)
+        needed = columns + (SORT_COLUMNS if order != 'document' else [])
+        fields = extraction_fields((COLUMN_SOURCES[column][1] for column in needed), model_filter)
+        with _typed_errors():
+            models = get_backend('expat').iter_devices(source, fields)
+            success, message = models_to_csv(models, output, 'stream', compression, None, False, order,
+                                             SORT_RUN_SIZE, columns, model_filter)
+        if not success:
+            raise NoDevicesError(message)
+        return message
+    if format == 'xlsx':
+        if columns:
+            raise ValueError("XLSX 输出不支持选择列")
+        if hasattr(source, 'read'):
+            source = source.read()
+        with _typed_errors():
+            described = write_xlsx(source, output, engine=engine, grouping=grouping,
+                                   model_filter=model_filter)
+        return f"处理成功（{described}）"
+    raise ValueError(f"未知的输出格式: {format}，可选: {', '.join(FORMATS)}")
+
+class ConversionResult:
+    """
+    convert_many 中一个任务的结果
+
+    Attributes:
+        index: 任务在 jobs 中的序号（从 0 开始）
+        output: 输出路径
+        message: 成功时的结果信息
+        seconds: 转换用时（秒，在工作进程中测量）
+        error: return_exceptions 为真时失败任务的异常（ConversionError），成功时为 None
+    """
+
+    def __init__(self, index, output, message=None, seconds=None, error=None):
+        self.index = index
+        self.output = output
+        self.message = message
+        self.seconds = seconds
+        self.error = error
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"ConversionResult({self.index}, {self.output!r}, error={self.error!r})"
+        return f"ConversionResult({self.index}, {self.output!r}, {self.message!r})"
+
+def _run_job(format, source, output, options):
+    """在工作进程中执行一个转换，返回 (信息, 用时)"""
+    started = time.perf_counter()
+    try:
+        message = convert(source, output, format, **options)
+    except ConversionError:
+        raise
+    except Exception as e:
+        # 工作进程中的其他异常同样以 ConversionError 传回
+        raise ConversionError(f"{type(e).__name__}: {str(e)}") from None
+    return message, time.perf_counter() - started
+
+async def _ajobs(jobs):
+    if hasattr(jobs, '__aiter__'):
+        async for job in jobs:
+            yield job
+    else:
+        for job in jobs:
+            yield job
+
+async def _materialize(source, chunk_size=READ_CHUNK_SIZE):
+    """把不能传给工作进程的输入（文件对象、异步字节流）读为字节内容"""
+    if isinstance(source, (bytes, str, os.PathLike)):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read') or hasattr(source, '__aiter__'):
+        return b''.join([chunk async for chunk in _achunks(source, chunk_size)])
+    # XmlInput 等可以直接传给工作进程
+    return source
+
+def _job_result(future, index, output, return_exceptions):
+    try:
+        message, seconds = future.result()
+        return ConversionResult(index, output, message, seconds)
+    except BrokenProcessPool as e:
+        error = WorkerCrashedError(f"工作进程异常退出: {str(e)}")
+    except ConversionError as e:
+        error = e
+    error.index = index
+    error.output = output
+    if not return_exceptions:
+        raise error
+    return ConversionResult(index, output, error=error)
+
+async def convert_many(jobs, format='csv', workers=None, max_pending=None, executor=None, return_exceptions=False,
+                       **options):
+    """
+    在有界的进程池中并行转换，按完成顺序产出结果
+
+    Args:
+        jobs: (输入, 输出路径) 的可迭代对象或异步可迭代对象，按需逐个取出；输入为文件路径、
+              XmlInput、字节内容、二进制文件对象或异步字节流（后两者在提交前读为字节内容）
+        format: 'csv' 或 'xlsx'
+        workers: 创建的进程池大小，默认 CPU 数
+        max_pending: 已提交但未完成的任务数上限，默认为进程数的两倍；达到上限时暂停从 jobs 中取任务
+        executor: 已有的 concurrent.futures 执行器（如服务中长期使用的进程池），给出时不创建也不关闭
+        return_exceptions: 为真时失败的任务以 ConversionResult.error 产出；否则抛出第一个失败任务
+                           的异常，并取消尚未开始的任务
+        options: 传给 convert 的其他参数（columns、where、order 等）
+    Yields:
+        ConversionResult
+    Raises:
+        ConversionError: 任务失败（return_exceptions 为假时）
+    """
+    if format not in FORMATS:
+        raise ValueError(f"未知的输出格式: {format}，可选: {', '.join(FORMATS)}")
+    if workers is not None and workers < 1:
+        raise ValueError(f"进程数应为正整数: {workers}")
+    loop = asyncio.get_running_loop()
+    owned = executor is None
+    if owned:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    limit = max_pending or 2 * (workers or os.cpu_count() or 1)
+    pending = {}
+
+    async def completed():
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        # 按任务序号产出同时完成的结果
+        for future in sorted(done, key=lambda future: pending[future][0]):
+            index, output = pending.pop(future)
+            yield _job_result(future, index, output, return_exceptions)
+
+    try:
+        index = 0
+        async for source, output in _ajobs(jobs):
+            if not isinstance(output, (str, os.PathLike)):
+                raise ValueError(f"第 {index} 个任务的输出应为文件路径")
+            while len(pending) >= limit:
+                async for result in completed():
+                    yield result
+            source = await _materialize(source)
+            future = loop.run_in_executor(executor, _run_job, format, source, output, options)
+            pending[future] = (index, output)
+            index += 1
+        while pending:
+            async for result in completed():
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            # 不在事件循环中等待工作进程退出
+            executor.shutdown(wait=False, cancel_futures=True)
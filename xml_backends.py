@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+可替换的XML解析后端
+
+所有后端都把 DeviceCollection 下的每个 Device 转换成同样结构的设备模型：
+
+    {
+        'device': {字段名: 文本},          # Device 的直接叶子子元素
+        'im_record': {字段名: 文本},       # Device/ImRecord 的叶子子元素
+        'modules': [{字段名: 文本}, ...],  # Device/Modules/Module
+        'descendant_modules': [{字段名: 文本}, ...],  # Device 下任意深度的 Module
+        'interfaces': [[端口, ...], ...],  # 每个 PnInterface/PortList 下的 Port 字段
+        'direct_interfaces': [bool, ...],  # 对应的 PnInterface 是否为 Device/Interfaces/PnInterface
+        'descendants': {字段名: 文本},     # DESCENDANT_FIELDS 中各字段第一个后代元素的文本
+    }
+
+同名子元素只取第一个，空元素的文本为 ''。没有 PortList 的 PnInterface
+在 interfaces 中为 None，以便与没有端口的 PortList 区分。interfaces 包含
+Device 下任意深度的 PnInterface（与 device.findall('.//PnInterface') 相同），
+direct_interfaces 标出其中位于第一个 Interfaces 子元素下的直接子元素，
+即 d_xml2csv 读取的 device.find('Interfaces').findall('PnInterface')。
+descendant_modules 与 xml2csv2 的 device.findall('.//Module') 相同，按文档
+顺序包含 modules 中的字典（同一个对象）和其他位置的 Module。descendants
+与 device.find('.//字段名').text 相同：按文档顺序取 Device 下任意深度的
+第一个同名元素，文本为其第一个子元素之前的部分。
+
+all_devices=True 时改为处理文档中（根元素以外）所有的 Device，与
+root.findall('.//Device') 相同，不要求存在 DeviceCollection。嵌套在
+另一个 Device 中的 Device 也单独产出，排在外层设备之后；其中的端口、
+模块和 descendants 字段同时属于外层设备。
+
+    etree  基于 xml.etree.ElementTree 构建完整的树，作为参考实现
+    expat  直接基于 pyexpat 的状态机，边解析边产出设备模型，不构建树
+
+声明了实体（DOCTYPE 中的 <!ENTITY>）的文档一律拒绝处理，以防实体
+扩展攻击；设备数据不会用到实体。
+
+iter_devices 可以用 fields 指定只提取的叶子字段名（对设备、ImRecord、
+模块和端口同样适用），模型结构不变，只是字典中缺少未选择的字段。
+"""
+
+import io
+import sys
+import copy
+import pyexpat
+import xml.etree.ElementTree as ET
+
+from xml_sources import open_input
+
+# 每次送入 expat 的数据块大小
+READ_CHUNK_SIZE = 1 << 20
+
+# 设备模型的结构版本，模型结构或提取规则变化时递增，使缓存的旧模型失效
+MODEL_VERSION = 5
+
+# 按 './/字段名' 查找的字段（xml2csv2 的订单号、固件版本和硬件版本）
+DESCENDANT_FIELDS = ('OrderID', 'SoftwareRevision', 'HardwareRevision')
+
+# 检查文档序言时每次读取的大小
+PROLOG_CHUNK_SIZE = 64 << 10
+
+class StructureError(Exception):
+    """XML结构不满足转换要求"""
+
+class EntityError(ET.ParseError):
+    """文档声明了实体，拒绝处理"""
+
+class _RootReached(Exception):
+    """序言检查已到达根元素"""
+
+def refuse_entities(parser):
+    """让 pyexpat 解析器遇到实体声明时抛出 EntityError，与 ParseError 一样带有声明所在的位置"""
+    def refuse(name, is_parameter_entity, *args):
+        kind = '参数实体' if is_parameter_entity else '实体'
+        line, column = parser.CurrentLineNumber, parser.CurrentColumnNumber
+        error = EntityError(f"拒绝处理声明了{kind}的文档: {name}: line {line}, column {column}")
+        error.position = (line, column)
+        raise error
+
+    parser.EntityDeclHandler = refuse
+    parser.SetParamEntityParsing(pyexpat.XML_PARAM_ENTITY_PARSING_NEVER)
+
+def _prolog_parser():
+    def start(name, attrs):
+        raise _RootReached
+    parser = pyexpat.ParserCreate()
+    parser.StartElementHandler = start
+    refuse_entities(parser)
+    return parser
+
+def _check_prolog_chunk(parser, data, final):
+    """送入一块数据，返回序言检查是否已经结束"""
+    try:
+        parser.Parse(data, final)
+    except _RootReached:
+        return True
+    except pyexpat.ExpatError:
+        # 格式错误留给实际的解析报告
+        return True
+    return final
+
+def check_entities(data):
+    """
+    检查文档在根元素之前是否声明了实体
+
+    ElementTree 不提供底层 expat 解析器，无法在解析时拒绝实体，因此先用
+    expat 单独检查序言，到达根元素即停止，不解析文档内容。
+
+    Args:
+        data: XML文档的 bytes 或 str
+    Raises:
+        EntityError: 声明了实体
+    """
+    parser = _prolog_parser()
+    for start in range(0, len(data), PROLOG_CHUNK_SIZE):
+        if _check_prolog_chunk(parser, data[start:start + PROLOG_CHUNK_SIZE], False):
+            return
+    _check_prolog_chunk(parser, data[:0], True)
+
+class EntityGuard(io.BufferedIOBase):
+    """读取前先检查文档序言中没有实体声明的二进制流，读取的内容不变"""
+
+    def __init__(self, f):
+        """
+        Args:
+            f: 二进制文件对象，关闭时一并关闭
+        Raises:
+            EntityError: 声明了实体
+        """
+        self._f = f
+        parser = _prolog_parser()
+        head = []
+        while True:
+            chunk = f.read(PROLOG_CHUNK_SIZE)
+            head.append(chunk)
+            if _check_prolog_chunk(parser, chunk, not chunk):
+                break
+        self._head = b''.join(head)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._f.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._f.read(), b''
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+def new_device_model():
+    """创建一个空的设备模型"""
+    return {'device': {}, 'im_record': {}, 'modules': [], 'descendant_modules': [], 'interfaces': [],
+            'direct_interfaces': [], 'descendants': {}}
+
+def iter_ports(model, direct_only=False):
+    """
+    按文档顺序遍历设备模型中接口的端口
+
+    Args:
+        model: 设备模型
+        direct_only: 只遍历 Device/Interfaces/PnInterface 的端口（CSV 的取法）
+    """
+    for ports, direct in zip(model['interfaces'], model['direct_interfaces']):
+        if ports and (direct or not direct_only):
+            yield from ports
+
+def _leaf_texts(element, wanted=None):
+    """收集元素的直接叶子子元素文本，同名元素只保留第一个；wanted 为要保留的字段名集合"""
+    fields = {}
+    for child in element:
+        if len(child) == 0 and child.tag not in fields and (wanted is None or child.tag in wanted):
+            fields[child.tag] = child.text or ''
+    return fields
+
+def device_model_from_element(device, fields=None):
+    """
+    将 Device 元素转换为设备模型
+
+    Args:
+        device: Device 元素
+        fields: 只提取的叶子字段名集合，None 表示全部
+    """
+    model = new_device_model()
+    model['device'] = _leaf_texts(device, fields)
+
+    im_record = device.find('ImRecord')
+    if im_record is not None:
+        model['im_record'] = _leaf_texts(im_record, fields)
+
+    listed = {}
+    modules = device.find('Modules')
+    if modules is not None:
+        listed = {module: _leaf_texts(module, fields) for module in modules.findall('Module')}
+        model['modules'] = list(listed.values())
+    model['descendant_modules'] = [listed[module] if module in listed else _leaf_texts(module, fields)
+                                   for module in device.iter('Module')]
+
+    interfaces = device.find('Interfaces')
+    direct = set(interfaces.findall('PnInterface')) if interfaces is not None else set()
+    for interface in device.iter('PnInterface'):
+        port_list = interface.find('PortList')
+        ports = None
+        if port_list is not None:
+            ports = [_leaf_texts(port, fields) for port in port_list.findall('Port')]
+        model['interfaces'].append(ports)
+        model['direct_interfaces'].append(interface in direct)
+
+    for field in DESCENDANT_FIELDS:
+        if fields is None or field in fields:
+            element = device.find('.//' + field)
+            if element is not None:
+                model['descendants'][field] = element.text or ''
+
+    return model
+
+def _open_source(source):
+    """
+    将数据源统一为二进制文件对象
+
+    Returns:
+        (file, bool): (文件对象, 是否需要由调用方关闭)
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), True
+    if hasattr(source, 'read'):
+        return source, False
+    return open_input(source), True
+
+class ElementTreeBackend:
+    """基于 ElementTree 的参考后端"""
+
+    name = 'etree'
+
+    def iter_devices(self, source, fields=None, all_devices=False):
+        """
+        解析XML并按文档顺序产出设备模型
+
+        Args:
+            source: 文件路径、XmlInput、二进制文件对象或字节内容
+            fields: 只提取的叶子字段名集合，None 表示全部
+            all_devices: 处理所有 .//Device，而不只是 DeviceCollection 下的 Device
+        """
+        f, should_close = _open_source(source)
+        try:
+            root = ET.parse(EntityGuard(f)).getroot()
+        finally:
+            if should_close:
+                f.close()
+
+        if all_devices:
+            for device in root.findall('.//Device'):
+                yield device_model_from_element(device, fields)
+            return
+
+        devices = root.find('DeviceCollection')
+        if devices is None:
+            raise StructureError("找不到设备集合")
+
+        for device in devices.findall('Device'):
+            yield device_model_from_element(device, fields)
+
+# expat 状态机中元素的上下文类型
+_COLLECTION = 'collection'
+_DEVICE = 'device'
+_MODULES = 'modules'
+_INTERFACES = 'interfaces'
+_INTERFACE = 'interface'
+_PORTLIST = 'portlist'
+
+class DeviceParser:
+    """
+    基于 pyexpat 的增量解析器
+
+    只跟踪 Device / ImRecord / Modules / Module / Interfaces / PnInterface / PortList / Port
+    的上下文，设备结束时立即完成模型，内存占用只与单个设备的大小有关。
+    数据由调用方逐块送入，适合数据块异步到达的场合：
+
+        parser = DeviceParser(fields)
+        for chunk in chunks:
+            models.extend(parser.feed(chunk))
+        models.extend(parser.close())
+    """
+
+    def __init__(self, fields=None, all_devices=False):
+        """
+        Args:
+            fields: 只提取的叶子字段名集合，None 表示全部
+            all_devices: 处理所有 Device（包括嵌套在其他 Device 中的），不要求存在 DeviceCollection
+        """
+        self.all_devices = all_devices
+        self.collection_seen = False
+        descendant_fields = {field for field in DESCENDANT_FIELDS if fields is None or field in fields}
+        finished = self._finished = []
+        # 每个打开元素对应一项：叶子子元素文本写入的字典，以及 (上下文类型, 附带数据)
+        targets = []
+        contexts = []
+        # 当前元素开始以来收到的文本，由 expat 直接追加
+        text = []
+        model = None
+        im_taken = modules_taken = interfaces_taken = False
+        # 嵌套的 Device（只在 all_devices 时出现）：外层设备的 (模型, 三个标志)，
+        # 以及按开始顺序排列的内层模型，最外层设备结束后依次产出
+        outer = []
+        nested = []
+        is_leaf = False
+        # 等待文本的 descendants 字段及其所属的模型：文本到第一个子元素或元素结束为止
+        pending = None
+
+        def flush_pending():
+            value = ''.join(text)
+            for owner in pending[1]:
+                owner['descendants'][pending[0]] = value
+
+        def start(tag, attrs):
+            nonlocal model, im_taken, modules_taken, interfaces_taken, is_leaf, pending
+            if pending is not None:
+                flush_pending()
+                pending = None
+            del text[:]
+            is_leaf = True
+            target = context = None
+
+            if model is not None:
+                parent = contexts[-1]
+                if tag == 'Device' and all_devices:
+                    # 外层设备的任意深度字段（接口、模块、descendants）同样包括内层设备的内容
+                    outer.append((model, im_taken, modules_taken, interfaces_taken))
+                    model = new_device_model()
+                    nested.append(model)
+                    im_taken = modules_taken = interfaces_taken = False
+                    target = model['device']
+                    context = (_DEVICE, None)
+                    targets.append(target)
+                    contexts.append(context)
+                    return
+                if parent is not None:
+                    kind = parent[0]
+                    if kind is _DEVICE:
+                        if tag == 'ImRecord' and not im_taken:
+                            im_taken = True
+                            target = model['im_record']
+                        elif tag == 'Modules' and not modules_taken:
+                            modules_taken = True
+                            context = (_MODULES, None)
+                        elif tag == 'Interfaces' and not interfaces_taken:
+                            interfaces_taken = True
+                            context = (_INTERFACES, None)
+                    elif kind is _MODULES:
+                        if tag == 'Module':
+                            target = {}
+                            model['modules'].append(target)
+                    elif kind is _PORTLIST:
+                        if tag == 'Port':
+                            target = {}
+                            parent[1].append(target)
+                    elif kind is _INTERFACE:
+                        if tag == 'PortList' and not parent[1][1]:
+                            parent[1][1] = True
+                            ports = []
+                            for owner, index in parent[1][0]:
+                                owner['interfaces'][index] = ports
+                            context = (_PORTLIST, ports)
+                if tag == 'Module':
+                    if target is None:
+                        target = {}
+                    model['descendant_modules'].append(target)
+                    for owner in outer:
+                        owner[0]['descendant_modules'].append(target)
+                elif tag == 'PnInterface':
+                    # 遇到 PortList 之前占位为 None；(模型, 序号) 列出接口所属的每个模型
+                    slots = [(model, len(model['interfaces']))]
+                    model['interfaces'].append(None)
+                    model['direct_interfaces'].append(parent is not None and parent[0] is _INTERFACES)
+                    for owner in outer:
+                        slots.append((owner[0], len(owner[0]['interfaces'])))
+                        owner[0]['interfaces'].append(None)
+                        owner[0]['direct_interfaces'].append(False)
+                    context = (_INTERFACE, [slots, False])
+                elif tag in descendant_fields and tag not in model['descendants']:
+                    pending = (tag, [model] + [owner[0] for owner in outer if tag not in owner[0]['descendants']])
+            elif contexts:
+                parent = contexts[-1]
+                if tag == 'Device' and (all_devices or parent is not None and parent[0] is _COLLECTION):
+                    model = new_device_model()
+                    im_taken = modules_taken = interfaces_taken = False
+                    target = model['device']
+                    context = (_DEVICE, None)
+                elif tag == 'DeviceCollection' and len(contexts) == 1 and not self.collection_seen:
+                    self.collection_seen = True
+                    context = (_COLLECTION, None)
+
+            targets.append(target)
+            contexts.append(context)
+
+        def end(tag):
+            nonlocal model, im_taken, modules_taken, interfaces_taken, is_leaf, pending
+            if pending is not None:
+                flush_pending()
+                pending = None
+            targets.pop()
+            context = contexts.pop()
+            if context is not None and context[0] is _DEVICE:
+                if outer:
+                    model, im_taken, modules_taken, interfaces_taken = outer.pop()
+                else:
+                    # 与 findall('.//Device') 的顺序相同：外层设备在前；内层设备与外层
+                    # 共用的端口和模块字典在这里复制，使各模型互相独立
+                    finished.append(model)
+                    if nested:
+                        finished.extend(copy.deepcopy(nested_model) for nested_model in nested)
+                        del nested[:]
+                    model = None
+            if is_leaf and targets:
+                # 空的嵌套 Device 也是外层元素的叶子子元素
+                target = targets[-1]
+                if target is not None and tag not in target and (fields is None or tag in fields):
+                    target[tag] = ''.join(text)
+            is_leaf = False
+
+        parser = self._parser = pyexpat.ParserCreate()
+        refuse_entities(parser)
+        parser.buffer_text = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text.append
+
+    def feed(self, data, final=False):
+        """
+        送入一块数据
+
+        Args:
+            data: 字节数据
+            final: 是否为最后一块（之后不能再送入）
+        Returns:
+            这块数据中完成的设备模型列表，按文档顺序
+        Raises:
+            ET.ParseError: XML格式错误
+        """
+        try:
+            self._parser.Parse(data, final)
+        except pyexpat.ExpatError as e:
+            # 与 ElementTree 抛出的 ParseError 一样附带错误代码和位置
+            error = ET.ParseError(str(e))
+            error.code, error.position = e.code, (e.lineno, e.offset)
+            raise error from None
+        finished = self._finished[:]
+        del self._finished[:]
+        return finished
+
+    def close(self):
+        """
+        结束解析并检查结构
+
+        Returns:
+            剩余的设备模型列表
+        Raises:
+            ET.ParseError: 文档不完整
+            StructureError: 找不到设备集合（all_devices 时不检查）
+        """
+        finished = self.feed(b'', True)
+        if not self.collection_seen and not self.all_devices:
+            raise StructureError("找不到设备集合")
+        return finished
+
+class ExpatBackend:
+    """
+    基于 pyexpat 的流式后端（见 DeviceParser），设备结束时立即产出模型
+    """
+
+    name = 'expat'
+
+    def iter_devices(self, source, fields=None, all_devices=False):
+        """
+        解析XML并按文档顺序产出设备模型
+
+        Args:
+            source: 文件路径、XmlInput、二进制文件对象或字节内容
+            fields: 只提取的叶子字段名集合，None 表示全部
+            all_devices: 处理所有 .//Device，而不只是 DeviceCollection 下的 Device（见模块说明）
+        """
+        parser = DeviceParser(fields, all_devices)
+        f, should_close = _open_source(source)
+        try:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield from parser.feed(chunk)
+        finally:
+            if should_close:
+                f.close()
+        yield from parser.close()
+
+# 可用的解析后端
+BACKENDS = {
+    ElementTreeBackend.name: ElementTreeBackend,
+    ExpatBackend.name: ExpatBackend,
+}
+
+DEFAULT_BACKEND = ElementTreeBackend.name
+
+def get_backend(name=None):
+    """按名称获取解析后端实例"""
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"未知的解析后端: {name}，可选: {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+def compare_backends(source, names=None):
+    """
+    用多个后端解析同一份XML，检查产出的设备模型是否完全一致
+
+    Args:
+        source: 文件路径
+        names: 要比较的后端名称，默认全部
+    Returns:
+        (bool, str): (是否一致, 说明)
+    """
+    names = names or list(BACKENDS)
+    reference_name = names[0]
+    reference = list(get_backend(reference_name).iter_devices(source))
+
+    for name in names[1:]:
+        models = list(get_backend(name).iter_devices(source))
+        if len(models) != len(reference):
+            return False, f"{name} 产出 {len(models)} 个设备，{reference_name} 产出 {len(reference)} 个"
+        for index, (a, b) in enumerate(zip(reference, models), 1):
+            if a != b:
+                return False, f"第 {index} 个设备不一致: {reference_name}={a!r} {name}={b!r}"
+
+    return True, f"{len(reference)} 个设备在 {', '.join(names)} 之间完全一致"
+
+def main():
+    if len(sys.argv) != 2:
+        print("用法: python xml_backends.py <XML文件>")
+        print("用所有解析后端解析同一文件并检查结果是否一致")
+        sys.exit(1)
+
+    try:
+        same, message = compare_backends(sys.argv[1])
+    except Exception as e:
+        print(f"错误: {str(e)}")
+        sys.exit(1)
+
+    if same:
+        print(f"成功: {message}")
+    else:
+        print(f"错误: {message}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
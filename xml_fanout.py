@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+一次解析，同时生成多种输出
+
+每个XML输入只读取、解码、清理和解析一遍，产出的设备模型依次交给所有
+选中的输出格式（xlsx 除外，见下）：
+
+    flat     每个端口一行的CSV（同 d_xml2csv / xml2csv）
+    grouped  按设备分组的CSV（同 xml2csv2）
+    xlsx     合并了设备单元格的工作簿（同 xml2xlsx）
+    sheets   规范化的工作簿，设备、模块、端口各一个工作表，以设备序号关联
+
+flat、grouped 和 sheets 共用 xml2csv 的清理方式（移除全部数字字符引用），
+只处理 DeviceCollection 下的 Device。xlsx 与 xml2xlsx 的默认（stream）引擎
+完全相同：按 xml2xlsx 的编码和清理方式解码，处理所有 .//Device，解析失败
+时同样改用更激进的清理；与其他格式同时选择时，xlsx 单独再解析一遍。
+"""
+
+import os
+import sys
+import csv
+import argparse
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from functools import partial
+
+from openpyxl import Workbook
+
+import d_xml2csv
+import xml2csv2
+import xml2xlsx
+from batch_runner import add_isolation_arguments, run_conversions
+from run_report import RunReporter, add_report_arguments, reporter_from_args
+from sharding import Shard, add_shard_arguments, manifest_path, shard_from_args, shard_key, write_manifest
+from csv_output import COMPRESSIONS, open_csv_output, output_suffix
+from memory_budget import PeakMemory, parse_size
+from model_cache import DEFAULT_CACHE_SIZE, PROFILE_STRIPPED_STREAM, PROFILE_XLSX_STREAM, ModelCache, cached_models
+from xml2csv import remove_char_references
+from xml_backends import BACKENDS, DEFAULT_BACKEND, get_backend
+from xml_sources import open_cleaned, scan_inputs, group_by_directory
+
+class FlatCsvOutput:
+    """每个端口一行的CSV"""
+
+    name = 'flat'
+    suffix = '.csv'
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, model):
+        self.rows.extend(d_xml2csv.device_rows(model))
+
+    def save(self, path, compression=None, compresslevel=None):
+        self.rows.sort(key=d_xml2csv.ROW_SORT_KEY)
+        with open_csv_output(path, compression, compresslevel) as f:
+            d_xml2csv.write_csv_rows(self.rows, f)
+        return f"{len(self.rows)} 条记录"
+
+class GroupedCsvOutput:
+    """按设备分组的CSV"""
+
+    name = 'grouped'
+    suffix = '.csv'
+
+    def __init__(self):
+        self.rows = []
+        self.device_number = 0
+        self.processed_devices = {}
+
+    def add(self, model):
+        self.device_number += 1
+        for row in xml2csv2.device_group_rows(model, self.device_number, self.processed_devices):
+            # 重复的列名取同一个值，按表头顺序存为元组
+            self.rows.append(tuple(row[header] for header in xml2csv2.HEADERS))
+
+    def save(self, path, compression=None, compresslevel=None):
+        with open_csv_output(path, compression, compresslevel) as f:
+            writer = csv.writer(f)
+            writer.writerow(xml2csv2.HEADERS)
+            writer.writerows(self.rows)
+        return f"{len(self.rows)} 条记录"
+
+class MergedXlsxOutput:
+    """合并了设备单元格的工作簿（模型由 xlsx_output 按 xml2xlsx 的方式单独提取）"""
+
+    name = 'xlsx'
+    suffix = '.xlsx'
+
+    def __init__(self):
+        self.devices = []
+        self.ports_by_name = {}
+
+    def add(self, model):
+        device_row, name, port_rows = xml2xlsx.device_sheet_rows(model)
+        self.devices.append(device_row)
+        if port_rows:
+            self.ports_by_name.setdefault(name, []).extend(port_rows)
+
+    def save(self, path, compression=None, compresslevel=None):
+        xml2xlsx.write_workbook_streaming(self.devices, self.ports_by_name, path)
+        return f"{len(self.devices)} 个设备"
+
+# 规范化工作簿中模块的字段
+MODULE_FIELDS = ['ModuleIdentNumber', 'ModuleName', 'OrderNumber', 'OrderID', 'SerialNumber',
+                 'SoftwareRevision', 'HardwareRevision']
+
+class NormalizedSheetsOutput:
+    """
+    规范化的工作簿
+
+    Devices、Modules、Ports 三个工作表以 DeviceIndex（设备在文档中的序号）
+    关联，行在解析过程中直接写入只写模式的工作表。
+    """
+
+    name = 'sheets'
+    suffix = '.xlsx'
+
+    def __init__(self):
+        self.wb = Workbook(write_only=True)
+        self.devices = self.wb.create_sheet('Devices')
+        self.modules = self.wb.create_sheet('Modules')
+        self.ports = self.wb.create_sheet('Ports')
+        self.devices.append(['DeviceIndex'] + xml2xlsx.DEVICE_HEADERS)
+        self.modules.append(['DeviceIndex', 'NameOfStation', 'ModuleIndex'] + MODULE_FIELDS)
+        self.ports.append(['DeviceIndex', 'NameOfStation', 'InterfaceIndex'] + xml2xlsx.PORT_FIELDS)
+        self.device_count = 0
+
+    def add(self, model):
+        self.device_count += 1
+        index = self.device_count
+        device, im_record = model['device'], model['im_record']
+        name = device.get('NameOfStation', '')
+
+        self.devices.append([index] + [device.get(field, '') for field in xml2xlsx.DEVICE_FIELDS] +
+                            [im_record.get(field, '') for field in xml2xlsx.IM_RECORD_FIELDS])
+        for module_index, module in enumerate(model['modules'], 1):
+            self.modules.append([index, name, module_index] +
+                                [module.get(field, '') for field in MODULE_FIELDS])
+        for interface_index, ports in enumerate(model['interfaces'], 1):
+            for port in ports or ():
+                self.ports.append([index, name, interface_index] +
+                                  [port.get(field, '') for field in xml2xlsx.PORT_FIELDS])
+
+    def save(self, path, compression=None, compresslevel=None):
+        self.wb.save(path)
+        return f"{self.device_count} 个设备"
+
+# 可用的输出格式
+OUTPUT_FORMATS = {
+    output.name: output
+    for output in (FlatCsvOutput, GroupedCsvOutput, MergedXlsxOutput, NormalizedSheetsOutput)
+}
+
+def extract_models(xml_path, backend=None):
+    """按 xml2csv 的方式流式清理并解析XML输入，逐个产出设备模型"""
+    with open_cleaned(xml_path, remove_char_references, ('utf-8', 'latin1')) as f:
+        yield from get_backend(backend).iter_devices(f)
+
+def xlsx_output(xml_path, cache=None):
+    """
+    按 xml2xlsx 流式引擎的方式解析XML输入，生成 xlsx 格式的输出
+
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+        cache: ModelCache，与 xml2xlsx 的 stream 引擎共用缓存
+    Returns:
+        (MergedXlsxOutput, bool): (填好设备的输出, 模型是否来自缓存)
+    """
+    for strip_references in (False, True):
+        output = MergedXlsxOutput()
+        try:
+            models, cached = cached_models(cache, xml_path, PROFILE_XLSX_STREAM,
+                                           partial(xml2xlsx.stream_device_models, xml_path, strip_references))
+            for model in models:
+                output.add(model)
+            return output, cached
+        except ET.ParseError:
+            # 与 xml2xlsx 相同，解析失败时尝试更激进的清理
+            if strip_references:
+                raise
+
+def convert_all(xml_path, output_paths, backend=None, compression=None, compresslevel=None, cache=None):
+    """
+    解析一次XML输入，写出所有指定格式的结果
+
+    Args:
+        xml_path: XML文件路径、XmlInput 或已读取的字节内容
+        output_paths: {格式名称: 输出路径}
+        backend: 解析后端名称，默认 etree（xlsx 与 xml2xlsx 的 stream 引擎一样总是使用 expat）
+        compression: CSV输出的压缩格式
+        compresslevel: 压缩级别
+        cache: ModelCache，与 xml2csv（xlsx 为 xml2xlsx）的 stream 引擎共用同一种提取方式的缓存
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    with PeakMemory() as memory:
+        try:
+            outputs = {name: OUTPUT_FORMATS[name]() for name in output_paths if name != MergedXlsxOutput.name}
+            device_count = 0
+            cached = True
+            if outputs:
+                models, cached = cached_models(cache, xml_path, PROFILE_STRIPPED_STREAM,
+                                               partial(extract_models, xml_path, backend))
+                for model in models:
+                    device_count += 1
+                    for output in outputs.values():
+                        output.add(model)
+            if MergedXlsxOutput.name in output_paths:
+                output, xlsx_cached = xlsx_output(xml_path, cache)
+                outputs[MergedXlsxOutput.name] = output
+                cached = cached and xlsx_cached
+                if len(outputs) == 1:
+                    device_count = len(output.devices)
+
+            if device_count == 0:
+                return False, "DeviceCollection 中没有设备数据"
+
+            results = []
+            for name in output_paths:
+                output = outputs[name]
+                # 压缩只作用于CSV输出
+                level = compresslevel if output.suffix == '.csv' else None
+                method = compression if output.suffix == '.csv' else None
+                results.append(f"{name}: {output.save(output_paths[name], method, level)}")
+        except Exception as e:
+            return False, f"处理失败: {str(e)}"
+    source = "（缓存）" if cached else ""
+    return True, f"{'；'.join(results)}{source}，{memory.describe()}"
+
+def output_file_name(name, output_format, compression=None):
+    """输出文件名，CSV格式附加压缩后缀"""
+    output = OUTPUT_FORMATS[output_format]
+    if output.suffix == '.csv':
+        return name + output.suffix + output_suffix(compression)
+    return name + output.suffix
+
+def process_directory(input_dir, output_dir, formats, backend=None, jobs=1, compression=None, compresslevel=None,
+                      cache=None, reporter=None, shard=None,
+                      timeout=None, memory_limit=None):
+    """
+    批量处理目录下的所有XML输入，每种格式写入 output_dir 下的同名子目录
+
+    输出文件的命名与 xml2csv 相同：只保留第一级目录，目录中只有一个XML
+    文件时使用目录名。某种格式的目标文件已存在时只跳过该格式。
+
+    Args:
+        input_dir: XML文件所在目录
+        output_dir: 输出根目录
+        formats: 输出格式名称列表
+        backend: 解析后端名称，默认 etree
+        jobs: 并行进程数，默认顺序处理
+        compression: CSV输出的压缩格式
+        compresslevel: 压缩级别
+        cache: ModelCache，命中时不再清理和解析XML
+        reporter: RunReporter，决定每个文件的输出方式并写运行报告，处理结束时关闭
+        shard: Shard，只处理其中一个分片的输入，并在输出目录的 _shards 中写出清单
+        timeout: 单个文件的转换时间上限（秒），超时的隔离工作进程被终止
+        memory_limit: 单个隔离工作进程的内存上限（字节）
+    """
+    if reporter is None:
+        reporter = RunReporter()
+    if shard is None:
+        shard = Shard()
+    total_files = 0
+    success_count = 0
+    skipped_count = 0
+    failed_files = []
+    planned = set()
+    # 本分片负责的输出文件
+    planned_outputs = []
+    started = datetime.now()
+
+    def plan_names():
+        """确定每个输入的输出子目录和文件名，只保留本分片负责的输入"""
+        inputs = scan_inputs(input_dir)
+        candidates = []
+
+        for rel_path, xml_inputs in group_by_directory(inputs).items():
+            path_parts = rel_path.split(os.sep)
+            # 只取第一级目录
+            subdir = path_parts[0] if len(path_parts) > 1 else ''
+            root = os.path.join(input_dir, rel_path) if rel_path else input_dir
+
+            for xml_input in xml_inputs:
+                if len(xml_inputs) == 1:
+                    name = os.path.basename(root)
+                else:
+                    name = os.path.splitext(os.path.basename(xml_input.rel_path))[0]
+                candidates.append((xml_input, subdir, name))
+
+        # 按输出名称分片（与格式无关），同名输出总在同一分片
+        def name_key(item):
+            return shard_key(os.path.join(output_dir, item[1], item[2]), output_dir)
+        return shard.select(candidates, key=name_key, size=lambda item: item[0].size)
+
+    def plan_tasks():
+        nonlocal total_files, skipped_count
+
+        candidates = plan_names()
+        reporter.set_total(len(candidates), sum(xml_input.size for xml_input, _, _ in candidates))
+
+        for xml_input, subdir, name in candidates:
+            total_files += 1
+            output_paths = {}
+            for output_format in formats:
+                path = os.path.join(output_dir, output_format, subdir,
+                                    output_file_name(name, output_format, compression))
+                planned_outputs.append(path)
+                if not os.path.exists(path) and path not in planned:
+                    output_paths[output_format] = path
+
+            if not output_paths:
+                if reporter.verbose:
+                    print(f"[{total_files}] 处理文件：")
+                    print(f"源文件：{xml_input.display_name}")
+                    print("✓ 跳过：所有目标文件已存在")
+                    print("=" * 60)
+                skipped_count += 1
+                reporter.skipped(xml_input, None, "所有目标文件已存在")
+                continue
+
+            for path in output_paths.values():
+                planned.add(path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            yield xml_input, output_paths, total_files
+
+    convert = partial(convert_all, backend=backend, compression=compression, compresslevel=compresslevel,
+                      cache=cache)
+    results = run_conversions(plan_tasks(), convert, jobs, timed=True, timeout=timeout,
+                              memory_limit=memory_limit)
+    for (xml_input, output_paths, number), success, message, seconds in results:
+        reporter.finished(xml_input, output_paths, success, message, seconds)
+        if success:
+            success_count += 1
+        else:
+            failed_files.append((xml_input.display_name, message))
+        if not reporter.verbose:
+            continue
+        print(f"[{number}] 处理文件：")
+        print(f"源文件：{xml_input.display_name}")
+        for path in output_paths.values():
+            print(f"目标文件：{path}")
+        if success:
+            print(f"✓ 成功：{message}")
+        else:
+            print(f"✗ 失败：{message}")
+        print("=" * 60)
+    reporter.close()
+    if shard.sharded:
+        write_manifest(manifest_path(output_dir, shard), shard, 'xml_fanout', reporter,
+                       list(dict.fromkeys(planned_outputs)), output_dir, started)
+
+    # 打印处理总结
+    print("\n处理完成：" if not shard.sharded else f"\n分片 {shard} 处理完成：")
+    print(f"总文件数：{total_files}")
+    print(f"成功：{success_count}")
+    print(f"跳过：{skipped_count}")
+    print(f"失败：{len(failed_files)}")
+
+    if failed_files:
+        print("\n失败文件列表：")
+        for file_path, error in failed_files:
+            print(f"- {file_path}")
+            print(f"  错误：{error}")
+
+def parse_formats(text):
+    """解析逗号分隔的格式列表"""
+    formats = [name.strip() for name in text.split(',') if name.strip()]
+    unknown = [name for name in formats if name not in OUTPUT_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            f"未知的输出格式: {', '.join(unknown)}，可选: {', '.join(OUTPUT_FORMATS)}")
+    return list(dict.fromkeys(formats))
+
+def main():
+    parser = argparse.ArgumentParser(description='一次解析XML，同时生成多种CSV和Excel输出')
+    parser.add_argument('input_dir', help='输入目录')
+    parser.add_argument('output_dir', help='输出目录，每种格式写入同名子目录')
+    parser.add_argument('--formats', type=parse_formats, default=list(OUTPUT_FORMATS),
+                        help=f"逗号分隔的输出格式 (默认全部: {','.join(OUTPUT_FORMATS)})")
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--jobs', type=int, default=1, help='并行进程数 (默认 1)')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), help='压缩输出的CSV文件')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    parser.add_argument('--cache-dir', default=None, help='设备模型缓存目录，命中时不再解析XML')
+    parser.add_argument('--cache-size', default=None, help='缓存目录大小上限，如 500M、2G (默认 1G)')
+    add_report_arguments(parser)
+    add_shard_arguments(parser)
+    add_isolation_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"错误: 输入目录 '{args.input_dir}' 不存在")
+        sys.exit(1)
+
+    try:
+        cache = None
+        if args.cache_dir:
+            cache_size = parse_size(args.cache_size) if args.cache_size else DEFAULT_CACHE_SIZE
+            cache = ModelCache(args.cache_dir, cache_size)
+        process_directory(args.input_dir, args.output_dir, args.formats, args.backend, args.jobs,
+                          args.compress, args.level, cache, reporter_from_args(args), shard_from_args(args),
+                          args.timeout, args.worker_memory)
+    except Exception as e:
+        print(f"处理过程中发生错误: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+提取时的过滤条件和列选择
+
+--where 条件直接作用于设备模型：不满足条件的设备和端口在生成任何
+输出行之前就被丢弃，不参与排序和写出。--columns 只输出选择的列，
+解析时也只提取这些列和条件用到的字段。
+
+条件格式为 "字段 运算符 值"，多个 --where 之间为"且":
+    =    等于              OperStatus=down
+    !=   不等于            RunState!=Operate
+    ~    正则匹配（search） ManufacturerName~^Siemens
+    !~   正则不匹配
+
+字段可以用 device.、im.、port. 前缀指定所属部分；不加前缀时，端口
+字段（xml2xlsx.PORT_FIELDS）按端口处理，ImRecord 字段按 ImRecord
+处理，其余按设备处理。缺少的字段按空字符串比较。
+
+有端口条件时只保留满足条件的端口，没有任何端口满足条件的设备被丢弃。
+"""
+
+import re
+import argparse
+
+OPERATORS = ('=', '!=', '~', '!~')
+
+# 条件字段的前缀和所属部分
+PART_PREFIXES = {'device': 'device', 'im': 'im_record', 'port': 'port'}
+
+_WHERE = re.compile(r'^\s*(?:(device|im|port)\.)?(\w+)\s*(!=|!~|=|~)(.*)$')
+
+class Predicate:
+    """一个字段条件"""
+
+    def __init__(self, part, field, operator, value):
+        if operator not in OPERATORS:
+            raise ValueError(f"未知的运算符: {operator}，可选: {', '.join(OPERATORS)}")
+        self.part = part
+        self.field = field
+        self.operator = operator
+        self.value = value
+        self._pattern = re.compile(value) if operator in ('~', '!~') else None
+
+    def __str__(self):
+        return f"{self.field}{self.operator}{self.value}"
+
+    def test(self, fields):
+        """
+        Args:
+            fields: 设备、ImRecord 或端口的字段字典
+        """
+        value = fields.get(self.field, '')
+        if self.operator == '=':
+            return value == self.value
+        if self.operator == '!=':
+            return value != self.value
+        matched = self._pattern.search(value) is not None
+        return matched if self.operator == '~' else not matched
+
+def parse_where(text):
+    """解析 --where 条件"""
+    match = _WHERE.match(text)
+    if match is None:
+        raise argparse.ArgumentTypeError(f"条件格式应为 字段=值、字段!=值、字段~正则 或 字段!~正则: {text}")
+    # xml2xlsx 也使用本模块，字段列表在这里才导入
+    from xml2xlsx import IM_RECORD_FIELDS, PORT_FIELDS
+
+    prefix, field, operator, value = match.groups()
+    if prefix:
+        part = PART_PREFIXES[prefix]
+    elif field in PORT_FIELDS:
+        part = 'port'
+    elif field in IM_RECORD_FIELDS:
+        part = 'im_record'
+    else:
+        part = 'device'
+    try:
+        return Predicate(part, field, operator, value.strip())
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"无效的正则表达式 {value!r}: {str(e)}")
+
+class ModelFilter:
+    """
+    按条件过滤设备模型
+
+    用法:
+        model_filter = ModelFilter([parse_where('OperStatus=down')])
+        for model in model_filter.apply(models):
+            ...
+    """
+
+    def __init__(self, predicates=()):
+        predicates = list(predicates)
+        self.device_predicates = [p for p in predicates if p.part == 'device']
+        self.im_predicates = [p for p in predicates if p.part == 'im_record']
+        self.port_predicates = [p for p in predicates if p.part == 'port']
+        self.fields = {p.field for p in predicates}
+
+    def __bool__(self):
+        return bool(self.fields)
+
+    def __str__(self):
+        return ' 且 '.join(str(p) for p in self.device_predicates + self.im_predicates + self.port_predicates)
+
+    def apply(self, models):
+        """
+        丢弃不满足条件的设备，并只保留满足端口条件的端口
+
+        Args:
+            models: 设备模型的可迭代对象（端口列表会被就地替换）
+        Yields:
+            满足条件的设备模型
+        """
+        for model in models:
+            device, im_record = model['device'], model['im_record']
+            if not all(p.test(device) for p in self.device_predicates):
+                continue
+            if not all(p.test(im_record) for p in self.im_predicates):
+                continue
+            if self.port_predicates:
+                matched = False
+                interfaces = []
+                for ports in model['interfaces']:
+                    if ports is not None:
+                        ports = [port for port in ports if all(p.test(port) for p in self.port_predicates)]
+                        matched = matched or bool(ports)
+                    interfaces.append(ports)
+                if not matched:
+                    continue
+                model['interfaces'] = interfaces
+            yield model
+
+def extraction_fields(columns, model_filter=None):
+    """
+    解析时需要提取的字段：输出列用到的字段加上条件用到的字段
+
+    Args:
+        columns: 输出用到的模型字段名
+        model_filter: ModelFilter
+    Returns:
+        字段名集合
+    """
+    fields = set(columns)
+    if model_filter:
+        fields |= model_filter.fields
+    return fields
+
+def columns_type(available):
+    """
+    创建 --columns 的参数类型：逗号分隔的列名，保持给出的顺序
+
+    Args:
+        available: 可选的列名列表
+    """
+    def parse(text):
+        columns = list(dict.fromkeys(name.strip() for name in text.split(',') if name.strip()))
+        unknown = [name for name in columns if name not in available]
+        if unknown or not columns:
+            raise argparse.ArgumentTypeError(
+                f"未知的列: {', '.join(unknown)}，可选: {', '.join(available)}")
+        return columns
+    return parse
+
+def add_filter_arguments(parser, columns=None):
+    """
+    向参数解析器添加 --where 和 --columns
+
+    Args:
+        parser: argparse 解析器
+        columns: 可选的输出列，None 表示不支持 --columns
+    """
+    parser.add_argument('--where', type=parse_where, action='append', default=[],
+                        help='过滤条件，如 OperStatus=down、ManufacturerName~^Siemens，可以重复（同时满足）')
+    if columns is not None:
+        parser.add_argument('--columns', type=columns_type(columns), default=None,
+                            help=f"逗号分隔的输出列 (默认全部: {','.join(columns)})")
+
+def filter_from_args(args):
+    """按命令行参数创建 ModelFilter，没有条件时为 None"""
+    return ModelFilter(args.where) if args.where else None
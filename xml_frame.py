@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+直接提取为 pandas DataFrame
+
+解析时把每个字段追加到各自的列表中，不为每个端口创建字典，最后一次性
+构建 DataFrame。取值种类很少的字段（厂商、设备类型、角色、运行状态、
+端口状态、MAU 类型）存为 category 类型，每个值只占一个整数编码，
+排序、分组、去重和合并区域的计算都可以向量化完成。
+
+设备字段在该设备的每个端口行中重复，其他字段中不同取值不超过行数
+一半的也自动存为 category；52MB 的样本（8 万行）因此从约 139MB
+降到约 13MB。
+
+每个端口一行；没有端口的设备保留一行，端口列为空字符串。DeviceIndex
+为设备在文档中的序号（从 0 开始），同一设备的行相邻。
+
+--where 和 --columns 见 xml_filter：解析时只提取选择的列和条件用到的
+字段，不满足条件的设备和端口不进入 DataFrame；DeviceIndex 总是保留，
+有条件时为设备在过滤结果中的序号。
+
+--numeric 把端口计数器（port_counters.COUNTER_FIELDS）存为 float64 列，
+空值和无法解析的值为 NaN，可以直接求和、比较和汇总。
+"""
+
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from memory_budget import PeakMemory, format_size
+from port_counters import COUNTER_FIELDS, parse_counter
+from xml2csv import remove_char_references
+from xml2xlsx import DEVICE_FIELDS, IM_RECORD_FIELDS, PORT_FIELDS
+from xml_backends import BACKENDS, get_backend, iter_ports
+from xml_filter import add_filter_arguments, extraction_fields, filter_from_args
+from xml_sources import open_cleaned
+
+# 设备列和端口列
+FRAME_DEVICE_COLUMNS = DEVICE_FIELDS + IM_RECORD_FIELDS
+FRAME_PORT_COLUMNS = PORT_FIELDS
+FRAME_COLUMNS = ['DeviceIndex'] + FRAME_DEVICE_COLUMNS + FRAME_PORT_COLUMNS
+
+# 排序用到的列
+SORT_COLUMNS = ['NameOfStation', 'IpAddress', 'PortID']
+
+# 总是存为 category 的低基数字段
+CATEGORICAL_COLUMNS = ['ManufacturerName', 'DeviceType', 'Role', 'RunState', 'OperStatus', 'MauType']
+
+# 其他字段的不同取值数不超过行数的这个比例时存为 category
+CATEGORY_RATIO = 0.5
+
+def _column(name, values, auto_categories):
+    if name in CATEGORICAL_COLUMNS:
+        return pd.Categorical(values)
+    if auto_categories:
+        categorical = pd.Categorical(values)
+        if len(categorical.categories) <= len(values) * CATEGORY_RATIO:
+            return categorical
+    return values
+
+def models_to_frame(models, auto_categories=True, columns=None, numeric=False):
+    """
+    将设备模型逐列填充为 DataFrame
+
+    Args:
+        models: 设备模型的可迭代对象
+        auto_categories: 是否把重复较多的其他字段也存为 category
+        columns: 要填充的设备和端口列，None 表示全部
+        numeric: 是否把端口计数器存为 float64 列
+    Returns:
+        df: 每个端口一行的 DataFrame
+    """
+    selected = set(FRAME_DEVICE_COLUMNS + FRAME_PORT_COLUMNS if columns is None else columns)
+    device_fields = [field for field in DEVICE_FIELDS if field in selected]
+    im_fields = [field for field in IM_RECORD_FIELDS if field in selected]
+    port_fields = [field for field in FRAME_PORT_COLUMNS if field in selected]
+    device_columns = [[] for _ in device_fields + im_fields]
+    port_columns = [[] for _ in port_fields]
+    device_index = []
+    empty_port = [''] * len(port_fields)
+
+    for index, model in enumerate(models):
+        device, im_record = model['device'], model['im_record']
+        values = ([device.get(field, '') for field in device_fields] +
+                  [im_record.get(field, '') for field in im_fields])
+        port_count = 0
+        for port in iter_ports(model):
+            port_count += 1
+            for column, field in zip(port_columns, port_fields):
+                column.append(port.get(field, ''))
+        if port_count == 0:
+            port_count = 1
+            for column, value in zip(port_columns, empty_port):
+                column.append(value)
+
+        # 设备字段在该设备的每一行重复
+        for column, value in zip(device_columns, values):
+            column.extend([value] * port_count)
+        device_index.extend([index] * port_count)
+
+    data = {'DeviceIndex': np.array(device_index, dtype=np.int64)}
+    for name, column in zip(device_fields + im_fields + port_fields, device_columns + port_columns):
+        if numeric and name in COUNTER_FIELDS:
+            data[name] = parse_counter(column)
+        else:
+            data[name] = _column(name, column, auto_categories)
+    return pd.DataFrame(data, columns=[name for name in FRAME_COLUMNS if name in data])
+
+def xml_to_frame(xml_file, backend='expat', auto_categories=True, model_filter=None, columns=None,
+                 numeric=False):
+    """
+    解析XML输入并返回 DataFrame
+
+    与 xml2csv 相同，读取时流式移除所有数字字符引用。
+
+    Args:
+        xml_file: XML文件路径、XmlInput 或已读取的字节内容
+        backend: 解析后端名称，默认 expat（流式，不构建树）
+        auto_categories: 是否把重复较多的其他字段也存为 category
+        model_filter: xml_filter.ModelFilter，只保留满足条件的设备和端口
+        columns: 要提取的设备和端口列，None 表示全部
+        numeric: 是否把端口计数器存为 float64 列
+    Returns:
+        df: 每个端口一行的 DataFrame
+    """
+    fields = extraction_fields(columns, model_filter) if columns is not None else None
+    with open_cleaned(xml_file, remove_char_references) as f:
+        models = get_backend(backend).iter_devices(f, fields)
+        if model_filter:
+            models = model_filter.apply(models)
+        return models_to_frame(models, auto_categories, columns, numeric)
+
+def sort_frame(df, natural=False):
+    """
+    按设备名称、IP地址和端口ID排序（与 d_xml2csv 的顺序相同）
+
+    Args:
+        df: DataFrame
+        natural: 端口ID中的数字是否按数值比较
+    """
+    if not natural:
+        return df.sort_values(SORT_COLUMNS, kind='stable')
+    from d_xml2csv import natural_key
+
+    def port_rank(column):
+        # 只对不同的端口ID做一次自然排序，再按名次排序
+        if column.name != 'PortID':
+            return column
+        values = column.astype(object)
+        ranks = {value: rank for rank, value in enumerate(sorted(values.unique(), key=natural_key))}
+        return values.map(ranks)
+
+    return df.sort_values(SORT_COLUMNS, kind='stable', key=port_rank)
+
+def group_runs(df, keys, first_row=2):
+    """
+    向量化计算相邻行中键相同的行范围，用于合并单元格或分组
+
+    Args:
+        df: DataFrame，行按写入工作表的顺序排列
+        keys: 键列名列表
+        first_row: 第一行数据在工作表中的行号
+    Returns:
+        groups: (首行, 末行) 列表，覆盖所有行
+    """
+    if df.empty:
+        return []
+    changed = np.zeros(len(df), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        values = df[key].to_numpy()
+        changed[1:] |= values[1:] != values[:-1]
+    starts = np.flatnonzero(changed)
+    ends = np.append(starts[1:], len(df)) - 1
+    return list(zip((starts + first_row).tolist(), (ends + first_row).tolist()))
+
+def memory_usage(df):
+    """DataFrame 占用的内存（字节，包括字符串对象）"""
+    return int(df.memory_usage(deep=True).sum())
+
+def main():
+    parser = argparse.ArgumentParser(description='将XML文件提取为 DataFrame 并保存')
+    parser.add_argument('xml_file', help='输入XML文件')
+    parser.add_argument('output', nargs='?', default=None,
+                        help='输出文件，按后缀保存为 .pkl、.parquet 或 .csv；省略时只显示统计')
+    parser.add_argument('--backend', choices=list(BACKENDS), default='expat', help='解析后端 (默认 expat)')
+    parser.add_argument('--sort', action='store_true', help='按设备名称、IP地址和端口ID排序')
+    parser.add_argument('--fixed-categories', action='store_true',
+                        help=f"只把 {', '.join(CATEGORICAL_COLUMNS)} 存为 category")
+    parser.add_argument('--numeric', action='store_true',
+                        help=f"把 {', '.join(COUNTER_FIELDS)} 存为数值列")
+    add_filter_arguments(parser, FRAME_DEVICE_COLUMNS + FRAME_PORT_COLUMNS)
+    args = parser.parse_args()
+    if args.sort and args.columns is not None and not set(SORT_COLUMNS) <= set(args.columns):
+        parser.error(f"--sort 需要 --columns 包含 {', '.join(SORT_COLUMNS)}")
+
+    try:
+        with PeakMemory() as memory:
+            df = xml_to_frame(args.xml_file, args.backend, not args.fixed_categories,
+                              filter_from_args(args), args.columns, args.numeric)
+            if args.sort:
+                df = sort_frame(df)
+        print(f"共 {len(df)} 行，{df['DeviceIndex'].nunique()} 个设备，"
+              f"DataFrame 占用 {format_size(memory_usage(df))}，{memory.describe()}")
+
+        if args.output:
+            if args.output.endswith('.pkl'):
+                df.to_pickle(args.output)
+            elif args.output.endswith('.parquet'):
+                df.to_parquet(args.output, index=False)
+            elif args.output.endswith('.csv'):
+                df.to_csv(args.output, index=False, encoding='utf-8-sig')
+            else:
+                print("错误: 输出文件须以 .pkl、.parquet 或 .csv 结尾")
+                sys.exit(1)
+            print(f"成功: 已保存到 {args.output}")
+    except Exception as e:
+        print(f"错误: 处理失败: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
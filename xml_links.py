@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+解析一次采集中各端口的链路对端，生成链路表
+
+每个 Port 的 RemoteNameOfStation、RemotePortID 和 RemoteMAC 记录了
+邻居（LLDP）信息。这里先为采集中的所有本地端口建立散列索引：
+
+    (设备名称, 端口ID) -> 端口
+    设备 MAC -> 设备名称
+
+再对每个端口按邻居信息查找对端端口（散列连接），整个过程只遍历端口
+两遍，与端口数成线性关系。查找顺序为 RemoteNameOfStation，找不到时
+按 RemoteMAC 对应的设备名称。PROFINET 的 RemotePortID 可能带有
+".设备名称" 后缀（如 port-001.dev-01），比较时去掉。
+
+链路表每条物理链路一行；双方互相指向的链路只在文档中先出现的端口
+处输出一次。Status 列：
+
+    ok            找到对端端口，且对端的邻居信息指回本端口
+    asymmetric    找到对端端口，但对端的邻居信息没有指回本端口
+    unknown_port  对端设备在采集中，但没有该端口
+    dangling      对端设备不在采集中
+    ambiguous     多个本地端口有相同的 (设备名称, 端口ID)，无法确定对端
+
+Mismatch 列列出两端不一致的项（以 ';' 分隔）：MauType、OperStatus，
+以及邻居信息中的 RemoteMAC、RemoteNameOfStation 与对端设备不符。
+
+用法:
+    python xml_links.py XML文件 链路表.csv [--topology]
+
+--topology 用 networkx 计算连通分量和环路，增加 Component 和 Ring 列。
+"""
+
+import sys
+import csv
+import argparse
+from collections import Counter
+
+from csv_output import COMPRESSIONS, open_csv_output
+from xml_backends import BACKENDS, DEFAULT_BACKEND, get_backend, iter_ports
+
+# 提取时需要的字段
+LINK_SOURCE_FIELDS = {'NameOfStation', 'MAC', 'PortID', 'PortDesc', 'OperStatus', 'MauType', 'CableDelay',
+                      'PowerBudget', 'RemoteNameOfStation', 'RemotePortID', 'RemoteMAC'}
+
+# 每个端口在索引中保存的值，按此顺序组成元组
+_STATION, _MAC, _PORT_ID, _PORT_DESC, _OPER_STATUS, _MAU_TYPE, _CABLE_DELAY, _POWER_BUDGET, \
+    _REMOTE_STATION, _REMOTE_PORT_ID, _REMOTE_MAC = range(11)
+_PORT_VALUES = ('PortID', 'PortDesc', 'OperStatus', 'MauType', 'CableDelay', 'PowerBudget',
+                'RemoteNameOfStation', 'RemotePortID', 'RemoteMAC')
+
+# 每端输出的列（与端口元组中的位置对应）
+_END_COLUMNS = [('Station', _STATION), ('MAC', _MAC), ('PortID', _PORT_ID), ('PortDesc', _PORT_DESC),
+                ('OperStatus', _OPER_STATUS), ('MauType', _MAU_TYPE), ('CableDelay', _CABLE_DELAY),
+                ('PowerBudget', _POWER_BUDGET)]
+
+LINK_FIELDS = (['Status', 'Mismatch', 'ResolvedBy'] +
+               ['Local' + name for name, _ in _END_COLUMNS] +
+               ['Remote' + name for name, _ in _END_COLUMNS])
+TOPOLOGY_FIELDS = ['Component', 'Ring']
+
+LINK_STATUSES = ('ok', 'asymmetric', 'unknown_port', 'dangling', 'ambiguous')
+
+# 索引中同一键对应多个端口或设备
+_AMBIGUOUS = -1
+
+def normalize_mac(mac):
+    """MAC 地址统一为小写、':' 分隔"""
+    return mac.strip().lower().replace('-', ':')
+
+def normalize_port_id(port_id, station):
+    """去掉 PROFINET 端口ID中的 '.设备名称' 后缀"""
+    if station and port_id.endswith('.' + station):
+        return port_id[:-len(station) - 1]
+    return port_id
+
+class LinkIndex:
+    """
+    采集中所有端口的索引
+
+    用法:
+        index = LinkIndex()
+        for model in index.track(models):
+            ...                      # 端口在遍历时登记
+        for row in index.links():
+            ...
+    """
+
+    def __init__(self):
+        self.ports = []
+        self._by_port = {}
+        self._by_mac = {}
+        self._stations = set()
+
+    def add(self, model):
+        """登记一个设备模型的所有端口"""
+        device = model['device']
+        station = device.get('NameOfStation', '')
+        mac = device.get('MAC', '')
+        self._stations.add(station)
+        if mac:
+            mac = normalize_mac(mac)
+            previous = self._by_mac.get(mac)
+            self._by_mac[mac] = station if previous in (None, station) else _AMBIGUOUS
+
+        for port in iter_ports(model):
+            values = (station, mac) + tuple(port.get(field, '') for field in _PORT_VALUES)
+            key = (station, values[_PORT_ID])
+            self._by_port[key] = _AMBIGUOUS if key in self._by_port else len(self.ports)
+            self.ports.append(values)
+
+    def track(self, models):
+        """边产出设备模型边登记端口"""
+        for model in models:
+            self.add(model)
+            yield model
+
+    def _partner(self, port):
+        """
+        查找端口的对端
+
+        Returns:
+            (状态, 对端端口序号或 None, 查找方式)
+        """
+        remote_station = port[_REMOTE_STATION]
+        remote_mac = normalize_mac(port[_REMOTE_MAC]) if port[_REMOTE_MAC] else ''
+        candidates = []
+        if remote_station:
+            candidates.append((remote_station, 'name'))
+        mac_station = self._by_mac.get(remote_mac) if remote_mac else None
+        if mac_station is not None and mac_station != _AMBIGUOUS and mac_station != remote_station:
+            candidates.append((mac_station, 'mac'))
+
+        status = 'dangling'
+        for station, resolved_by in candidates:
+            partner = self._by_port.get((station, normalize_port_id(port[_REMOTE_PORT_ID], station)))
+            if partner == _AMBIGUOUS:
+                return 'ambiguous', None, resolved_by
+            if partner is not None:
+                return 'ok', partner, resolved_by
+            if station in self._stations:
+                status = 'unknown_port'
+        return status, None, ''
+
+    def _points_back(self, port, partner):
+        """对端的邻居信息是否指向本端口"""
+        remote_station = partner[_REMOTE_STATION]
+        if remote_station != port[_STATION]:
+            mac = partner[_REMOTE_MAC]
+            if not (mac and port[_MAC] and normalize_mac(mac) == port[_MAC]):
+                return False
+            remote_station = port[_STATION]
+        return normalize_port_id(partner[_REMOTE_PORT_ID], remote_station) == port[_PORT_ID]
+
+    @staticmethod
+    def _mismatches(port, partner):
+        mismatches = []
+        for field, position in (('MauType', _MAU_TYPE), ('OperStatus', _OPER_STATUS)):
+            if port[position] != partner[position]:
+                mismatches.append(field)
+        if port[_REMOTE_MAC] and partner[_MAC] and normalize_mac(port[_REMOTE_MAC]) != partner[_MAC]:
+            mismatches.append('RemoteMAC')
+        if port[_REMOTE_STATION] and port[_REMOTE_STATION] != partner[_STATION]:
+            mismatches.append('RemoteNameOfStation')
+        return ';'.join(mismatches)
+
+    def resolve(self):
+        """
+        解析所有端口的对端
+
+        Yields:
+            (状态, 本端端口序号, 对端端口序号或 None, 不一致项, 查找方式)，按文档顺序，
+            互相指向的链路只在先出现的端口处产出一次
+        """
+        ports = self.ports
+        # 已输出的 ok 链路，以 (对端, 本端) 登记，到达对端端口时跳过
+        reported = set()
+        for index, port in enumerate(ports):
+            if not (port[_REMOTE_STATION] or port[_REMOTE_MAC] or port[_REMOTE_PORT_ID]):
+                continue
+            status, partner, resolved_by = self._partner(port)
+            if partner is None:
+                yield status, index, None, '', resolved_by
+                continue
+            if (index, partner) in reported:
+                continue
+            if self._points_back(port, ports[partner]):
+                reported.add((partner, index))
+            else:
+                status = 'asymmetric'
+            yield status, index, partner, self._mismatches(port, ports[partner]), resolved_by
+
+    def _row(self, status, index, partner, mismatch, resolved_by):
+        port = self.ports[index]
+        row = [status, mismatch, resolved_by] + [port[position] for _, position in _END_COLUMNS]
+        if partner is not None:
+            row.extend(self.ports[partner][position] for _, position in _END_COLUMNS)
+        else:
+            # 对端不在采集中，只有本端记录的邻居信息
+            row.extend([port[_REMOTE_STATION], normalize_mac(port[_REMOTE_MAC]) if port[_REMOTE_MAC] else '',
+                        port[_REMOTE_PORT_ID]] + [''] * (len(_END_COLUMNS) - 3))
+        return row
+
+    def links(self, topology=False):
+        """
+        生成链路表的行
+
+        Args:
+            topology: 是否计算连通分量和环路，追加 TOPOLOGY_FIELDS 列（需要 networkx）
+        Returns:
+            行列表，按 LINK_FIELDS（和 TOPOLOGY_FIELDS）排列
+        """
+        links = list(self.resolve())
+        rows = [self._row(*link) for link in links]
+        if topology:
+            components, rings = link_topology(
+                [(self.ports[index][_STATION], self.ports[partner][_STATION])
+                 for status, index, partner, _, _ in links if partner is not None])
+            for row, (status, index, partner, _, _) in zip(rows, links):
+                station = self.ports[index][_STATION]
+                edge = frozenset((station, self.ports[partner][_STATION])) if partner is not None else None
+                row.extend([components.get(station, ''), rings.get(edge, '')])
+        return rows
+
+def link_topology(edges):
+    """
+    计算设备之间的连通分量和环路
+
+    Args:
+        edges: (设备名称, 设备名称) 列表
+    Returns:
+        (components, rings): {设备名称: 分量编号}，分量按设备数从多到少编号（从 1 开始）；
+                             {frozenset(两端设备名称): 环路编号}，环路为图的一组基本回路
+    """
+    import networkx as nx
+
+    graph = nx.Graph()
+    graph.add_edges_from((a, b) for a, b in edges if a != b)
+    components = {}
+    ordered = sorted(nx.connected_components(graph), key=lambda nodes: (-len(nodes), min(nodes)))
+    for number, nodes in enumerate(ordered, 1):
+        for node in nodes:
+            components[node] = number
+    rings = {}
+    for number, cycle in enumerate(nx.cycle_basis(graph), 1):
+        for a, b in zip(cycle, cycle[1:] + cycle[:1]):
+            rings.setdefault(frozenset((a, b)), number)
+    return components, rings
+
+def append_links_sheet(wb, index, title='Links'):
+    """
+    在 openpyxl 工作簿（包括只写模式）末尾追加链路表工作表
+
+    Args:
+        wb: 工作簿
+        index: 已登记全部端口的 LinkIndex
+    """
+    ws = wb.create_sheet(title)
+    ws.append(LINK_FIELDS)
+    for row in index.links():
+        ws.append(row)
+
+def xml_to_links(xml_file, links_file, backend=None, topology=False, compression=None, compresslevel=None):
+    """
+    从XML文件生成链路表CSV
+
+    Args:
+        xml_file: XML文件路径、XmlInput 或已读取的字节内容
+        links_file: CSV文件路径或 '-'（标准输出）
+        backend: 解析后端名称
+        topology: 是否增加连通分量和环路列
+        compression: 输出压缩格式
+        compresslevel: 压缩级别
+    Returns:
+        (bool, str): (是否成功, 信息)
+    """
+    try:
+        index = LinkIndex()
+        for model in get_backend(backend).iter_devices(xml_file, LINK_SOURCE_FIELDS):
+            index.add(model)
+        rows = index.links(topology)
+        if not rows:
+            return False, "没有找到任何带邻居信息的端口"
+        with open_csv_output(links_file, compression, compresslevel) as f:
+            writer = csv.writer(f)
+            writer.writerow(LINK_FIELDS + (TOPOLOGY_FIELDS if topology else []))
+            writer.writerows(rows)
+        counts = Counter(row[0] for row in rows)
+        summary = '，'.join(f"{status} {counts[status]}" for status in LINK_STATUSES if counts[status])
+        return True, f"{len(index.ports)} 个端口，{len(rows)} 条链路（{summary}）"
+    except Exception as e:
+        return False, f"处理失败: {str(e)}"
+
+def main():
+    parser = argparse.ArgumentParser(description='解析端口的链路对端并生成链路表')
+    parser.add_argument('xml_file', help='输入XML文件')
+    parser.add_argument('links_file', help="输出CSV文件，'-' 表示写到标准输出")
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    parser.add_argument('--topology', action='store_true', help='用 networkx 计算连通分量和环路')
+    parser.add_argument('--compress', choices=list(COMPRESSIONS),
+                        help='压缩输出 (输出文件以 .gz/.bz2/.xz 结尾时自动启用)')
+    parser.add_argument('--level', type=int, default=None, help='压缩级别')
+    args = parser.parse_args()
+
+    log = sys.stderr if args.links_file == '-' else sys.stdout
+    success, message = xml_to_links(args.xml_file, args.links_file, args.backend, args.topology,
+                                    args.compress, args.level)
+    if success:
+        print(f"成功: {message}", file=log)
+    else:
+        print(f"错误: {message}", file=log)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
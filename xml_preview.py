@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+预览：只解析开头的若干设备，或抽样，并估计设备和端口总数
+
+预览总是用 expat 流式解析，每次只读取 PREVIEW_READ_SIZE 字节：
+
+    head    得到前 N 个设备后立即停止读取和解析
+    sample  对读到的设备做蓄水池抽样，得到 N 个设备的均匀随机样本
+            （按文档顺序返回）；读取的解压后数据超过 sample_bytes 时
+            停止，样本只来自已读取的部分
+
+总数按开头部分估计（至少读取 ESTIMATE_MIN_SIZE，只做字节匹配不解析）：
+统计其中完整设备的平均字节数和平均端口数，再按输入解压后的大小推算。压缩文件的解压后大小按已读取
+部分的压缩比推算；读完整个输入时给出准确的数目。
+"""
+
+import io
+import os
+import re
+import random
+import argparse
+
+from memory_budget import format_size, parse_size
+from xml_backends import get_backend, iter_ports
+from xml_sources import COMPRESSED_SUFFIXES, CleanedReader, XmlInput, compression_of
+
+# 每次读取的大小，决定预览最少解析的数据量
+PREVIEW_READ_SIZE = 64 << 10
+
+# 抽样时默认最多读取的解压后数据量
+DEFAULT_SAMPLE_BYTES = 16 << 20
+
+# 估计总数时至少读取、最多保留的开头部分的大小
+ESTIMATE_MIN_SIZE = 1 << 20
+ESTIMATE_PREFIX_SIZE = 4 << 20
+
+_DEVICE_START = re.compile(rb'<Device[\s/>]')
+_DEVICE_END = re.compile(rb'</Device\s*>')
+_PORT_START = re.compile(rb'<Port[\s/>]')
+
+class _CountingReader(io.BufferedIOBase):
+    """
+    统计已读取数据量的二进制流，每次最多返回 PREVIEW_READ_SIZE 字节
+
+    保留开头 ESTIMATE_PREFIX_SIZE 字节用于估计总数。
+    """
+
+    def __init__(self, f, size=None, raw=None, owned=True):
+        """
+        Args:
+            f: （解压后的）二进制流
+            size: 输入的大小；raw 不为 None 时为压缩文件的大小
+            raw: 压缩文件的原始流，用于计算压缩比
+            owned: 关闭时是否一并关闭 f 和 raw
+        """
+        self._f = f
+        self._raw = raw
+        self._owned = owned
+        self.size = size
+        self.consumed = 0
+        self.prefix = bytearray()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > PREVIEW_READ_SIZE:
+            size = PREVIEW_READ_SIZE
+        data = self._f.read(size)
+        self.consumed += len(data)
+        if len(self.prefix) < ESTIMATE_PREFIX_SIZE:
+            self.prefix += data[:ESTIMATE_PREFIX_SIZE - len(self.prefix)]
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def read_ahead(self, size):
+        """继续读取（不解析），直到已读取 size 字节或读完，使估计基于足够多的设备"""
+        while self.consumed < size and self.read(PREVIEW_READ_SIZE):
+            pass
+
+    def total_size(self):
+        """输入解压后的大小（压缩输入为估计值），无法得知时为 None"""
+        if self._raw is None or self.size is None:
+            return self.size
+        position = self._raw.tell()
+        if not position:
+            return None
+        return self.size * self.consumed / position
+
+    def close(self):
+        if not self.closed and self._owned:
+            self._f.close()
+            if self._raw is not None:
+                self._raw.close()
+        super().close()
+
+def _open_counted(source):
+    """打开输入源，返回 _CountingReader"""
+    if isinstance(source, (bytes, bytearray)):
+        return _CountingReader(io.BytesIO(source), len(source))
+    if hasattr(source, 'read'):
+        return _CountingReader(source, owned=False)
+    if isinstance(source, XmlInput):
+        if source.kind != 'file':
+            # 归档成员：未压缩时 size 即为成员大小
+            return _CountingReader(source.open(), None if source.compression else source.size)
+        path, compression = source.path, source.compression
+    else:
+        path = os.fspath(source)
+        compression = compression_of(path) or ''
+    raw = open(path, 'rb')
+    size = os.fstat(raw.fileno()).st_size
+    if not compression:
+        return _CountingReader(raw, size)
+    return _CountingReader(COMPRESSED_SUFFIXES[compression](raw, 'rb'), size, raw)
+
+class Preview:
+    """
+    预览结果
+
+    Attributes:
+        models: 预览的设备模型列表，按文档顺序
+        devices_read: 已解析的设备数
+        ports_read: 已解析设备的端口数
+        complete: 是否读完了整个输入（此时 devices_read 和 ports_read 即为总数）
+        bytes_read: 已读取的解压后数据量
+        estimated_devices: 估计的设备总数，无法估计时为 None
+        estimated_ports: 估计的端口总数，无法估计时为 None
+    """
+
+    def __init__(self, models, devices_read, ports_read, complete, bytes_read,
+                 estimated_devices=None, estimated_ports=None):
+        self.models = models
+        self.devices_read = devices_read
+        self.ports_read = ports_read
+        self.complete = complete
+        self.bytes_read = bytes_read
+        self.estimated_devices = estimated_devices
+        self.estimated_ports = estimated_ports
+
+    def describe(self):
+        if self.complete:
+            return f"共 {self.devices_read} 个设备、{self.ports_read} 个端口"
+        if self.estimated_devices is None:
+            return f"已读取 {format_size(self.bytes_read)}，无法估计设备总数"
+        return (f"估计共约 {self.estimated_devices} 个设备、{self.estimated_ports} 个端口"
+                f"（已读取 {format_size(self.bytes_read)}）")
+
+def estimate_totals(prefix, total_size):
+    """
+    按开头部分中完整设备的平均大小和端口数估计总数
+
+    Args:
+        prefix: 文档开头的字节
+        total_size: 文档的总字节数
+    Returns:
+        (设备数, 端口数)，无法估计时为 (None, None)
+    """
+    last_end = None
+    for match in _DEVICE_END.finditer(prefix):
+        last_end = match.end()
+    if last_end is None or not total_size:
+        return None, None
+    starts = [match.start() for match in _DEVICE_START.finditer(prefix, 0, last_end)]
+    if not starts:
+        return None, None
+    devices = len(starts)
+    ports = len(_PORT_START.findall(prefix, starts[0], last_end))
+    estimated = max(devices, round((total_size - starts[0]) * devices / (last_end - starts[0])))
+    return estimated, round(estimated * ports / devices)
+
+def preview_models(source, head=None, sample=None, seed=None, sample_bytes=DEFAULT_SAMPLE_BYTES,
+                   fields=None, model_filter=None, clean_text=None, encodings=('utf-8', 'latin1'),
+                   all_devices=False):
+    """
+    预览输入中的设备
+
+    Args:
+        source: 文件路径、XmlInput、二进制文件对象或字节内容
+        head: 取前 head 个设备
+        sample: 随机抽取 sample 个设备（与 head 二选一）
+        seed: 抽样的随机种子
+        sample_bytes: 抽样时最多读取的解压后数据量，0 表示读完整个输入
+        fields: 只提取的叶子字段名集合
+        model_filter: xml_filter.ModelFilter，只预览满足条件的设备
+        clean_text: 解析前对文本做的清理（见 xml_sources.CleanedReader），None 表示不清理
+        encodings: 清理时依次尝试的编码
+        all_devices: 预览所有 .//Device，而不只是 DeviceCollection 下的 Device（见 xml_backends）
+    Returns:
+        Preview
+    """
+    if (head is None) == (sample is None):
+        raise ValueError("head 和 sample 必须且只能指定一个")
+    reader = _open_counted(source)
+    stream = CleanedReader(reader, clean_text, encodings) if clean_text else reader
+    devices_read = ports_read = 0
+    complete = truncated = False
+
+    def counted(devices):
+        nonlocal devices_read, ports_read, truncated
+        for model in devices:
+            devices_read += 1
+            ports_read += sum(1 for _ in iter_ports(model))
+            yield model
+            if sample is not None and sample_bytes and reader.consumed >= sample_bytes:
+                truncated = True
+                return
+
+    try:
+        devices = get_backend('expat').iter_devices(stream, fields, all_devices)
+        candidates = counted(devices)
+        if model_filter:
+            candidates = model_filter.apply(candidates)
+        try:
+            if sample is None:
+                models = []
+                for model in candidates:
+                    models.append(model)
+                    if len(models) >= head:
+                        break
+                else:
+                    complete = True
+            else:
+                # 蓄水池抽样，记录序号以便按文档顺序返回
+                rng = random.Random(seed)
+                reservoir = []
+                for seen, model in enumerate(candidates):
+                    if seen < sample:
+                        reservoir.append((seen, model))
+                    else:
+                        slot = rng.randrange(seen + 1)
+                        if slot < sample:
+                            reservoir[slot] = (seen, model)
+                complete = not truncated
+                models = [model for _, model in sorted(reservoir, key=lambda item: item[0])]
+        finally:
+            devices.close()
+        if complete:
+            return Preview(models, devices_read, ports_read, True, reader.consumed)
+        reader.read_ahead(ESTIMATE_MIN_SIZE)
+        estimated_devices, estimated_ports = estimate_totals(bytes(reader.prefix), reader.total_size())
+        return Preview(models, devices_read, ports_read, False, reader.consumed,
+                       estimated_devices, estimated_ports)
+    finally:
+        stream.close()
+
+def add_preview_arguments(parser):
+    """向参数解析器添加 --head、--sample、--seed 和 --sample-bytes"""
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--head', type=_positive, default=None, metavar='N',
+                       help='预览：只解析前 N 个设备后立即停止，并估计设备和端口总数')
+    group.add_argument('--sample', type=_positive, default=None, metavar='N',
+                       help='预览：随机抽取 N 个设备（蓄水池抽样），并估计设备和端口总数')
+    parser.add_argument('--seed', type=int, default=None, help='抽样的随机种子')
+    parser.add_argument('--sample-bytes', default=None,
+                        help=f'抽样时最多读取的解压后数据量，如 64M，0 表示读完整个文件 '
+                             f'(默认 {format_size(DEFAULT_SAMPLE_BYTES)})')
+
+def sample_bytes_from_args(args):
+    """按命令行参数确定抽样时最多读取的数据量"""
+    return parse_size(args.sample_bytes) if args.sample_bytes is not None else DEFAULT_SAMPLE_BYTES
+
+def _positive(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"应为正整数: {text}")
+    return value
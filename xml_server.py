@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+常驻的本地转换服务
+
+进程启动时一次性加载解析器和 openpyxl，工作进程池保持预热状态，
+每个请求直接在内存中完成 XML -> CSV / XLSX 转换，不再经过临时文件。
+XLSX 用只写模式的 openpyxl 直接写入内存缓冲，不构建单元格对象。
+
+请求体完整读取后才交给工作进程，输出也在工作进程中完整生成后才发送：
+状态码要在转换完成后才能确定（XML或结构错误返回 422，其他错误返回
+500），而且进程池只能传递完整的字节内容。请求体大小由 --max-size 限制。
+
+接口:
+    POST /csv    请求体为XML（或 multipart/form-data 上传），返回 CSV
+    POST /xlsx   请求体为XML（或 multipart/form-data 上传），返回 XLSX
+    GET  /health 健康检查
+"""
+
+import io
+import os
+import sys
+import argparse
+import xml.etree.ElementTree as ET
+import threading
+import socketserver
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import d_xml2csv
+import xml2xlsx
+from memory_budget import parse_size
+from xml_backends import BACKENDS, DEFAULT_BACKEND, StructureError
+
+# 各输出格式对应的 Content-Type 和文件扩展名
+OUTPUT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', '.csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', '.xlsx'),
+}
+
+# 预热用的最小XML，确保工作进程在第一个请求之前已加载全部模块
+WARM_UP_XML = (b'<Root><DeviceCollection><Device><NameOfStation>warm-up</NameOfStation>'
+               b'</Device></DeviceCollection></Root>')
+
+# 由输入内容引起的错误（XML格式错误、声明了实体、结构不符、没有设备），返回 422；
+# 其他异常属于服务自身的问题，返回 500
+INPUT_ERRORS = (ET.ParseError, StructureError)
+
+def convert_content(xml_content, output_format, backend=None):
+    """
+    在内存中完成一次转换
+
+    Args:
+        xml_content: XML原始字节内容
+        output_format: 'csv' 或 'xlsx'
+        backend: 解析后端名称，默认 etree
+    Returns:
+        (bytes, int): (输出内容, 写入的记录数)
+    """
+    if output_format == 'csv':
+        if backend in (None, 'etree'):
+            records = d_xml2csv.extract_records(xml2xlsx.parse_xml_content(xml_content))
+        else:
+            records = d_xml2csv.records_from_models(xml2xlsx.load_device_models(xml_content, backend))
+        if not records:
+            raise StructureError("没有找到任何设备数据")
+        buffer = io.StringIO(newline='')
+        d_xml2csv.write_csv(records, buffer)
+        return buffer.getvalue().encode('utf-8-sig'), len(records)
+
+    # 只写模式直接写出，不构建单元格对象，也不逐列合并单元格
+    devices, ports_by_name = xml2xlsx.collect_rows(xml2xlsx.load_device_models(xml_content, backend))
+    buffer = io.BytesIO()
+    xml2xlsx.write_workbook_streaming(devices, ports_by_name, buffer)
+    name_index = xml2xlsx.DEVICE_FIELDS.index('NameOfStation')
+    record_count = sum(max(len(ports_by_name.get(device[name_index], ())), 1) for device in devices)
+    return buffer.getvalue(), record_count
+
+def warm_up(backend=None):
+    """在工作进程中执行一次最小转换，提前完成模块加载"""
+    for output_format in OUTPUT_FORMATS:
+        convert_content(WARM_UP_XML, output_format, backend)
+    return os.getpid()
+
+class RequestTooLarge(Exception):
+    """请求体超过大小限制"""
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """处理转换请求"""
+
+    server_version = 'XmlConvert/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # Unix socket 的客户端地址为空字符串
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def do_GET(self):
+        if self.path.split('?')[0] == '/health':
+            self.send_body(200, b'ok\n', 'text/plain; charset=utf-8')
+        else:
+            self.send_error_text(404, "未知路径")
+
+    def do_POST(self):
+        output_format = self.path.split('?')[0].strip('/')
+        if output_format not in OUTPUT_FORMATS:
+            self.send_error_text(404, "未知路径，请使用 /csv 或 /xlsx")
+            return
+
+        try:
+            body = self.read_body()
+        except RequestTooLarge:
+            self.send_error_text(413, f"请求体超过限制 {self.server.max_request_size} 字节")
+            self.close_connection = True
+            return
+        except ValueError as e:
+            self.send_error_text(400, str(e))
+            self.close_connection = True
+            return
+
+        try:
+            xml_content = self.extract_upload(body)
+        except ValueError as e:
+            self.send_error_text(400, str(e))
+            return
+
+        # 排队的请求数有上限，超出时立即拒绝而不是无限堆积
+        if not self.server.slots.acquire(blocking=False):
+            self.send_error_text(503, "服务繁忙，请稍后重试", {'Retry-After': '1'})
+            return
+        try:
+            future = self.server.executor.submit(convert_content, xml_content, output_format,
+                                                 self.server.backend)
+            content, record_count = future.result()
+        except INPUT_ERRORS as e:
+            self.send_error_text(422, f"处理失败: {str(e)}")
+            return
+        except Exception as e:
+            self.log_error("转换出错: %r", e)
+            self.send_error_text(500, f"服务内部错误: {str(e)}")
+            return
+        finally:
+            self.server.slots.release()
+
+        content_type, extension = OUTPUT_FORMATS[output_format]
+        self.send_body(200, content, content_type, {
+            'Content-Disposition': f'attachment; filename="converted{extension}"',
+            'X-Record-Count': str(record_count),
+        })
+
+    def read_body(self):
+        """读取请求体，支持 Content-Length 和分块传输两种方式"""
+        limit = self.server.max_request_size
+
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            total = 0
+            while True:
+                line = self.rfile.readline(65537)
+                try:
+                    size = int(line.split(b';')[0].strip(), 16)
+                except ValueError:
+                    size = -1
+                if size < 0:
+                    raise ValueError("分块传输格式错误")
+                if size == 0:
+                    # 跳过可能存在的 trailer
+                    while self.rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                total += size
+                if total > limit:
+                    raise RequestTooLarge()
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline(65537)
+            return b''.join(chunks)
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise ValueError("缺少 Content-Length")
+        # 负数会使 rfile.read 一直读到连接关闭
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise ValueError(f"Content-Length 无效: {self.headers.get('Content-Length')}")
+        if length > limit:
+            raise RequestTooLarge()
+        return self.rfile.read(length)
+
+    def extract_upload(self, body):
+        """从 multipart/form-data 中取出上传的文件，其他类型直接返回请求体"""
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.lower().startswith('multipart/form-data'):
+            if not body:
+                raise ValueError("请求体为空")
+            return body
+
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin1') + b'\r\n\r\n' + body)
+        for part in message.iter_parts():
+            if part.get_filename() or part.get_param('name', header='content-disposition') == 'file':
+                return part.get_payload(decode=True)
+        raise ValueError("multipart 请求中没有上传文件")
+
+    def send_body(self, status, content, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_error_text(self, status, message, headers=None):
+        self.send_body(status, (message + '\n').encode('utf-8'), 'text/plain; charset=utf-8', headers)
+
+class ConversionServerMixin:
+    """两种监听方式共用的工作池和限流设置"""
+
+    daemon_threads = True
+
+    def setup_pool(self, workers, queue_size, max_request_size, use_threads=False, backend=None):
+        self.max_request_size = max_request_size
+        self.backend = backend
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        if use_threads:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        # 提前启动并预热所有工作进程
+        for future in [self.executor.submit(warm_up, backend) for _ in range(workers)]:
+            future.result()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+class TCPConversionServer(ConversionServerMixin, ThreadingHTTPServer):
+    """监听 localhost 端口"""
+
+class UnixConversionServer(ConversionServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听 Unix socket"""
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+def create_server(host='127.0.0.1', port=8765, unix_socket=None, workers=None,
+                  queue_size=16, max_request_size=64 << 20, use_threads=False, backend=None):
+    """
+    创建转换服务
+
+    Args:
+        host, port: TCP 监听地址（未指定 unix_socket 时使用）
+        unix_socket: Unix socket 路径
+        workers: 工作进程数，默认为CPU核数
+        queue_size: 除正在处理的请求外允许排队的请求数
+        max_request_size: 请求体大小上限（字节）
+        use_threads: 使用线程池代替进程池
+        backend: 解析后端名称，默认 etree
+    Returns:
+        server: 尚未开始 serve_forever 的服务对象
+    """
+    workers = workers or os.cpu_count() or 1
+    if unix_socket:
+        server = UnixConversionServer(unix_socket, ConversionHandler)
+    else:
+        server = TCPConversionServer((host, port), ConversionHandler)
+    server.setup_pool(workers, queue_size, max_request_size, use_threads, backend)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='常驻的 XML 转换服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口 (默认 8765)')
+    parser.add_argument('--unix', metavar='PATH', help='改为监听 Unix socket')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数 (默认CPU核数)')
+    parser.add_argument('--queue', type=int, default=16, help='允许排队的请求数 (默认 16)')
+    parser.add_argument('--max-size', default='64M', help='请求体大小上限 (默认 64M)')
+    parser.add_argument('--threads', action='store_true', help='使用线程池代替进程池')
+    parser.add_argument('--backend', choices=list(BACKENDS), default=DEFAULT_BACKEND,
+                        help=f'解析后端 (默认 {DEFAULT_BACKEND})')
+    args = parser.parse_args()
+
+    try:
+        server = create_server(args.host, args.port, args.unix, args.workers,
+                               args.queue, parse_size(args.max_size), args.threads, args.backend)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法启动服务: {str(e)}")
+        sys.exit(1)
+
+    address = args.unix if args.unix else f"http://{args.host}:{args.port}"
+    print(f"转换服务已启动: {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止服务...")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
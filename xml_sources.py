@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+XML输入源的扫描与读取
+
+除普通 .xml 文件外，还支持:
+    压缩文件    .xml.gz / .xml.bz2 / .xml.xz
+    归档文件    .zip / .tar / .tar.gz / .tgz / .tar.bz2 / .tbz2 / .tar.xz / .txz
+
+归档被视为与其同名（去掉扩展名）的目录，成员的相对路径挂在该目录下，
+因此输出路径沿用与解压后完全相同的第一级目录规则。成员直接以流的方式
+读取，不会解压到磁盘。
+"""
+
+import io
+import os
+import re
+import bz2
+import codecs
+import gzip
+import lzma
+import tarfile
+import zipfile
+
+# 单文件压缩格式
+COMPRESSED_SUFFIXES = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+}
+
+# 归档格式，按后缀长度从长到短匹配
+ZIP_SUFFIXES = ('.zip',)
+TAR_SUFFIXES = ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.tbz2', '.txz', '.tar')
+
+def compression_of(name):
+    """返回压缩后缀（如 '.gz'），非压缩的XML返回 ''，不是XML返回 None"""
+    lower = name.lower()
+    if lower.endswith('.xml'):
+        return ''
+    for suffix in COMPRESSED_SUFFIXES:
+        if lower.endswith('.xml' + suffix):
+            return suffix
+    return None
+
+def archive_kind(name):
+    """返回 ('zip' 或 'tar', 归档后缀)，不是归档返回 (None, '')"""
+    lower = name.lower()
+    for suffix in ZIP_SUFFIXES:
+        if lower.endswith(suffix):
+            return 'zip', suffix
+    for suffix in TAR_SUFFIXES:
+        if lower.endswith(suffix):
+            return 'tar', suffix
+    return None, ''
+
+def is_xml_input(name):
+    """文件名是否为XML、压缩的XML或归档"""
+    return compression_of(name) is not None or archive_kind(name)[0] is not None
+
+def _decompressed(f, compression):
+    """为压缩数据流套上解压层"""
+    if not compression:
+        return f
+    return COMPRESSED_SUFFIXES[compression](f, 'rb')
+
+class XmlInput:
+    """
+    一个待转换的XML输入
+
+    Attributes:
+        path: 文件系统中的文件（普通文件、压缩文件或归档）
+        member: 归档成员名，不在归档中时为 None
+        kind: 'file'、'zip' 或 'tar'
+        compression: 压缩后缀，未压缩为 ''
+        base_dir: 扫描的根目录
+        rel_path: 相对于根目录的虚拟路径，总是以 .xml 结尾
+        size: 压缩前大小（已知时），否则为文件大小
+    """
+
+    __slots__ = ('path', 'member', 'kind', 'compression', 'base_dir', 'rel_path', 'size')
+
+    def __init__(self, path, base_dir, rel_path, kind='file', member=None, compression='', size=0):
+        self.path = path
+        self.member = member
+        self.kind = kind
+        self.compression = compression
+        self.base_dir = base_dir
+        self.rel_path = rel_path
+        self.size = size
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"XmlInput({self.display_name!r})"
+
+    @property
+    def display_name(self):
+        """用于日志输出的名称"""
+        if self.member is None:
+            return self.path
+        return f"{self.path}:{self.member}"
+
+    @property
+    def virtual_path(self):
+        """解压后该输入所在的路径"""
+        return os.path.join(self.base_dir, self.rel_path)
+
+    @property
+    def sequential(self):
+        """
+        是否只能顺序读取
+
+        tar 成员没有索引，随机读取一个成员需要从头解压整个归档，
+        因此应由 TarStreamReader 在一次顺序扫描中读出。
+        """
+        return self.kind == 'tar'
+
+    def open(self):
+        """以二进制流方式打开（自动解压）"""
+        if self.kind == 'zip':
+            archive = zipfile.ZipFile(self.path)
+            return _ArchiveMemberStream(_decompressed(archive.open(self.member), self.compression), archive)
+        if self.kind == 'tar':
+            archive = tarfile.open(self.path)
+            member = archive.extractfile(self.member)
+            return _ArchiveMemberStream(_decompressed(member, self.compression), archive)
+        return _decompressed(open(self.path, 'rb'), self.compression)
+
+    def read_bytes(self):
+        """读取全部（解压后的）内容"""
+        with self.open() as f:
+            return f.read()
+
+class _ArchiveMemberStream(io.BufferedIOBase):
+    """归档成员流，关闭时一并关闭归档"""
+
+    def __init__(self, stream, archive):
+        self._stream = stream
+        self._archive = archive
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+    def read1(self, size=-1):
+        return self._stream.read(size)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+            self._archive.close()
+        super().close()
+
+def _archive_stem(name, suffix):
+    return name[:len(name) - len(suffix)]
+
+def _member_inputs(path, base_dir, rel_dir, file_name, kind, suffix):
+    """列出归档中的XML成员"""
+    virtual_dir = os.path.join(rel_dir, _archive_stem(file_name, suffix))
+    inputs = []
+
+    if kind == 'zip':
+        with zipfile.ZipFile(path) as archive:
+            members = [(info.filename, info.file_size) for info in archive.infolist() if not info.is_dir()]
+    else:
+        # 流式读取成员头，只需顺序解压一遍
+        with tarfile.open(path, 'r|*') as archive:
+            members = [(info.name, info.size) for info in archive if info.isfile()]
+
+    for name, size in members:
+        compression = compression_of(name)
+        if compression is None:
+            continue
+        member_path = name.strip('/').replace('/', os.sep)
+        if compression:
+            member_path = member_path[:-len(compression)]
+        rel_path = os.path.normpath(os.path.join(virtual_dir, member_path))
+        inputs.append(XmlInput(path, base_dir, rel_path, kind, name, compression, size))
+    return inputs
+
+def inputs_in_directory(root, files, base_dir):
+    """
+    将 os.walk 产出的一个目录中的文件转换为XML输入列表
+
+    Args:
+        root: 当前目录
+        files: 当前目录中的文件名
+        base_dir: 扫描的根目录
+    Returns:
+        inputs: XmlInput 列表，顺序与 files 一致，归档成员按归档内顺序展开
+    """
+    rel_dir = os.path.relpath(root, base_dir)
+    if rel_dir == '.':
+        rel_dir = ''
+    inputs = []
+
+    for file_name in files:
+        path = os.path.join(root, file_name)
+        compression = compression_of(file_name)
+        if compression is not None:
+            rel_path = os.path.join(rel_dir, file_name[:len(file_name) - len(compression)])
+            inputs.append(XmlInput(path, base_dir, rel_path, 'file', None, compression,
+                                   os.path.getsize(path)))
+            continue
+
+        kind, suffix = archive_kind(file_name)
+        if kind is not None:
+            try:
+                inputs.extend(_member_inputs(path, base_dir, rel_dir, file_name, kind, suffix))
+            except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError) as e:
+                print(f"警告: 无法读取归档 {path}: {str(e)}")
+
+    return inputs
+
+def scan_inputs(input_dir):
+    """递归扫描目录下所有XML输入（包括压缩文件和归档成员）"""
+    inputs = []
+    for root, dirs, files in os.walk(input_dir):
+        inputs.extend(inputs_in_directory(root, files, input_dir))
+    return inputs
+
+def group_by_directory(inputs):
+    """按虚拟目录对输入分组，保持扫描顺序"""
+    groups = {}
+    for xml_input in inputs:
+        groups.setdefault(os.path.dirname(xml_input.rel_path), []).append(xml_input)
+    return groups
+
+def open_input(source):
+    """
+    以二进制流方式打开输入源
+
+    Args:
+        source: XmlInput 或文件路径（.gz/.bz2/.xz 会自动解压）
+    """
+    if isinstance(source, XmlInput):
+        return source.open()
+    compression = compression_of(os.fspath(source)) or ''
+    return _decompressed(open(source, 'rb'), compression)
+
+def read_input(source):
+    """
+    读取输入源的全部内容
+
+    Args:
+        source: XmlInput、文件路径或已读取的字节内容
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    with open_input(source) as f:
+        return f.read()
+
+class TarStreamReader:
+    """
+    在一次顺序扫描中依次读取同一 tar 归档中的多个成员
+
+    成员需按归档内顺序请求；若请求的成员已被跳过，则重新打开归档。
+    """
+
+    def __init__(self):
+        self.path = None
+        self.archive = None
+
+    def _reopen(self, path):
+        self.close()
+        self.path = path
+        self.archive = tarfile.open(path, 'r|*')
+
+    def read(self, xml_input):
+        """读取 tar 成员的（解压后的）内容"""
+        if self.path != xml_input.path:
+            self._reopen(xml_input.path)
+
+        for attempt in range(2):
+            # next() 从当前位置继续向后读取成员头
+            info = self.archive.next()
+            while info is not None:
+                if info.name == xml_input.member and info.isfile():
+                    data = self.archive.extractfile(info).read()
+                    if xml_input.compression:
+                        data = _decompressed(io.BytesIO(data), xml_input.compression).read()
+                    return data
+                info = self.archive.next()
+            self._reopen(xml_input.path)
+
+        raise FileNotFoundError(f"归档中找不到成员: {xml_input.display_name}")
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+        self.archive = None
+        self.path = None
+
+def load_sources(tasks):
+    """
+    按顺序为每个任务准备可以交给工作进程的数据源
+
+    可以随机读取的输入直接使用 XmlInput，由工作进程自行打开；
+    tar 成员在这里顺序读出字节内容，避免每个成员都从头解压归档。
+
+    Args:
+        tasks: 可迭代的任务，每个任务的第一项为 XmlInput
+    Yields:
+        (task, source)
+    """
+    reader = TarStreamReader()
+    try:
+        for task in tasks:
+            xml_input = task[0]
+            if xml_input.sequential:
+                yield task, reader.read(xml_input)
+            else:
+                yield task, xml_input
+    finally:
+        reader.close()
+
+# 数据块末尾可能被截断的字符引用（如 "&#x1"），需要留到下一块一起处理
+_PARTIAL_CHAR_REFERENCE = re.compile(r'&(#(x[0-9a-fA-F]*|[0-9]*)?)?$')
+
+class CleanedReader(io.BufferedIOBase):
+    """
+    边读取边解码、清理并重新编码为 UTF-8 的二进制流
+
+    用于代替"读入全部内容 -> 解码 -> 清理 -> 编码"的做法，内存占用只与
+    数据块大小有关。字符引用跨越数据块边界时会留到下一块一起清理。
+
+    解码失败时，从出错的位置起改用 encodings 中的下一个编码；与整体
+    回退相比，只有同时含有合法多字节字符和非法字节的文件结果不同。
+    """
+
+    def __init__(self, f, clean_text, encodings=('utf-8', 'latin1'), chunk_size=1 << 20):
+        """
+        Args:
+            f: 原始二进制流，关闭时一并关闭
+            clean_text: 对一段文本做清理的函数，只能依赖字符引用范围内的上下文
+            encodings: 依次尝试的编码，以 UTF-16 BOM 开头的数据直接按 UTF-16 解码
+            chunk_size: 每次从原始流读取的大小
+        """
+        self._f = f
+        self._clean_text = clean_text
+        self._encodings = list(encodings)
+        self._chunk_size = chunk_size
+        self._decoder = None
+        self._pending = ''
+        self._buffer = b''
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    @property
+    def encoding(self):
+        """当前使用的编码，开始读取前为 None"""
+        if self._decoder is None:
+            return None
+        return self._encodings[0]
+
+    def _decode(self, data, final):
+        if self._decoder is None:
+            if data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+                self._encodings.insert(0, 'utf-16')
+            self._decoder = codecs.getincrementaldecoder(self._encodings[0])()
+        try:
+            return self._decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            if len(self._encodings) == 1:
+                raise
+            # 出错之前的部分按当前编码解码，剩余部分换用下一个编码
+            text = e.object[:e.start].decode(self._encodings.pop(0))
+            self._decoder = codecs.getincrementaldecoder(self._encodings[0])()
+            return text + self._decode(e.object[e.start:], final)
+
+    def _fill(self):
+        data = self._f.read(self._chunk_size)
+        final = not data
+        text = self._pending + self._decode(data, final)
+        self._pending = ''
+        if not final:
+            partial = _PARTIAL_CHAR_REFERENCE.search(text)
+            if partial is not None:
+                self._pending = text[partial.start():]
+                text = text[:partial.start()]
+        self._buffer += self._clean_text(text).encode('utf-8')
+        self._eof = final
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._eof:
+                self._fill()
+            data, self._buffer = self._buffer, b''
+            return data
+        while len(self._buffer) < size and not self._eof:
+            self._fill()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read1(self, size=-1):
+        return self.read(size)
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        super().close()
+
+def open_cleaned(source, clean_text, encodings=('utf-8', 'latin1')):
+    """
+    以流的方式打开输入源，读取时逐块解码、清理并重新编码为 UTF-8
+
+    Args:
+        source: XmlInput、文件路径或已读取的字节内容
+        clean_text: 对一段文本做清理的函数
+        encodings: 依次尝试的编码
+    Returns:
+        CleanedReader
+    """
+    if isinstance(source, (bytes, bytearray)):
+        raw = io.BytesIO(source)
+    else:
+        raw = open_input(source)
+    return CleanedReader(raw, clean_text, encodings)
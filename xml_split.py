@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+把单个大文件的 DeviceCollection 拆分为多段并行解析
+
+先扫描一遍原始字节，找出 DeviceCollection 中各个 Device 的起止位置，
+再把连续的若干个设备划为一段。每段在工作进程中重新组成一个完整的
+文档解析：
+
+    原文件开头到 <DeviceCollection ...> 为止（XML声明、DOCTYPE、根元素）
+    + 本段的字节
+    + 原文件从 </DeviceCollection> 起到结尾
+
+各段拼接起来正好是原来 DeviceCollection 的全部内容，因此按段的顺序
+合并结果与整体解析完全相同。每段都带有原来的XML声明和序言，编码
+处理和实体检查与整体解析一样逐段进行。段中的解析错误换算为原文件
+中的行号和列号后再抛出。
+
+只在能确定拆分点是 DeviceCollection 的直接子元素 Device 时才拆分：
+两个设备之间只能有空白和注释，出现其他标记后不再拆分。无法拆分的
+输入（压缩文件、归档成员、UTF-16 编码、找不到设备集合、只有一个
+设备、序言格式错误等）返回 None，由调用方按原来的方式整体处理，
+错误信息也与整体处理相同。
+"""
+
+import re
+import mmap
+import pyexpat
+import xml.etree.ElementTree as ET
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+from xml_backends import PROLOG_CHUNK_SIZE, EntityError, refuse_entities
+from xml_sources import compression_of
+
+# 每个工作进程平均分到的段数，段数多于进程数时各进程的负载更均衡
+SEGMENTS_PER_JOB = 4
+
+# 换算错误位置时读取原文件的数据块大小
+_COUNT_CHUNK_SIZE = 1 << 20
+
+# ParseError 信息中的位置
+_ERROR_POSITION = re.compile(r'line \d+, column \d+')
+
+# DeviceCollection 中的 Device 标签，跳过注释、CDATA 和处理指令中的内容；
+# 属性值中可以出现 '>'，按引号匹配
+_DEVICE_TAGS = re.compile(rb'<(?:!--.*?-->|!\[CDATA\[.*?\]\]>|\?.*?\?>|(/)Device\s*>|'
+                          rb'Device(?=[\s/>])(?:[^>"\']|"[^"]*"|\'[^\']*\')*>|/DeviceCollection\s*>)', re.S)
+_START_TAG = re.compile(rb'<[^\s/>]+(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+_GAP = re.compile(rb'(?:\s|<!--.*?-->)*', re.S)
+
+class _CollectionReached(Exception):
+    """到达 DeviceCollection 的开始标签"""
+
+class SplitLayout:
+    """
+    可拆分输入的布局
+
+    Attributes:
+        path: 输入文件路径
+        header_end: DeviceCollection 开始标签之后的位置
+        footer_start: DeviceCollection 结束标签的位置
+        boundaries: 可以拆分的位置（各直接子元素 Device 的开始位置），递增
+        complete: 是否除第一个设备外每个设备的开始位置都在 boundaries 中，
+            即按 boundaries 切开的每一段正好包含一个设备
+    """
+
+    def __init__(self, path, header_end, footer_start, boundaries, complete=False):
+        self.path = path
+        self.header_end = header_end
+        self.footer_start = footer_start
+        self.boundaries = boundaries
+        self.complete = complete
+
+    def segments(self, parts):
+        """
+        把 DeviceCollection 的内容按字节数大致均分为不超过 parts 段
+
+        Returns:
+            [(起始位置, 结束位置), ...]，首尾相接，覆盖 header_end 到 footer_start
+        """
+        target = (self.footer_start - self.header_end) / max(parts, 1)
+        segments = []
+        start = self.header_end
+        for boundary in self.boundaries:
+            if boundary - start >= target:
+                segments.append((start, boundary))
+                start = boundary
+        segments.append((start, self.footer_start))
+        return segments
+
+def _collection_start(data):
+    """
+    用 expat 解析序言和根元素开头，找到根元素下第一个 DeviceCollection 的开始标签
+
+    Returns:
+        开始标签的位置，找不到时为 None
+    Raises:
+        EntityError: 声明了实体
+    """
+    depth = 0
+    position = None
+
+    def start(tag, attrs):
+        nonlocal depth, position
+        depth += 1
+        if depth == 2 and tag == 'DeviceCollection':
+            position = parser.CurrentByteIndex
+            raise _CollectionReached
+
+    def end(tag):
+        nonlocal depth
+        depth -= 1
+
+    parser = pyexpat.ParserCreate()
+    refuse_entities(parser)
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    try:
+        for offset in range(0, len(data), PROLOG_CHUNK_SIZE):
+            parser.Parse(data[offset:offset + PROLOG_CHUNK_SIZE], False)
+        parser.Parse(b'', True)
+    except _CollectionReached:
+        return position
+    except pyexpat.ExpatError:
+        return None
+    return None
+
+def scan_layout(data, path=None):
+    """
+    扫描文档字节，找出可以拆分的位置
+
+    Args:
+        data: 文档的 bytes 或 mmap
+        path: 输入文件路径，记录在布局中
+    Returns:
+        SplitLayout，不能拆分时为 None
+    Raises:
+        EntityError: 声明了实体
+    """
+    # 扫描按 ASCII 字节匹配标签，不适用于 UTF-16
+    if data[:2] in (b'\xff\xfe', b'\xfe\xff') or data[:2] in (b'<\x00', b'\x00<'):
+        return None
+    position = _collection_start(data)
+    if position is None:
+        return None
+    tag = _START_TAG.match(data, position)
+    if tag is None or tag.group().endswith(b'/>'):
+        return None
+    header_end = tag.end()
+
+    boundaries = []
+    depth = 0
+    clean = True
+    previous_end = header_end
+    for match in _DEVICE_TAGS.finditer(data, header_end):
+        text = match.group()
+        if text.startswith((b'<!', b'<?')):
+            continue
+        if text.startswith(b'</DeviceCollection'):
+            if depth == 0:
+                if len(boundaries) < 2:
+                    return None
+                # 第一个设备之前不拆分
+                return SplitLayout(path, header_end, match.start(), boundaries[1:], clean)
+            continue
+        if match.group(1):
+            depth -= 1
+            if depth == 0:
+                previous_end = match.end()
+            continue
+        if depth == 0:
+            # 与上一个设备之间只有空白和注释时，这个 Device 仍是 DeviceCollection 的直接子元素
+            clean = clean and _GAP.fullmatch(data, previous_end, match.start()) is not None
+            if clean:
+                boundaries.append(match.start())
+        if text.endswith(b'/>'):
+            if depth == 0:
+                previous_end = match.end()
+        else:
+            depth += 1
+    return None
+
+def split_layout(source):
+    """
+    扫描输入文件的布局
+
+    Args:
+        source: 输入源；只有未压缩的文件路径可以拆分
+    Returns:
+        SplitLayout，不能拆分时为 None
+    """
+    if not isinstance(source, str) or compression_of(source):
+        return None
+    try:
+        with open(source, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return scan_layout(data, source)
+    except (OSError, ValueError, EntityError):
+        # 空文件无法映射；实体等错误留给整体处理报告
+        return None
+
+def read_segment(path, header_end, footer_start, start, end):
+    """读取一段设备，并补上原文件的开头和结尾组成完整的文档"""
+    with open(path, 'rb') as f:
+        header = f.read(header_end)
+        f.seek(start)
+        body = f.read(end - start)
+        f.seek(footer_start)
+        footer = f.read()
+    return header + body + footer
+
+def _text_length(data):
+    """字节数据的字符数，与 expat 的列号一致（无效字节各算一个字符）"""
+    return len(data.decode('utf-8', 'surrogateescape'))
+
+def _original_position(path, header_end, footer_start, segment, document, position):
+    """
+    把段文档中的 (行, 列) 换算为原文件中的 (行, 列)
+
+    Args:
+        path, header_end, footer_start: 见 SplitLayout
+        segment: 段的 (起始位置, 结束位置)
+        document: read_segment 组成的段文档
+        position: expat 报告的位置，行号从 1 开始，列号为该行开头起的字符数
+    """
+    line, column = position
+    line_start = 0
+    for _ in range(line - 1):
+        line_start = document.index(b'\n', line_start) + 1
+    line_end = document.find(b'\n', line_start)
+    text = document[line_start:line_end if line_end >= 0 else len(document)].decode('utf-8', 'surrogateescape')
+    offset = line_start + len(text[:column].encode('utf-8', 'surrogateescape'))
+
+    # 段文档由原文件的开头、本段和结尾三部分组成
+    start, end = segment
+    if offset >= header_end + end - start:
+        offset = footer_start + offset - (header_end + end - start)
+    elif offset >= header_end:
+        offset = start + offset - header_end
+
+    lines = 1
+    tail = b''
+    with open(path, 'rb') as f:
+        remaining = offset
+        while remaining > 0:
+            chunk = f.read(min(_COUNT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            newlines = chunk.count(b'\n')
+            if newlines:
+                lines += newlines
+                tail = chunk[chunk.rindex(b'\n') + 1:]
+            else:
+                tail += chunk
+    return lines, _text_length(tail)
+
+def _run_segment(work, path, header_end, footer_start, segment):
+    document = read_segment(path, header_end, footer_start, *segment)
+    try:
+        return work(document)
+    except ET.ParseError as e:
+        if getattr(e, 'position', None) is None:
+            raise
+        # 段文档中的位置对调用方没有意义，换算为原文件中的位置
+        line, column = _original_position(path, header_end, footer_start, segment, document, e.position)
+        error = type(e)(_ERROR_POSITION.sub(f'line {line}, column {column}', str(e)))
+        error.code, error.position = getattr(e, 'code', None), (line, column)
+        raise error from None
+
+def map_segments(layout, work, jobs):
+    """
+    在进程池中逐段执行 work
+
+    Args:
+        layout: SplitLayout
+        work: 模块级函数 work(document) -> 结果，document 为该段组成的文档字节
+        jobs: 并行进程数
+    Yields:
+        各段的结果，按文档顺序
+    """
+    segments = layout.segments(jobs * SEGMENTS_PER_JOB)
+    with ProcessPoolExecutor(max_workers=min(jobs, len(segments))) as executor:
+        yield from executor.map(_run_segment, repeat(work), repeat(layout.path), repeat(layout.header_end),
+                                repeat(layout.footer_start), segments)
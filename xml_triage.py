@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+转换前的预检扫描
+
+不做转换，只检查目录中每个XML输入能否被转换：是否能解压和解码、
+是否为格式正确的XML、是否有 DeviceCollection 以及其中是否有设备。
+检查以 expat 流式进行，默认在看到第一个 Device 时就结束，不构建树。
+
+扫描方式:
+    first     看到第一个 Device 即结束（最快，不统计设备数）
+    estimate  同 first，另外按字节统计 '<Device' 标签数作为设备数估计
+    count     完整解析，统计 DeviceCollection 下的设备数，并检查整个文档格式
+
+状态:
+    ok             有 DeviceCollection，且其中至少有一个 Device
+    empty          DeviceCollection 中没有 Device
+    no_collection  根元素下没有 DeviceCollection
+    malformed      XML格式错误，或声明了实体（拒绝处理）
+    unreadable     无法打开、解压或解码
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+from functools import partial
+from pyexpat import ExpatError, ParserCreate
+
+from batch_runner import run_conversions
+from csv_output import open_csv_output
+from xml2csv import remove_char_references
+from xml_backends import EntityError, refuse_entities
+from xml_sources import open_cleaned, open_input, scan_inputs
+
+TRIAGE_MODES = ('first', 'estimate', 'count')
+DEFAULT_TRIAGE_MODE = 'first'
+
+STATUSES = ('ok', 'empty', 'no_collection', 'malformed', 'unreadable')
+STATUS_LABELS = {
+    'ok': '可转换',
+    'empty': '没有设备',
+    'no_collection': '缺少 DeviceCollection',
+    'malformed': '格式错误',
+    'unreadable': '无法读取',
+}
+
+# 报告的列
+REPORT_FIELDS = ['status', 'path', 'size', 'declared_encoding', 'decoded_as', 'devices', 'message', 'seconds']
+
+# 提前结束的扫描每次只读取一小块
+SCAN_CHUNK_SIZE = 64 << 10
+
+# 估计设备数时统计的标签
+_DEVICE_TAG = re.compile(rb'<Device[\s/>]')
+
+class _StopScan(Exception):
+    """已经可以判断结果，提前结束解析"""
+
+class _StructureScan:
+    """跟踪根元素下第一个 DeviceCollection 及其中 Device 子元素的 expat 处理器"""
+
+    def __init__(self, count_devices):
+        self.count_devices = count_devices
+        self.depth = 0
+        self.collection_seen = False
+        self.in_collection = False
+        self.devices = 0
+        self.declared_encoding = None
+
+    def xml_decl(self, version, encoding, standalone):
+        self.declared_encoding = encoding
+
+    def start(self, name, attrs):
+        self.depth += 1
+        if self.depth == 2 and name == 'DeviceCollection' and not self.collection_seen:
+            self.collection_seen = self.in_collection = True
+        elif self.depth == 3 and self.in_collection and name == 'Device':
+            self.devices += 1
+            if not self.count_devices:
+                raise _StopScan
+
+    def end(self, name):
+        if self.depth == 2 and self.in_collection:
+            self.in_collection = False
+            if not self.count_devices:
+                raise _StopScan
+        self.depth -= 1
+
+def scan_structure(f, count_devices=False, chunk_size=SCAN_CHUNK_SIZE):
+    """
+    流式检查XML结构
+
+    Args:
+        f: UTF-8 编码的二进制流
+        count_devices: 是否解析整个文档并统计设备数
+        chunk_size: 每次读取的大小
+    Returns:
+        (status, devices, declared_encoding, message)，devices 在提前结束时为 None
+    Raises:
+        ExpatError: XML格式错误
+    """
+    scan = _StructureScan(count_devices)
+    parser = ParserCreate('utf-8')
+    refuse_entities(parser)
+    parser.XmlDeclHandler = scan.xml_decl
+    parser.StartElementHandler = scan.start
+    parser.EndElementHandler = scan.end
+
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            parser.Parse(chunk, not chunk)
+            if not chunk:
+                break
+    except _StopScan:
+        pass
+
+    devices = scan.devices if count_devices else None
+    if not scan.collection_seen:
+        return 'no_collection', devices, scan.declared_encoding, "找不到 DeviceCollection 元素"
+    if scan.devices == 0:
+        return 'empty', 0, scan.declared_encoding, "DeviceCollection 中没有设备数据"
+    return 'ok', devices, scan.declared_encoding, ""
+
+def estimate_devices(source):
+    """按字节统计解压后内容中的 '<Device' 标签数（UTF-16 等编码的输入不准确）"""
+    if isinstance(source, (bytes, bytearray)):
+        return len(_DEVICE_TAG.findall(source))
+    count = 0
+    tail = b''
+    with open_input(source) as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            data = tail + chunk
+            count += len(_DEVICE_TAG.findall(data))
+            # 一个匹配至少 8 字节，保留末尾 7 字节既能接上被截断的标签，也不会重复统计
+            tail = data[-7:]
+    return count
+
+def triage_file(source, output_path=None, mode=DEFAULT_TRIAGE_MODE):
+    """
+    检查单个XML输入
+
+    Args:
+        source: XmlInput、文件路径或已读取的字节内容（tar 成员）
+        output_path: 未使用，与 run_conversions 的转换函数接口一致
+        mode: 扫描方式，见 TRIAGE_MODES
+    Returns:
+        (bool, dict): (是否可转换, 报告项)
+    """
+    started = time.perf_counter()
+    entry = {'declared_encoding': None, 'decoded_as': None, 'devices': None}
+    f = None
+    try:
+        f = open_cleaned(source, remove_char_references)
+        status, devices, declared, message = scan_structure(f, mode == 'count')
+        entry['declared_encoding'] = declared
+        if mode == 'estimate' and status == 'ok':
+            devices = estimate_devices(source)
+    except ExpatError as e:
+        status, devices, message = 'malformed', None, f"XML格式错误: {str(e)}"
+    except EntityError as e:
+        status, devices, message = 'malformed', None, str(e)
+    except Exception as e:
+        status, devices, message = 'unreadable', None, f"读取失败: {str(e)}"
+    finally:
+        if f is not None:
+            entry['decoded_as'] = f.encoding
+            f.close()
+
+    entry.update(status=status, devices=devices, message=message,
+                 seconds=round(time.perf_counter() - started, 3))
+    return status == 'ok', entry
+
+def triage_directory(input_dir, mode=DEFAULT_TRIAGE_MODE, jobs=None):
+    """
+    并行检查目录下的所有XML输入
+
+    Args:
+        input_dir: 输入目录
+        mode: 扫描方式
+        jobs: 并行进程数，默认为CPU核数
+    Yields:
+        报告项，按完成顺序
+    """
+    jobs = jobs or os.cpu_count() or 1
+    tasks = ((xml_input, None) for xml_input in scan_inputs(input_dir))
+    convert = partial(triage_file, mode=mode)
+    for (xml_input, _), success, entry in run_conversions(tasks, convert, jobs):
+        if not isinstance(entry, dict):
+            # 工作进程中的异常
+            entry = {'status': 'unreadable', 'declared_encoding': None, 'decoded_as': None,
+                     'devices': None, 'message': entry, 'seconds': None}
+        entry['path'] = xml_input.display_name
+        entry['size'] = xml_input.size
+        yield entry
+
+def _report_order(entry):
+    return STATUSES.index(entry['status']), entry['path']
+
+def write_json_report(entries, path, mode=DEFAULT_TRIAGE_MODE):
+    """写出按状态分组的JSON报告"""
+    groups = {status: [] for status in STATUSES}
+    for entry in sorted(entries, key=_report_order):
+        groups[entry['status']].append({field: entry[field] for field in REPORT_FIELDS if field != 'status'})
+    report = {
+        'mode': mode,
+        'summary': {status: len(items) for status, items in groups.items()},
+        'groups': groups,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+def write_csv_report(entries, path):
+    """写出按状态排序的CSV报告"""
+    with open_csv_output(path) as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(entries, key=_report_order))
+
+def main():
+    parser = argparse.ArgumentParser(description='转换前检查目录中的XML文件')
+    parser.add_argument('input_dir', help='输入目录')
+    parser.add_argument('--mode', choices=TRIAGE_MODES, default=DEFAULT_TRIAGE_MODE,
+                        help='扫描方式：first 看到第一个设备即结束，estimate 另外估计设备数，'
+                             'count 完整解析并统计设备数 (默认 first)')
+    parser.add_argument('--jobs', type=int, default=None, help='并行进程数 (默认为CPU核数)')
+    parser.add_argument('--json', default=None, help='JSON报告文件')
+    parser.add_argument('--csv', default=None, help='CSV报告文件')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input_dir):
+        print(f"错误: 输入目录 '{args.input_dir}' 不存在")
+        sys.exit(1)
+
+    started = time.perf_counter()
+    entries = []
+    for entry in triage_directory(args.input_dir, args.mode, args.jobs):
+        entries.append(entry)
+        if entry['status'] != 'ok':
+            print(f"✗ [{STATUS_LABELS[entry['status']]}] {entry['path']}: {entry['message']}")
+
+    print("\n" + "=" * 50)
+    print(f"检查完成，共 {len(entries)} 个文件，用时 {time.perf_counter() - started:.1f} 秒")
+    for status in STATUSES:
+        count = sum(1 for entry in entries if entry['status'] == status)
+        if count:
+            print(f"{STATUS_LABELS[status]}: {count}")
+    if args.mode != 'first':
+        total = sum(entry['devices'] or 0 for entry in entries)
+        label = '设备数估计' if args.mode == 'estimate' else '设备总数'
+        print(f"{label}: {total}")
+
+    if args.json:
+        write_json_report(entries, args.json, args.mode)
+        print(f"JSON报告: {args.json}")
+    if args.csv:
+        write_csv_report(entries, args.csv)
+        print(f"CSV报告: {args.csv}")
+
+if __name__ == "__main__":
+    main()